@@ -0,0 +1,527 @@
+import sys
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import subprocess
+import tracemalloc
+import multiprocessing
+
+from aiohttp import web
+
+from reddit import get_subreddits, CrawlMetrics, RequestScheduler
+from telegram_bot import RedditLoop, _get_reddit_data
+
+# Scenarios benchmarked: 'full' reads whole listings of `--limit` threads, and
+# 'cutoff' reads listings of several pages in which the minimum score is
+# reached within the first page (so any request for a later page is wasted)
+SCENARIOS = ('full', 'cutoff')
+
+# Minimum score of the 'cutoff' scenario (the default of the crawler and the
+# minimum score used by the bot), and number of threads in its listings
+CUTOFF_MIN_SCORE = 5000
+CUTOFF_TOTAL = 300
+
+# ------------------------------------------------------------------------------
+def make_listing(subreddit, offset, count, total, payload, top_score=100000):
+    '''Generates a synthetic page of the top threads listing of a subreddit.
+
+    Parameters
+    ----------
+        subreddit (str). The name of the subreddit.
+
+        offset (int). The position of the first thread of the page.
+
+        count (int). The number of threads in the page.
+
+        total (int). The total number of threads in the listing (so the last
+        page has no cursor to a next page).
+
+        payload (int). The size (in characters) of the text of each thread,
+        which is not used by the crawler but is part of the response.
+
+        top_score (int). The score of the first thread of the listing (the
+        score goes down by one at each thread). The default is 100000.
+
+    Returns
+    -------
+        listing (dict). The listing, in the same format of the reddit server.
+    '''
+    end = min(offset + count, total)
+    children = []
+    for index in range(offset, end):
+        children.append({
+            'kind': 't3',
+            'data': {
+                'subreddit': subreddit,
+                'selftext': 'x' * payload,
+                'title': f'Thread {index} of {subreddit}',
+                'score': top_score - index,
+                'ups': top_score - index,
+                'downs': 0,
+                'author': f'author{index}',
+                'num_comments': index,
+                'permalink': f'/r/{subreddit}/comments/{index}/',
+                'url': f'https://example.com/{subreddit}/{index}',
+                'name': f't3_{index}'
+            }
+        })
+
+    # The cursor comes before the threads, as in the responses of the reddit
+    # server (so the crawler can find it before reading the whole page)
+    return {
+        'kind': 'Listing',
+        'data': {
+            'after': f't3_{end}' if end < total else None,
+            'dist': len(children),
+            'modhash': '',
+            'children': children,
+            'before': None
+        }
+    }
+
+# ------------------------------------------------------------------------------
+def _serve(port, latency, payload, error_rate, total, cutoff, listing_path,
+           seed, ready):
+    '''Runs the local reddit server (in a separate process, so it does not
+    compete with the crawler for the event loop nor count in its memory).
+
+    Parameters
+    ----------
+        port (int). The port to listen on (0 for any free port).
+
+        latency (float). The delay (in seconds) before each response.
+
+        payload (int). The size of the text of each synthetic thread.
+
+        error_rate (float). The fraction of the requests answered with an
+        error (HTTP status 503).
+
+        total (int). The number of threads in each synthetic listing of the
+        'full' scenario.
+
+        cutoff (int). The number of threads above the minimum score in the
+        synthetic listings of the 'cutoff' scenario (whose subreddits are
+        named 'cutoff<number>').
+
+        listing_path (str). The path of a recorded `top.json` response to
+        serve for all subreddits instead of the synthetic listings, or None.
+
+        seed (int). The seed for the random generator of the errors.
+
+        ready (multiprocessing.Connection). The pipe to send the port to when
+        the server is ready.
+    '''
+    rand = random.Random(seed)
+    recorded = None
+    if listing_path is not None:
+        with open(listing_path, mode='rb') as file:
+            recorded = file.read()
+
+    async def top(request):
+        await asyncio.sleep(latency)
+        if rand.random() < error_rate:
+            return web.Response(status=503)
+        if recorded is not None:
+            return web.Response(body=recorded, content_type='application/json')
+
+        subreddit = request.match_info['subreddit']
+        count = min(int(request.query.get('limit', 25)), 100)
+        after = request.query.get('after')
+        offset = int(after[3:]) if after else 0
+        if subreddit.startswith('cutoff'):
+            listing = make_listing(subreddit, offset, count, CUTOFF_TOTAL,
+                                   payload, CUTOFF_MIN_SCORE + cutoff - 1)
+        else:
+            listing = make_listing(subreddit, offset, count, total, payload)
+        return web.json_response(listing)
+
+    async def start():
+        app = web.Application()
+        app.router.add_get('/r/{subreddit}/top.json', top)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', port)
+        await site.start()
+        ready.send(runner.addresses[0][1])
+        await asyncio.Event().wait()
+
+    asyncio.run(start())
+
+# ------------------------------------------------------------------------------
+def start_server(args):
+    '''Starts the local reddit server in a separate process.
+
+    Parameters
+    ----------
+        args (object). The parsed command line arguments.
+
+    Returns
+    -------
+        process (multiprocessing.Process). The process of the server.
+
+        base_url (str). The base url of the server.
+    '''
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_serve, daemon=True,
+                                      args=(args.port, args.latency / 1000,
+                                            args.payload, args.error_rate,
+                                            args.limit, args.cutoff,
+                                            args.listing, 0, sender))
+    process.start()
+    port = receiver.recv()
+    return process, f'http://127.0.0.1:{port}'
+
+# ------------------------------------------------------------------------------
+def run_crawl(mode, scenario, subreddits, args, base_url, metrics=None):
+    '''Crawls the given subreddits once.
+
+    Parameters
+    ----------
+        mode (str). 'crawler' to call `reddit.get_subreddits` directly, or
+        'bot' to go through the bot path (`telegram_bot._get_reddit_data`, with
+        the query parameters of the bot, in a `RedditLoop` started before the
+        crawl).
+
+        scenario (str). The scenario (one of `SCENARIOS`). In the 'cutoff'
+        scenario the crawler asks for all the threads of the listings with a
+        minimum score of `CUTOFF_MIN_SCORE`.
+
+        subreddits (list). The names of the subreddits to crawl.
+
+        args (object). The parsed command line arguments.
+
+        base_url (str). The base url of the local server.
+
+        metrics (reddit.CrawlMetrics). The metrics to record the requests in.
+        The default is None.
+
+    Returns
+    -------
+        seconds (float). The time spent crawling.
+    '''
+    # The benchmark measures the crawler, so the failed requests are retried
+    # right away
+    scheduler = RequestScheduler(backoff_base=0)
+
+    if mode == 'crawler':
+        if scenario == 'cutoff':
+            limit, min_score = CUTOFF_TOTAL, CUTOFF_MIN_SCORE
+        else:
+            limit, min_score = args.limit, args.min_score
+        begin = time.perf_counter()
+        asyncio.run(get_subreddits(subreddits, limit, min_score,
+                                   args.concurrency, scheduler=scheduler,
+                                   metrics=metrics, base_url=base_url))
+        return time.perf_counter() - begin
+
+    # The bot keeps its event loop and HTTP session for as long as it runs, so
+    # their creation is not part of the crawl
+    reddit_loop = RedditLoop(metrics=metrics, base_url=base_url)
+    reddit_loop.scheduler = scheduler
+    try:
+        begin = time.perf_counter()
+        _get_reddit_data(subreddits, reddit_loop)
+        return time.perf_counter() - begin
+    finally:
+        reddit_loop.close()
+
+# ------------------------------------------------------------------------------
+def run_benchmark(mode, scenario, count, args, base_url):
+    '''Runs the benchmark of a crawl of the given number of subreddits.
+
+    Parameters
+    ----------
+        mode (str). The path to benchmark (refer to `run_crawl`).
+
+        scenario (str). The scenario to benchmark (one of `SCENARIOS`).
+
+        count (int). The number of subreddits to crawl.
+
+        args (object). The parsed command line arguments.
+
+        base_url (str). The base url of the local server.
+
+    Returns
+    -------
+        result (dict). The results of the benchmark: the best time of the
+        crawl, the requests per second and per subreddit (which shows the
+        pages requested in vain in the 'cutoff' scenario), the p50 and p99 of
+        the latency of the requests (in seconds), and the peak memory
+        allocated while crawling (in bytes).
+    '''
+    prefix = 'cutoff' if scenario == 'cutoff' else 'bench'
+    subreddits = [f'{prefix}{i}' for i in range(count)]
+
+    best = None
+    for _ in range(args.repeat):
+        metrics = CrawlMetrics()
+        seconds = run_crawl(mode, scenario, subreddits, args, base_url,
+                            metrics)
+        if best is None or seconds < best[0]:
+            best = (seconds, metrics)
+
+    seconds, metrics = best
+    requests = sum(sum(entry['requests'].values())
+                   for entry in metrics.summary().values())
+    latency = metrics.overall('ttfb') or {'p50': None, 'p99': None}
+
+    # The peak memory comes from an extra crawl, out of the timed ones
+    tracemalloc.start()
+    run_crawl(mode, scenario, subreddits, args, base_url)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'mode': mode,
+        'scenario': scenario,
+        'subreddits': count,
+        'seconds': seconds,
+        'requests': requests,
+        'requests_per_second': requests / seconds if seconds > 0 else None,
+        'requests_per_subreddit': requests / count,
+        'latency_p50': latency['p50'],
+        'latency_p99': latency['p99'],
+        'peak_memory': peak
+    }
+
+# ------------------------------------------------------------------------------
+def _get_commit():
+    '''Gets the hash of the current git commit, if available.
+
+    Returns
+    -------
+        commit (str). The hash of the commit, or None if it can not be found.
+    '''
+    try:
+        folder = os.path.dirname(os.path.abspath(__file__))
+        output = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=folder,
+                                capture_output=True, text=True, check=True)
+        return output.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# ------------------------------------------------------------------------------
+def compare(report, baseline):
+    '''Prints the requests per second of each benchmark in the given report
+    relative to the same benchmark in a baseline report.
+
+    Parameters
+    ----------
+        report (dict). The report of the current run.
+
+        baseline (dict). The report to compare to (e.g. from another commit).
+    '''
+    def key(result):
+        return (result['mode'], result.get('scenario', 'full'),
+                result['subreddits'])
+
+    previous = {key(result): result for result in baseline['results']}
+    for result in report['results']:
+        old = previous.get(key(result))
+        if old is None or not old['requests_per_second']:
+            continue
+        ratio = result['requests_per_second'] / old['requests_per_second']
+        print(f'{result["mode"]:>8} {result["scenario"]:>6} '
+              f'subreddits={result["subreddits"]:<6} '
+              f'{result["requests_per_second"]:8.1f} req/s ({ratio:5.2f}x), '
+              f'{result["requests_per_subreddit"]:.2f} req/subreddit',
+              file=sys.stderr)
+
+# ------------------------------------------------------------------------------
+def main(argv):
+    '''Main entry function, called at the beginning of this script.
+
+    Parameters
+    ----------
+        argv (list). List of string arguments received from the command line.
+
+    Returns
+    -------
+        status (int). Status code to be returned to the command line. A negative
+        value indicates an error, and 0 indicates success.
+    '''
+    args = parseCommandLine(argv)
+
+    report = {
+        'commit': _get_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'server': {
+            'latency_ms': args.latency,
+            'payload': args.payload,
+            'error_rate': args.error_rate,
+            'listing': args.listing,
+            'cutoff': args.cutoff
+        },
+        'results': []
+    }
+
+    server, base_url = start_server(args)
+    try:
+        for mode in args.modes:
+            for scenario in args.scenarios:
+                for count in args.counts:
+                    result = run_benchmark(mode, scenario, count, args,
+                                           base_url)
+                    report['results'].append(result)
+    finally:
+        server.terminate()
+        server.join()
+
+    output = json.dumps(report, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, mode='w', encoding='utf-8') as file:
+            file.write(output)
+
+    if args.compare is not None:
+        with open(args.compare, mode='r', encoding='utf-8') as file:
+            compare(report, json.load(file))
+
+    return 0
+
+#---------------------------------------------
+def parseCommandLine(argv):
+    '''Parses the command line of this script.
+    This function uses the argparse package to handle the command line
+    arguments. In case of command line errors, the application will be
+    automatically terminated.
+
+    Parameters
+    ----------
+        argv (list). List of strings with the arguments received from the
+        command line.
+
+    Returns
+    -------
+        args (object). Object with the parsed arguments as attributes
+        (refer to the documentation of the argparse package for details).
+    '''
+    parser = argparse.ArgumentParser(description='Benchmarks the crawler '
+                                    'against a local stand-in of the reddit '
+                                    'server, at increasing numbers of '
+                                    'subreddits, reporting the results in '
+                                    'JSON.')
+
+    parser.add_argument('-n', '--counts', metavar='"value[;value;...]"',
+                        default='1;10;50;200',
+                        help='Semicolon-separated list of numbers of '
+                        'subreddits to crawl. The default is "1;10;50;200".')
+
+    parser.add_argument('-M', '--modes', metavar='"name[;name]"',
+                        default='crawler;bot',
+                        help='Semicolon-separated list of paths to benchmark: '
+                        'crawler (reddit.get_subreddits) and bot '
+                        '(telegram_bot._get_reddit_data, which uses the limit '
+                        'and minimum score of the bot). The default is both '
+                        'of them.')
+
+    parser.add_argument('-s', '--scenarios', metavar='"name[;name]"',
+                        default='full;cutoff',
+                        help='Semicolon-separated list of scenarios to '
+                        'benchmark: full (listings of --limit threads, all '
+                        'read) and cutoff (listings of 300 threads in which '
+                        'the minimum score of 5000 is reached within the '
+                        'first page, so only one request per subreddit is '
+                        'needed). The default is both of them.')
+
+    parser.add_argument('-k', '--cutoff', metavar='value', default=25,
+                        type=int, help='Number of threads above the minimum '
+                        'score in the listings of the cutoff scenario. The '
+                        'default value is 25.')
+
+    parser.add_argument('-l', '--limit', metavar='value', default=50, type=int,
+                        help='Number of threads in each listing (and limit of '
+                        'threads to get for each subreddit). The default value '
+                        'is 50.')
+
+    parser.add_argument('-m', '--min_score', metavar='value', default=0,
+                        type=int, help='Minimum score for the threads. The '
+                        'default value is 0 (i.e. all threads are read).')
+
+    parser.add_argument('-c', '--concurrency', metavar='value', default=8,
+                        type=int, help='Maximum number of subreddits queried at '
+                        'the same time. The default value is 8.')
+
+    parser.add_argument('-L', '--latency', metavar='ms', default=50,
+                        type=float, help='Latency of the server (in '
+                        'milliseconds) before each response. The default value '
+                        'is 50.')
+
+    parser.add_argument('-p', '--payload', metavar='chars', default=500,
+                        type=int, help='Size of the text of each synthetic '
+                        'thread (not used by the crawler, but read with the '
+                        'response). The default value is 500.')
+
+    parser.add_argument('-e', '--error_rate', metavar='value', default=0.0,
+                        type=float, help='Fraction of the requests answered '
+                        'with an error (HTTP 503), which the crawler retries. '
+                        'The default value is 0.')
+
+    parser.add_argument('-j', '--listing', metavar='path',
+                        help='Path of a recorded top.json response to serve '
+                        'for all subreddits, instead of the synthetic '
+                        'listings.')
+
+    parser.add_argument('-P', '--port', metavar='value', default=0, type=int,
+                        help='Port of the local server. The default is any free '
+                        'port.')
+
+    parser.add_argument('-r', '--repeat', metavar='value', default=3, type=int,
+                        help='Number of times each crawl is repeated (the best '
+                        'time is reported). The default value is 3.')
+
+    parser.add_argument('-o', '--output', metavar='path',
+                        help='Path of the file to write the JSON report to. If '
+                        'not given, the report is printed to the standard '
+                        'output.')
+
+    parser.add_argument('-C', '--compare', metavar='path',
+                        help='Path of a previous JSON report to compare the '
+                        'requests per second with (e.g. from another commit).')
+
+    args = parser.parse_args(argv)
+
+    try:
+        args.counts = [int(count) for count in args.counts.split(';')]
+    except ValueError:
+        parser.error('The numbers of subreddits must be integer numbers')
+    if min(args.counts) <= 0:
+        parser.error('The minimum number of subreddits is 1')
+
+    args.modes = args.modes.split(';')
+    for mode in args.modes:
+        if mode not in ['crawler', 'bot']:
+            parser.error(f'Unknown benchmark mode: {mode}')
+
+    args.scenarios = args.scenarios.split(';')
+    for scenario in args.scenarios:
+        if scenario not in SCENARIOS:
+            parser.error(f'Unknown benchmark scenario: {scenario}')
+
+    if not 0 < args.cutoff < 50:
+        parser.error('The cutoff must be between 1 and 49 (so it is within '
+                     'the first page of the bot)')
+
+    if args.limit <= 0:
+        parser.error('The minimum limit of threads is 1')
+
+    if args.concurrency <= 0:
+        parser.error('The minimum concurrency is 1')
+
+    if not 0 <= args.error_rate < 1:
+        parser.error('The error rate must be between 0 and 1 (exclusive)')
+
+    if args.repeat <= 0:
+        parser.error('The minimum number of repetitions is 1')
+
+    return args
+
+# ------------------------------------------------------------------------------
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
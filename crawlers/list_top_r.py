@@ -1,8 +1,10 @@
 import sys
+import json
 import argparse
 import asyncio
   
-from reddit import get_subreddits 
+from reddit import fetch_subreddits, iter_subreddits, CrawlMetrics
+from reddit import SnapshotStore
 
 # ------------------------------------------------------------------------------
 def main(argv):
@@ -18,36 +20,104 @@ def main(argv):
         value indicates an error, and 0 indicates success.
     '''
     args = parseCommandLine(argv)
-    data = asyncio.run(get_subreddits(args.subreddits, args.limit, args.min_score))
-    
-    print('=' * 80)
-    print(f'TOP THREADS ON REDDIT TODAY (limiting in {args.limit} threads with '
-          f'minimum score of {args.min_score})')
-    print('=' * 80)
-
-    for item in data:
-        print(f'SUBREDDIT: {item["subreddit"]}')
-        print('')
-
-        if len(item['threads']) > 0:
-            for thread in item['threads']:
-                print(f'\tURL: {thread["url"]}')
-                print(f'\tTITLE: {thread["title"]}')
-                print(f'\tSCORE: {thread["score"]}')
-                print(f'\tUP VOTES: {thread["ups"]}')
-                print(f'\tDOWN VOTES: {thread["downs"]}')
-                print(f'\tAUTHOR: {thread["author"]}')
-                print(f'\tNUMBER OF COMMENTS: {thread["num_comments"]}')
-                print(f'\tCOMMENTS URL: {thread["url_comments"]}')
-                print('')
+    metrics = CrawlMetrics() if args.metrics else None
+    store = SnapshotStore(args.snapshots) if args.snapshots else None
+
+    if args.format == 'ndjson':
+        print_item = print_ndjson
+    else:
+        print_item = print_text
+        print('=' * 80)
+        print(f'TOP THREADS ON REDDIT TODAY (limiting in {args.limit} threads '
+              f'with minimum score of {args.min_score})')
+        print('=' * 80)
+
+    # In the streaming mode each subreddit is printed as soon as its query
+    # finishes. Otherwise, they are printed in the given order after all the
+    # queries finish. The store is closed even if the queries fail (or are
+    # interrupted)
+    try:
+        if args.stream:
+            async def stream():
+                async for item in iter_subreddits(args.subreddits, args.limit,
+                                                  args.min_score,
+                                                  args.concurrency,
+                                                  metrics=metrics, store=store):
+                    print_item(item)
+                    sys.stdout.flush()
+            asyncio.run(stream())
         else:
-            print('\tThere are no threads in the query conditions (i.e. limit '
-                  'and minimum score)')
+            data = asyncio.run(fetch_subreddits(args.subreddits, args.limit,
+                                                args.min_score,
+                                                args.concurrency,
+                                                metrics=metrics, store=store))
+            for item in data:
+                print_item(item)
+    finally:
+        if store is not None:
+            store.close()
+
+    if args.format != 'ndjson':
+        print('=' * 80)
+
+    # The metrics go to the standard error, so they do not mix with the output
+    if metrics is not None:
+        print(metrics.format_summary(), file=sys.stderr)
+
+    return 0
+
+# ------------------------------------------------------------------------------
+def print_text(item):
+    '''Prints the data of a subreddit as human-readable text.
+
+    Parameters
+    ----------
+        item (reddit.SubredditResult). The data of the subreddit.
+    '''
+    print(f'SUBREDDIT: {item.subreddit}')
+    print('')
+
+    if item.error is not None:
+        print(f'\tFailed to query the subreddit ({item.error})')
+        print('')
+    elif len(item.threads) > 0:
+        for thread in item.threads:
+            print(f'\tURL: {thread.url}')
+            print(f'\tTITLE: {thread.title}')
+            print(f'\tSCORE: {thread.score}')
+            print(f'\tUP VOTES: {thread.ups}')
+            print(f'\tDOWN VOTES: {thread.downs}')
+            print(f'\tAUTHOR: {thread.author}')
+            print(f'\tNUMBER OF COMMENTS: {thread.num_comments}')
+            print(f'\tCOMMENTS URL: {thread.url_comments}')
             print('')
+    else:
+        print('\tThere are no threads in the query conditions (i.e. limit '
+              'and minimum score)')
+        print('')
 
-    print('=' * 80)
+# ------------------------------------------------------------------------------
+def print_ndjson(item):
+    '''Prints the data of a subreddit as newline-delimited JSON, with one
+    object per thread (with the name of the subreddit and the attributes of
+    the thread). The errors are printed to the standard error.
 
-    return 0
+    Parameters
+    ----------
+        item (reddit.SubredditResult). The data of the subreddit.
+    '''
+    if item.error is not None:
+        print(f'Failed to query the subreddit {item.subreddit} ({item.error})',
+              file=sys.stderr)
+        return
+
+    lines = []
+    for thread in item.threads:
+        record = {'subreddit': item.subreddit}
+        record.update(zip(thread._fields, thread))
+        lines.append(json.dumps(record, ensure_ascii=False))
+    if lines:
+        print('\n'.join(lines))
 
 #---------------------------------------------
 def parseCommandLine(argv):
@@ -89,12 +159,41 @@ def parseCommandLine(argv):
                         'acceptable value is 0 (case in which this argument is '
                         'disconsidered).')
 
+    parser.add_argument('-c', '--concurrency', metavar='value', default=8,
+                        type=int, help='Maximum number of subreddits queried at '
+                        'the same time. The default value is 8, and the minimum '
+                        'acceptable value is 1.')
+
+    parser.add_argument('-S', '--stream', action='store_true',
+                        help='Prints each subreddit as soon as its query '
+                        'finishes (i.e. in the order the queries finish), '
+                        'instead of waiting for all of them.')
+
+    parser.add_argument('-f', '--format', choices=['text', 'ndjson'],
+                        default='text', help='Output format: human-readable '
+                        'text, or newline-delimited JSON with one object per '
+                        'thread. The default is text.')
+
+    parser.add_argument('-M', '--metrics', action='store_true',
+                        help='Prints to the standard error a summary of the '
+                        'requests of each subreddit: number of requests, bytes '
+                        'received and time spent in each phase (DNS, connect, '
+                        'time to first byte, body, JSON parsing and filtering).')
+
+    parser.add_argument('-d', '--snapshots', metavar='path',
+                        help='Path of a SQLite database to keep the snapshots '
+                        'of the pages queried in. The pages that did not change '
+                        'since their snapshots are read from the database '
+                        'instead of downloaded again.')
 
     args = parser.parse_args()
 
     if args.limit <= 0:
         parser.error('The minimum limit of threads to get is 1')
 
+    if args.concurrency <= 0:
+        parser.error('The minimum concurrency is 1')
+
     args.subreddits = args.subreddits.split(';')
 
     return args
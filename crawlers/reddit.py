@@ -1,12 +1,186 @@
+import os
 import asyncio
 import aiohttp
 import json
+import re
+import time
+import random
+import codecs
+import sqlite3
+import threading
+from bisect import bisect_left
+from types import SimpleNamespace
+from collections import OrderedDict, namedtuple
+
+# Use the fastest JSON backend available to decode the responses (or each
+# thread of a listing, when they are parsed as they arrive)
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    try:
+        import ujson
+        _json_loads = ujson.loads
+    except ImportError:
+        _json_loads = json.loads
+
+# Base url of the reddit server
+BASE_URL = 'https://old.reddit.com'
+
+# Maximum number of threads that the reddit server returns in a single page
+PAGE_LIMIT = 100
+
+# Pattern of the cursor of the next page in the text of a listing
+_AFTER = re.compile(r'"after"\s*:\s*(?:null|"((?:[^"\\]|\\.)*)")')
+
+# Patterns and characters used to scan the children of a listing for their
+# boundaries. The pattern of the start of the next child (which can never
+# match in a string, where the quotes are escaped) also matches any prefix of
+# it, and the group is only matched by the whole of it
+_SKIP = re.compile(rb'[^{}"]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^{}"]*)*')
+_SEPARATOR = re.compile(rb'[\s,]*')
+_NEXT_CHILD = re.compile(rb'\s*(?:,\s*(?:\{\s*(?:"(?:k(?:i(?:n(?:d(")?)?)?)?)?'
+                         rb')?)?)?')
+_QUOTE = ord('"')
+_OPEN = ord('{')
+_END = ord(']')
+_BACKSLASH = ord('\\')
+
+# ==============================================================================
+class RedditError(Exception):
+    '''Base class of the errors in the queries to the reddit server.'''
+
+# ==============================================================================
+class RedditConnectionError(RedditError):
+    '''Error raised when the reddit server can not be reached (even after
+    retrying).'''
+
+# ==============================================================================
+class RedditHTTPError(RedditError):
+    '''Error raised when the reddit server answers with an error status.
+
+    Attributes
+    ----------
+        status (int). The HTTP status of the response.
+
+        url (str). The url of the request.
+    '''
+
+    # --------------------------------------------------------------------------
+    def __init__(self, status, url):
+        super().__init__(f'HTTP status {status} for {url}')
+        self.status = status
+        self.url = url
+
+# ==============================================================================
+class RedditRateLimitError(RedditHTTPError):
+    '''Error raised when the reddit server keeps refusing the requests due to
+    its rate limit (HTTP status 429), even after retrying.'''
+
+# ==============================================================================
+class _Record:
+    '''Mixin that gives a dictionary-like (read only) view to the named tuples
+    of the records, so `record['field']` works as in the dictionaries
+    previously returned.'''
+
+    __slots__ = ()
+
+    # --------------------------------------------------------------------------
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        return tuple.__getitem__(self, key)
+
+    # --------------------------------------------------------------------------
+    def get(self, key, default=None):
+        '''Gets the value of a field by its name, or the default value if
+        there is no field with that name.'''
+        return getattr(self, key, default) if key in self._fields else default
+
+    # --------------------------------------------------------------------------
+    def keys(self):
+        '''Gets the names of the fields.'''
+        return self._fields
+
+    # --------------------------------------------------------------------------
+    def items(self):
+        '''Gets the pairs of names and values of the fields.'''
+        return zip(self._fields, self)
+
+    # --------------------------------------------------------------------------
+    def to_dict(self):
+        '''Converts the record to a dictionary.'''
+        return dict(zip(self._fields, self))
+
+# ==============================================================================
+class Thread(_Record, namedtuple('Thread', ['url', 'title', 'score', 'ups',
+                                            'downs', 'author', 'num_comments',
+                                            'url_comments'])):
+    '''The data of a top thread of a subreddit.
+
+    Attributes
+    ----------
+        url (str). The url of the thread.
+
+        title (str). The title of the thread.
+
+        score (int). The score of the thread.
+
+        ups (int). The number of up votes in the thread.
+
+        downs (int). The number of down votes in the thread.
+
+        author (str). The name of the author of the thread.
+
+        num_comments (int). The number of comments in the thread.
+
+        url_comments (str). The url of the comments of the thread.
+    '''
+
+    __slots__ = ()
+
+# ==============================================================================
+class SubredditResult(_Record, namedtuple('SubredditResult',
+                                          ['subreddit', 'threads', 'error'])):
+    '''The result of the query of the top threads of a subreddit.
+
+    Attributes
+    ----------
+        subreddit (str). The name of the subreddit.
+
+        threads (tuple). The top threads of the subreddit (`Thread` records),
+        sorted by score. It is empty if the query failed.
+
+        error (str). The description of the error, if the query failed, or
+        None otherwise.
+    '''
+
+    __slots__ = ()
+
+    # --------------------------------------------------------------------------
+    def to_dict(self):
+        '''Converts the result to a dictionary (including its threads), as
+        returned by function `get_subreddits`.'''
+        return {
+            'subreddit': self.subreddit,
+            'threads': [thread.to_dict() for thread in self.threads],
+            'error': self.error
+        }
 
 # ------------------------------------------------------------------------------
-async def get_subreddits(subreddits, limit=50, min_score=5000):
+async def get_subreddits(subreddits, limit=50, min_score=5000, concurrency=8,
+                         client=None, cache=None, stream=True, scheduler=None,
+                         metrics=None, base_url=BASE_URL, store=None):
     '''Gets the top threads (up to the given limit and minimum score) for the
     given list of subreddits.
 
+    The subreddits are queried concurrently (up to the given number of
+    simultaneous requests), and a failure to query a subreddit does not stop
+    the others from being queried.
+
     Parameters
     ----------
         subreddits (list). List of strings with the names of the subreddits to
@@ -20,37 +194,1211 @@ async def get_subreddits(subreddits, limit=50, min_score=5000):
         (besides the reddit original indication from the top query). The default
         is 5000 and the minimum acceptable is 0.
 
+        concurrency (int). Maximum number of requests to the reddit server
+        running at the same time. The default is 8 and the minimum acceptable
+        is 1.
+
+        client (aiohttp.ClientSession). A HTTP asynchronous session running in
+        the same event loop of this call, to be used (and kept open) for the
+        queries, so its pool of connections can be reused by many calls. The
+        default is None, in which case a new session is opened and closed by
+        this call.
+
+        cache (ThreadCache). A cache of the top threads of the subreddits to
+        use. The default is None, meaning that no cache is used.
+
+        stream (bool). Indicates if the responses of the server are parsed as
+        they arrive (True) or only after they are completely read (False).
+        Refer to the documentation of function `_get_top_threads` for
+        details. The default is True.
+
+        scheduler (RequestScheduler). The scheduler that paces the requests
+        according to the rate limit of the server and retries the failed ones.
+        It should be shared by all calls using the same client. The default is
+        None, in which case a new scheduler is used just for this call.
+
+        metrics (CrawlMetrics). The metrics to record the requests in. If a
+        client is given, it must have been created with the trace config of
+        the metrics (refer to `CrawlMetrics.trace_config`) for the network
+        phases to be recorded. The default is None, meaning that no metrics are
+        recorded.
+
+        base_url (str). The base url of the reddit server (e.g. to query a
+        local server in tests and benchmarks). The default is `BASE_URL`.
+
+        store (SnapshotStore). The store of snapshots of the pages, used to
+        query the server only for the pages that changed (the others are read
+        from the store). The default is None, meaning no store is used.
+
     Returns
     -------
         data (list). A list of dictionaries containing the top threads for each
-        subreddit given in the `subreddits` argument. Each item in the list is a
-        dictionary containing the following attributes:
+        subreddit given in the `subreddits` argument, in the same order. Each
+        item in the list is a dictionary containing the following attributes:
             {
                 'subreddit': 'name of the subreddit',
-                'threads': [ list of dictionaries with thread data ]
+                'threads': [ list of dictionaries with thread data ],
+                'error': 'description of the error' or None
             }
         For details on the contents of the list of dictionaries in the `threads`
         attribute, please refer to the return type in the documentation of 
-        function `_get_top_threads`.
+        function `_get_top_threads`. If the query for a subreddit failed, its
+        `threads` list is empty and its `error` attribute describes the failure
+        (otherwise, it is None).
+    '''
+    results = await fetch_subreddits(subreddits, limit, min_score,
+                                     concurrency, client, cache, stream,
+                                     scheduler, metrics, base_url, store)
+    return [result.to_dict() for result in results]
+
+# ------------------------------------------------------------------------------
+async def fetch_subreddits(subreddits, limit=50, min_score=5000, concurrency=8,
+                           client=None, cache=None, stream=True,
+                           scheduler=None, metrics=None, base_url=BASE_URL,
+                           store=None):
+    '''Gets the top threads (up to the given limit and minimum score) for the
+    given list of subreddits, as compact records.
+
+    This function works as function `get_subreddits`, but the data of each
+    subreddit is a `SubredditResult` record and each thread is a `Thread`
+    record (named tuples, which take much less memory than dictionaries). The
+    records also accept the access to their fields by name (e.g.
+    `result['threads'][0]['title']`), as the dictionaries do.
+
+    Parameters
+    ----------
+        The same parameters of function `get_subreddits`.
+
+    Returns
+    -------
+        results (list). A list of `SubredditResult` records, in the same order
+        of the `subreddits` argument.
     '''
     limit = max(limit, 1)
     min_score = max(min_score, 0)
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
 
-    data = []
-    client = aiohttp.ClientSession(loop=asyncio.get_event_loop())
+    if client is None:
+        async with _open_client(metrics) as client:
+            return await fetch_subreddits(subreddits, limit, min_score,
+                                          concurrency, client, cache,
+                                          stream, scheduler, metrics,
+                                          base_url, store)
+
+    if scheduler is None:
+        scheduler = RequestScheduler()
+
+    tasks = [_get_subreddit(client, semaphore, subreddit, limit, min_score,
+                            cache, stream, scheduler, metrics, base_url,
+                            store)
+             for subreddit in subreddits]
+    return await asyncio.gather(*tasks)
+
+# ------------------------------------------------------------------------------
+def _open_client(metrics=None):
+    '''Opens a new HTTP session, traced by the given metrics (if any).'''
+    if metrics is None:
+        return aiohttp.ClientSession()
+    return aiohttp.ClientSession(trace_configs=[metrics.trace_config()])
+
+# ------------------------------------------------------------------------------
+async def iter_subreddits(subreddits, limit=50, min_score=5000, concurrency=8,
+                          client=None, cache=None, stream=True, scheduler=None,
+                          metrics=None, base_url=BASE_URL, store=None):
+    '''Gets the top threads for the given list of subreddits, yielding the
+    data of each subreddit as soon as its query finishes (i.e. in the order
+    the queries finish, not in the order of the given list).
+
+    If the iteration is stopped early, the queries still running are
+    cancelled.
+
+    Parameters
+    ----------
+        The same parameters of function `get_subreddits`.
 
-    for subreddit in subreddits:
-        sub_data = await _get_top_threads(client, subreddit, limit, min_score)        
-        data.append({
-            'subreddit': subreddit,
-            'threads': sub_data
-        })
+    Yields
+    ------
+        result (SubredditResult). The record with the data of a subreddit, as
+        described in the documentation of function `fetch_subreddits`.
+    '''
+    limit = max(limit, 1)
+    min_score = max(min_score, 0)
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
 
-    await client.close()
-    return data
+    if client is None:
+        async with _open_client(metrics) as client:
+            async for item in iter_subreddits(subreddits, limit, min_score,
+                                              concurrency, client, cache,
+                                              stream, scheduler, metrics,
+                                              base_url, store):
+                yield item
+        return
+
+    if scheduler is None:
+        scheduler = RequestScheduler()
+
+    tasks = [asyncio.ensure_future(_get_subreddit(client, semaphore, subreddit,
+                                                  limit, min_score, cache,
+                                                  stream, scheduler, metrics,
+                                                  base_url, store))
+             for subreddit in subreddits]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
 
 # ------------------------------------------------------------------------------
-async def _get_top_threads(client, subreddit, limit, min_score):
+async def _get_subreddit(client, semaphore, subreddit, limit, min_score,
+                         cache=None, stream=True, scheduler=None, metrics=None,
+                         base_url=BASE_URL, store=None):
+    '''Gets the top threads for the given subreddit, capturing any error that
+    happens in the query.
+
+    Parameters
+    ----------
+        client (aiohttp.ClientSession). The HTTP session to query the data.
+
+        semaphore (asyncio.Semaphore). The semaphore that limits the number of
+        requests running at the same time.
+
+        subreddit (str). Name of the subreddit to query the top threads for.
+
+        limit (int). Maximum number of threads to query the server.
+
+        min_score (int). The minimum score for a thread to be considered as top.
+
+        cache (ThreadCache). The cache of top threads to use, or None.
+
+        stream (bool). Indicates if the responses are parsed as they arrive.
+
+        scheduler (RequestScheduler). The scheduler of the requests, or None.
+
+        metrics (CrawlMetrics). The metrics to record the requests in, or None.
+
+        base_url (str). The base url of the reddit server.
+
+        store (SnapshotStore). The store of snapshots of the pages, or None.
+
+    Returns
+    -------
+        result (SubredditResult). The record with the subreddit data.
+    '''
+    async def fetch(min_score):
+        async with semaphore:
+            threads = await _get_top_threads(client, subreddit, limit,
+                                             min_score, stream, scheduler,
+                                             metrics, base_url, store)
+            return tuple(threads)
+
+    try:
+        # The cache keeps all threads queried (i.e. regardless of their score),
+        # so the same entry serves any minimum score
+        if cache is None:
+            threads = await fetch(min_score)
+        else:
+            threads = await cache.get((subreddit.lower(), limit),
+                                      lambda: fetch(0))
+            threads = _filter_threads(threads, min_score)
+    except Exception as error:
+        return SubredditResult(subreddit, (), f'{type(error).__name__}: {error}')
+
+    return SubredditResult(subreddit, threads, None)
+
+# ------------------------------------------------------------------------------
+def _filter_threads(threads, min_score):
+    '''Filters the given threads (sorted by score, as returned by the reddit
+    server) by the given minimum score.
+
+    Parameters
+    ----------
+        threads (tuple). The records with the data of the threads.
+
+        min_score (int). The minimum score for a thread to be considered as top.
+
+    Returns
+    -------
+        threads (tuple). The threads before the first one with a score lower
+        than the minimum.
+    '''
+    if min_score <= 0:
+        return tuple(threads)
+
+    for index, thread in enumerate(threads):
+        if thread.score < min_score:
+            return tuple(threads[:index])
+    return tuple(threads)
+
+# ==============================================================================
+class ThreadCache:
+    '''A cache of the top threads of subreddits, with a time to live (TTL)
+    for the entries and least recently used (LRU) eviction.
+
+    Besides caching the results, concurrent requests for the same entry are
+    coalesced: while a query is running, any other request for the same entry
+    simply waits for that query to finish, instead of querying the server
+    again.
+
+    The cache must be used by a single event loop (the one where the queries
+    run).
+
+    Attributes
+    ----------
+        ttl (float). Time (in seconds) that an entry is kept valid.
+
+        maxsize (int). Maximum number of entries kept in the cache.
+
+        hits (int). Number of requests served from the cache.
+
+        misses (int). Number of requests that queried the server.
+
+        coalesced (int). Number of requests that waited for a query already
+        running for the same entry.
+    '''
+
+    # --------------------------------------------------------------------------
+    def __init__(self, ttl=300, maxsize=256, clock=time.monotonic):
+        '''Creates the cache.
+
+        Parameters
+        ----------
+            ttl (float). Time (in seconds) that an entry is kept valid. The
+            default is 300 (5 minutes).
+
+            maxsize (int). Maximum number of entries kept in the cache. The
+            default is 256.
+
+            clock (function). The function that gives the current time, in
+            seconds. The default is `time.monotonic`.
+        '''
+        self.ttl = ttl
+        self.maxsize = max(maxsize, 0)
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._pending = {}
+
+    # --------------------------------------------------------------------------
+    def __len__(self):
+        '''Gets the number of entries currently in the cache.'''
+        return len(self._entries)
+
+    # --------------------------------------------------------------------------
+    async def get(self, key, fetch):
+        '''Gets the cached value for the given key, fetching it if needed.
+
+        Parameters
+        ----------
+            key (tuple). The key of the entry (for example, the subreddit name
+            and the limit of threads).
+
+            fetch (function). A function without arguments that returns the
+            coroutine to query the value, called only on a cache miss.
+
+        Returns
+        -------
+            value (object). The cached (or just fetched) value.
+        '''
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, value = entry
+            if expires > self._clock():
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return value
+            del self._entries[key]
+
+        # The query is shielded, so a request that is cancelled does not
+        # cancel it for the other requests waiting for the same entry
+        task = self._pending.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return await asyncio.shield(task)
+
+        self.misses += 1
+        task = asyncio.ensure_future(fetch())
+        self._pending[key] = task
+        task.add_done_callback(lambda task: self._finish(key, task))
+        return await asyncio.shield(task)
+
+    # --------------------------------------------------------------------------
+    def clear(self):
+        '''Removes all entries from the cache and resets the counters (the
+        queries still running are not affected).'''
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    # --------------------------------------------------------------------------
+    def _finish(self, key, task):
+        '''Stores the result of a finished query (failed queries are not
+        cached).'''
+        self._pending.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+
+        if self.maxsize > 0:
+            self._entries[key] = (self._clock() + self.ttl, task.result())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+# ==============================================================================
+class RequestScheduler:
+    '''A scheduler of the requests to the reddit server, that paces them
+    according to the rate limit informed by the server and retries the ones
+    that fail due to transient errors.
+
+    The reddit server informs in the headers of each response how many
+    requests are still allowed (`X-Ratelimit-Remaining`) and in how many
+    seconds that quota is renewed (`X-Ratelimit-Reset`). The scheduler works
+    as a token bucket filled with that quota: the requests go out right away
+    (so a burst of requests, e.g. for many subreddits, is sent at once) while
+    the quota, except for a small margin, is not used up, and only then they
+    wait for the quota to be renewed. The requests refused by the rate limit
+    (HTTP status 429), with a server error (HTTP status 5xx) or with a
+    connection error are retried after an exponential backoff with random
+    jitter.
+
+    The scheduler must be used by a single event loop.
+
+    Attributes
+    ----------
+        max_retries (int). Maximum number of times a request is retried.
+
+        backoff_base (float). Base delay (in seconds) of the backoff.
+
+        backoff_cap (float). Maximum delay (in seconds) of the backoff.
+
+        margin (float). Number of requests of the quota that are not used (to
+        account for the requests sent by other clients or not yet counted by
+        the server).
+
+        remaining (float). Number of requests still allowed by the server in
+        the current period (None while it is unknown).
+    '''
+
+    # --------------------------------------------------------------------------
+    def __init__(self, max_retries=3, backoff_base=0.5, backoff_cap=30,
+                 margin=2, clock=time.monotonic, sleep=asyncio.sleep):
+        '''Creates the scheduler.
+
+        Parameters
+        ----------
+            max_retries (int). Maximum number of times a request is retried.
+            The default is 3.
+
+            backoff_base (float). Base delay (in seconds) of the backoff, which
+            doubles at each retry. The default is 0.5.
+
+            backoff_cap (float). Maximum delay (in seconds) of the backoff. The
+            default is 30.
+
+            margin (float). Number of requests of the quota that are not used.
+            The default is 2.
+
+            clock (function). The function that gives the current time, in
+            seconds. The default is `time.monotonic`.
+
+            sleep (function). The coroutine function that waits for a number
+            of seconds (in the same time of the clock). The default is
+            `asyncio.sleep`.
+        '''
+        self.max_retries = max(max_retries, 0)
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.margin = margin
+        self.remaining = None
+        self._clock = clock
+        self._sleep = sleep
+        self._reset_at = None
+        self._probe = None
+        self._probed = False
+
+    # --------------------------------------------------------------------------
+    async def request(self, client, url, trace_request_ctx=None, headers=None):
+        '''Sends a GET request, pacing it according to the rate limit and
+        retrying it on transient errors.
+
+        Parameters
+        ----------
+            client (aiohttp.ClientSession). The HTTP session to send the
+            request with.
+
+            url (str). The url to request.
+
+            trace_request_ctx (object). The context given to the trace configs
+            of the client in each attempt of the request (e.g. the subreddit,
+            for `CrawlMetrics`). The default is None.
+
+            headers (dict). Additional headers of the request (e.g. the
+            validators of a conditional request). The default is None.
+
+        Returns
+        -------
+            response (aiohttp.ClientResponse). The successful response (HTTP
+            status 200, or 304 for a conditional request), still to be read
+            and released by the caller.
+
+        Raises
+        ------
+            RedditRateLimitError. If the request is still refused by the rate
+            limit after all retries.
+
+            RedditHTTPError. If the server answers with another error status
+            (immediately for client errors, or after all retries for server
+            errors).
+
+            RedditConnectionError. If the server can not be reached after all
+            retries.
+        '''
+        attempt = 0
+        while True:
+            probe = await self.acquire()
+
+            try:
+                response = await client.get(url, headers=headers,
+                                            trace_request_ctx=trace_request_ctx)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+                if attempt >= self.max_retries:
+                    raise RedditConnectionError(f'{error!r} for {url}') \
+                        from error
+            else:
+                self.update(response.headers)
+                if response.status == 200 or \
+                   (response.status == 304 and headers):
+                    return response
+                response.release()
+
+                if response.status == 429:
+                    retry_after = response.headers.get('Retry-After')
+                    if retry_after is not None:
+                        self.update({'X-Ratelimit-Remaining': 0,
+                                     'X-Ratelimit-Reset': retry_after})
+                    if attempt >= self.max_retries:
+                        raise RedditRateLimitError(response.status, url)
+                elif response.status < 500 or attempt >= self.max_retries:
+                    raise RedditHTTPError(response.status, url)
+            finally:
+                if probe is not None:
+                    self._end_probe(probe)
+
+            await self._sleep(self.backoff(attempt))
+            attempt += 1
+
+    # --------------------------------------------------------------------------
+    async def acquire(self):
+        '''Waits until the next request can be sent.
+
+        Returns
+        -------
+            probe (asyncio.Event). If the request is the one sent to learn the
+            quota, the event that the other requests wait for, to be given to
+            `_end_probe` when its response arrives. Otherwise, None.
+        '''
+        while True:
+            now = self._clock()
+
+            # When the quota period ends, the new quota must be known again
+            if self._reset_at is not None and now >= self._reset_at:
+                self._reset_at = None
+                self.remaining = None
+                self._probe = None
+                self._probed = False
+
+            # While the quota is unknown a single request is sent, and the
+            # others wait for its response (so a burst of requests does not
+            # exceed a quota that is already low)
+            if not self._probed:
+                if self._probe is None:
+                    self._probe = asyncio.Event()
+                    return self._probe
+                await self._probe.wait()
+                continue
+
+            # Without information from the server the requests are not delayed
+            if self.remaining is None:
+                return None
+
+            # The requests go out right away while there are requests left in
+            # the quota (besides the margin), and otherwise wait for the quota
+            # to be renewed
+            if self.remaining - self.margin >= 1:
+                self.remaining -= 1
+                return None
+
+            await self._sleep(self._reset_at - now)
+
+    # --------------------------------------------------------------------------
+    def update(self, headers):
+        '''Updates the rate limit information from the headers of a response.
+
+        Parameters
+        ----------
+            headers (dict). The headers of the response.
+        '''
+        remaining = _parse_float(headers.get('X-Ratelimit-Remaining'))
+        reset = _parse_float(headers.get('X-Ratelimit-Reset'))
+        if remaining is None or reset is None:
+            return
+
+        # Within the same period, the responses of requests sent earlier may
+        # report more remaining requests than the ones already scheduled
+        now = self._clock()
+        if self.remaining is not None and now < self._reset_at:
+            remaining = min(remaining, self.remaining)
+
+        self.remaining = remaining
+        self._reset_at = now + reset
+
+    # --------------------------------------------------------------------------
+    def _end_probe(self, probe):
+        '''Releases the requests waiting for the response of a probe request.
+
+        Parameters
+        ----------
+            probe (asyncio.Event). The event returned by `acquire` for the
+            probe request. If the quota was renewed since then (and a new probe
+            started), only the requests waiting for this one are released.
+        '''
+        probe.set()
+        if probe is self._probe:
+            self._probed = True
+
+    # --------------------------------------------------------------------------
+    def backoff(self, attempt):
+        '''Gets the delay before retrying a request, using an exponential
+        backoff with full jitter (i.e. a random delay up to the exponential
+        value), so the retries of many requests do not happen all at once.
+
+        Parameters
+        ----------
+            attempt (int). The number of the attempt that failed (from 0).
+
+        Returns
+        -------
+            delay (float). The delay in seconds.
+        '''
+        limit = min(self.backoff_cap, self.backoff_base * 2 ** attempt)
+        return random.uniform(0, limit)
+
+# ------------------------------------------------------------------------------
+def _parse_float(value):
+    '''Parses a number in a header value.
+
+    Parameters
+    ----------
+        value (str). The header value (or None, if the header is missing).
+
+    Returns
+    -------
+        number (float). The parsed number, or None if it is not valid.
+    '''
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+# ==============================================================================
+class Histogram:
+    '''A histogram of observed values, with cumulative buckets (as in the
+    Prometheus histograms). It is not thread safe, so the accesses must be
+    serialized by its users.
+
+    Attributes
+    ----------
+        bounds (tuple). Upper bounds of the buckets, in increasing order.
+
+        counts (list). Number of values in each bucket (not cumulative), with
+        one more bucket for the values above the last bound.
+
+        sum (float). Sum of the values.
+
+        count (int). Number of values.
+
+        min (float). Minimum value.
+
+        max (float). Maximum value.
+    '''
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count', 'min', 'max')
+
+    # --------------------------------------------------------------------------
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    # --------------------------------------------------------------------------
+    def observe(self, value):
+        '''Adds a value to the histogram.'''
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    # --------------------------------------------------------------------------
+    def merge(self, other):
+        '''Adds the values of another histogram (with the same buckets).'''
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    # --------------------------------------------------------------------------
+    def stats(self):
+        '''Gets the number of values and their mean, p50 and p99.'''
+        return {
+            'count': self.count,
+            'mean': self.sum / self.count,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99)
+        }
+
+    # --------------------------------------------------------------------------
+    def quantile(self, q):
+        '''Estimates the given quantile (from 0 to 1) by interpolating the
+        values within the bucket where it falls (limited to the minimum and
+        maximum values observed).'''
+        if self.count == 0:
+            return None
+
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = self.bounds[index - 1] if index > 0 else self.min
+                upper = self.bounds[index] if index < len(self.bounds) \
+                        else self.max
+                lower = max(lower, self.min)
+                upper = min(upper, self.max)
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.max
+
+# ==============================================================================
+class CrawlMetrics:
+    '''Metrics of the queries to the reddit server: the time spent in each
+    phase of the requests, the number of requests (by HTTP status) and the
+    number of bytes received, per subreddit.
+
+    The network phases are measured by the hooks of an aiohttp trace config
+    (refer to method `trace_config`), so the HTTP session used in the queries
+    must be created with it. The other phases are measured while the pages are
+    read. The times are aggregated in histograms, and the metrics can be
+    exported as a text summary or in the Prometheus text format.
+
+    The phases measured are:
+        'dns': resolution of the host name (only when not cached).
+        'connect': opening of a new connection (only when not reused).
+        'ttfb': time to the first byte, i.e. from the start of the request
+            until the response headers are received.
+        'body': reading of the response body.
+        'parse': decoding of the JSON in the response body.
+        'filter': building of the thread records and filtering by score.
+        'total': the whole page, from the scheduling of the request
+            (including the waits and retries) until its threads are built.
+
+    The metrics can be read from another thread (e.g. to export them) while
+    the queries are running.
+    '''
+
+    # Phases of the requests measured
+    PHASES = ('dns', 'connect', 'ttfb', 'body', 'parse', 'filter', 'total')
+
+    # Default upper bounds (in seconds) of the buckets of the histograms
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+               0.5, 1.0, 2.5, 5.0, 10.0)
+
+    # --------------------------------------------------------------------------
+    def __init__(self, buckets=BUCKETS):
+        '''Creates the (empty) metrics.
+
+        Parameters
+        ----------
+            buckets (tuple). Upper bounds (in seconds) of the buckets of the
+            histograms, in increasing order. The default is `BUCKETS`.
+        '''
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._requests = {}
+        self._bytes = {}
+        self._collectors = []
+
+    # --------------------------------------------------------------------------
+    def add_collector(self, collector):
+        '''Adds a collector of other metrics to the Prometheus output (e.g. the
+        metrics of the components that use the queries).
+
+        Parameters
+        ----------
+            collector (function). A function with no arguments that gives the
+            metrics in the Prometheus text format (str). It is called each time
+            the metrics are exported, so it must be thread safe.
+        '''
+        with self._lock:
+            self._collectors.append(collector)
+
+    # --------------------------------------------------------------------------
+    def observe(self, subreddit, phase, seconds):
+        '''Records the time spent in a phase of a request.
+
+        Parameters
+        ----------
+            subreddit (str). The name of the subreddit queried.
+
+            phase (str). The phase of the request (one of `PHASES`).
+
+            seconds (float). The time spent.
+        '''
+        with self._lock:
+            key = (subreddit, phase)
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    # --------------------------------------------------------------------------
+    def count_request(self, subreddit, status):
+        '''Counts a request.
+
+        Parameters
+        ----------
+            subreddit (str). The name of the subreddit queried.
+
+            status (object). The HTTP status of the response, or the name of
+            the error if the request failed without a response.
+        '''
+        with self._lock:
+            key = (subreddit, str(status))
+            self._requests[key] = self._requests.get(key, 0) + 1
+
+    # --------------------------------------------------------------------------
+    def add_bytes(self, subreddit, count):
+        '''Counts the bytes received in a response body.
+
+        Parameters
+        ----------
+            subreddit (str). The name of the subreddit queried.
+
+            count (int). The number of bytes.
+        '''
+        with self._lock:
+            self._bytes[subreddit] = self._bytes.get(subreddit, 0) + count
+
+    # --------------------------------------------------------------------------
+    def trace_config(self):
+        '''Creates the aiohttp trace config that measures the network phases
+        of the requests. The subreddit of each request is given by the
+        `trace_request_ctx` argument of the request (as sent by the
+        `RequestScheduler`).
+
+        Returns
+        -------
+            trace_config (aiohttp.TraceConfig). The trace config, to be given
+            to the HTTP session (`aiohttp.ClientSession(trace_configs=[...])`).
+        '''
+        clock = time.perf_counter
+
+        async def on_request_start(session, context, params):
+            context.start = clock()
+
+        async def on_dns_start(session, context, params):
+            context.dns_start = clock()
+
+        async def on_dns_end(session, context, params):
+            self.observe(context.trace_request_ctx, 'dns',
+                         clock() - context.dns_start)
+
+        async def on_connection_start(session, context, params):
+            context.connection_start = clock()
+
+        async def on_connection_end(session, context, params):
+            self.observe(context.trace_request_ctx, 'connect',
+                         clock() - context.connection_start)
+
+        async def on_request_end(session, context, params):
+            self.observe(context.trace_request_ctx, 'ttfb',
+                         clock() - context.start)
+            self.count_request(context.trace_request_ctx,
+                               params.response.status)
+
+        async def on_request_exception(session, context, params):
+            self.count_request(context.trace_request_ctx,
+                               type(params.exception).__name__)
+
+        trace_config = aiohttp.TraceConfig(
+            trace_config_ctx_factory=_trace_context)
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_dns_resolvehost_start.append(on_dns_start)
+        trace_config.on_dns_resolvehost_end.append(on_dns_end)
+        trace_config.on_connection_create_start.append(on_connection_start)
+        trace_config.on_connection_create_end.append(on_connection_end)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        return trace_config
+
+    # --------------------------------------------------------------------------
+    def summary(self):
+        '''Gets a summary of the metrics.
+
+        Returns
+        -------
+            summary (dict). The metrics of each subreddit, indexed by its name:
+                {
+                    'requests': {status: count, ...},
+                    'bytes': total of bytes received,
+                    'phases': {
+                        phase: {'count': int, 'mean': float, 'p50': float,
+                                'p99': float},
+                        ...
+                    }
+                }
+            The quantiles are estimated from the histograms.
+        '''
+        summary = {}
+
+        def entry(subreddit):
+            return summary.setdefault(subreddit, {'requests': {}, 'bytes': 0,
+                                                  'phases': {}})
+
+        with self._lock:
+            for (subreddit, status), count in self._requests.items():
+                entry(subreddit)['requests'][status] = count
+            for subreddit, count in self._bytes.items():
+                entry(subreddit)['bytes'] = count
+            for (subreddit, phase), histogram in self._histograms.items():
+                entry(subreddit)['phases'][phase] = histogram.stats()
+        return summary
+
+    # --------------------------------------------------------------------------
+    def overall(self, phase):
+        '''Gets the statistics of a phase of the requests of all subreddits.
+
+        Parameters
+        ----------
+            phase (str). The phase of the requests (one of `PHASES`).
+
+        Returns
+        -------
+            stats (dict). The number of requests and the mean, p50 and p99 of
+            the times (in seconds), or None if the phase was never recorded.
+        '''
+        merged = Histogram(self.buckets)
+        with self._lock:
+            for (_, name), histogram in self._histograms.items():
+                if name == phase:
+                    merged.merge(histogram)
+        return merged.stats() if merged.count else None
+
+    # --------------------------------------------------------------------------
+    def format_summary(self):
+        '''Formats the summary of the metrics as human-readable text.
+
+        Returns
+        -------
+            text (str). A table with the requests, bytes and times (mean, p50
+            and p99, in milliseconds) of each phase, per subreddit.
+        '''
+        lines = [f'{"SUBREDDIT":<20} {"PHASE":<8} {"COUNT":>6} {"MEAN":>9} '
+                 f'{"P50":>9} {"P99":>9}']
+        for subreddit, entry in sorted(self.summary().items()):
+            requests = ', '.join(f'{status}: {count}' for status, count
+                                 in sorted(entry['requests'].items()))
+            lines.append(f'{subreddit:<20} requests ({requests}), '
+                         f'{entry["bytes"]} bytes')
+            for phase in self.PHASES:
+                stats = entry['phases'].get(phase)
+                if stats is None:
+                    continue
+                lines.append(f'{"":<20} {phase:<8} {stats["count"]:>6} '
+                             f'{stats["mean"] * 1000:>7.1f}ms '
+                             f'{stats["p50"] * 1000:>7.1f}ms '
+                             f'{stats["p99"] * 1000:>7.1f}ms')
+        return '\n'.join(lines)
+
+    # --------------------------------------------------------------------------
+    def to_prometheus(self):
+        '''Exports the metrics in the Prometheus text format.
+
+        Returns
+        -------
+            text (str). The metrics `reddit_requests_total`,
+            `reddit_response_bytes_total` and `reddit_request_phase_seconds`
+            (a histogram), labeled by subreddit (and status or phase),
+            followed by the metrics of the collectors added (refer to method
+            `add_collector`).
+        '''
+        lines = ['# HELP reddit_requests_total Requests to the reddit server.',
+                 '# TYPE reddit_requests_total counter']
+        with self._lock:
+            for (subreddit, status), count in sorted(self._requests.items()):
+                lines.append(f'reddit_requests_total{{subreddit='
+                             f'"{escape_label(subreddit)}",status='
+                             f'"{escape_label(status)}"}} {count}')
+
+            lines.append('# HELP reddit_response_bytes_total Bytes received '
+                         'in the response bodies.')
+            lines.append('# TYPE reddit_response_bytes_total counter')
+            for subreddit, count in sorted(self._bytes.items()):
+                lines.append(f'reddit_response_bytes_total{{subreddit='
+                             f'"{escape_label(subreddit)}"}} {count}')
+
+            lines.append('# HELP reddit_request_phase_seconds Time spent in '
+                         'each phase of the requests.')
+            lines.append('# TYPE reddit_request_phase_seconds histogram')
+            name = 'reddit_request_phase_seconds'
+            for (subreddit, phase), histogram in sorted(
+                    self._histograms.items()):
+                labels = f'subreddit="{escape_label(subreddit)}",' \
+                         f'phase="{phase}"'
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',),
+                                        histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} '
+                                 f'{cumulative}')
+                lines.append(f'{name}_sum{{{labels}}} {histogram.sum}')
+                lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+            collectors = list(self._collectors)
+
+        # The collectors are called out of the lock, since they may take
+        # locks of their own
+        for collector in collectors:
+            lines.append(collector().rstrip('\n'))
+        return '\n'.join(lines) + '\n'
+
+    # --------------------------------------------------------------------------
+    def write_prometheus(self, path):
+        '''Writes the metrics in the Prometheus text format to a file. The
+        file is replaced atomically, so a collector (e.g. the textfile
+        collector of the node exporter) never reads it half written.
+
+        Parameters
+        ----------
+            path (str). The path of the file.
+        '''
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, mode='w', encoding='utf-8') as file:
+            file.write(self.to_prometheus())
+        os.replace(temp_path, path)
+
+# ------------------------------------------------------------------------------
+def _trace_context(trace_request_ctx=None):
+    '''Creates the context of a traced request, keeping the subreddit given
+    by the request (or a placeholder if none was given).'''
+    return SimpleNamespace(trace_request_ctx=trace_request_ctx or 'unknown')
+
+# ------------------------------------------------------------------------------
+def escape_label(value):
+    '''Escapes a value of a label in the Prometheus text format.
+
+    Parameters
+    ----------
+        value (str). The value of the label.
+
+    Returns
+    -------
+        value (str). The value with the backslashes, quotes and line breaks
+        escaped.
+    '''
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# ==============================================================================
+class SnapshotStore:
+    '''A persistent store (in a SQLite database) of the snapshots of the pages
+    of the top threads listings.
+
+    Each page is saved with the validators sent by the server (`ETag` and
+    `Last-Modified`), which are sent back (as `If-None-Match` and
+    `If-Modified-Since`) when the page is queried again. If the page did not
+    change, the server answers with HTTP status 304 (without a body) and the
+    threads are read from the store instead, saving the download and the
+    parsing of the page. Since the snapshots are kept on disk, they survive
+    the restarts of the applications.
+
+    The threads of all the snapshots are also indexed by score, so they can be
+    queried across all the subreddits stored (refer to `top_threads`).
+
+    The store can be used from any thread (the accesses are serialized).
+    '''
+
+    # --------------------------------------------------------------------------
+    def __init__(self, path=':memory:'):
+        '''Opens (or creates) the store.
+
+        Parameters
+        ----------
+            path (str). The path of the SQLite database file. The default is
+            ':memory:', meaning a temporary store in memory.
+        '''
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            if path != ':memory:':
+                self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA foreign_keys=ON')
+            self._db.execute('CREATE TABLE IF NOT EXISTS pages ('
+                             'url TEXT PRIMARY KEY, '
+                             'subreddit TEXT NOT NULL, '
+                             'etag TEXT, '
+                             'last_modified TEXT, '
+                             'after TEXT, '
+                             'fetched_at REAL NOT NULL)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS threads ('
+                             'page_url TEXT NOT NULL REFERENCES pages(url) '
+                             'ON DELETE CASCADE, '
+                             'position INTEGER NOT NULL, '
+                             'subreddit TEXT NOT NULL, '
+                             'url TEXT, title TEXT, score INTEGER, '
+                             'ups INTEGER, downs INTEGER, author TEXT, '
+                             'num_comments INTEGER, url_comments TEXT, '
+                             'PRIMARY KEY (page_url, position))')
+            self._db.execute('CREATE INDEX IF NOT EXISTS threads_by_score '
+                             'ON threads (score)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS threads_by_subreddit '
+                             'ON threads (subreddit, score)')
+
+    # --------------------------------------------------------------------------
+    def get_page(self, url):
+        '''Gets the snapshot of a page.
+
+        Parameters
+        ----------
+            url (str). The url of the page.
+
+        Returns
+        -------
+            snapshot (dict). The snapshot of the page, or None if it is not
+            stored:
+                {
+                    'etag': 'the ETag of the page' or None,
+                    'last_modified': 'the Last-Modified of the page' or None,
+                    'after': 'the cursor of the next page' or None,
+                    'fetched_at': time (as in `time.time`) of the download,
+                    'threads': [ list of `Thread` records ]
+                }
+        '''
+        with self._lock:
+            page = self._db.execute('SELECT etag, last_modified, after, '
+                                    'fetched_at FROM pages WHERE url = ?',
+                                    (url,)).fetchone()
+            if page is None:
+                return None
+            rows = self._db.execute('SELECT ' + _THREAD_COLUMNS + ' FROM '
+                                    'threads WHERE page_url = ? ORDER BY '
+                                    'position', (url,)).fetchall()
+
+        return {
+            'etag': page[0],
+            'last_modified': page[1],
+            'after': page[2],
+            'fetched_at': page[3],
+            'threads': [Thread._make(row) for row in rows]
+        }
+
+    # --------------------------------------------------------------------------
+    def save_page(self, url, subreddit, etag, last_modified, after, threads):
+        '''Saves (or replaces) the snapshot of a page.
+
+        Parameters
+        ----------
+            url (str). The url of the page.
+
+            subreddit (str). The name of the subreddit.
+
+            etag (str). The `ETag` header of the response, or None.
+
+            last_modified (str). The `Last-Modified` header of the response, or
+            None.
+
+            after (str). The cursor of the next page, or None.
+
+            threads (list). All the `Thread` records in the page.
+        '''
+        subreddit = subreddit.lower()
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO pages VALUES '
+                             '(?, ?, ?, ?, ?, ?)',
+                             (url, subreddit, etag, last_modified, after,
+                              time.time()))
+            self._db.execute('DELETE FROM threads WHERE page_url = ?', (url,))
+            self._db.executemany('INSERT INTO threads VALUES '
+                                 '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                 [(url, position, subreddit) + tuple(thread)
+                                  for position, thread in enumerate(threads)])
+
+    # --------------------------------------------------------------------------
+    def touch_page(self, url):
+        '''Marks the snapshot of a page as confirmed by the server now.
+
+        Parameters
+        ----------
+            url (str). The url of the page.
+        '''
+        with self._lock, self._db:
+            self._db.execute('UPDATE pages SET fetched_at = ? WHERE url = ?',
+                             (time.time(), url))
+
+    # --------------------------------------------------------------------------
+    def top_threads(self, min_score=0, limit=50, subreddits=None):
+        '''Gets the top threads across the snapshots stored, sorted by score
+        (with each thread only once, even if it is stored in many pages).
+
+        Parameters
+        ----------
+            min_score (int). The minimum score of the threads. The default is
+            0.
+
+            limit (int). Maximum number of threads to get. The default is 50.
+
+            subreddits (list). The names of the subreddits to get the threads
+            from. The default is None, meaning all the subreddits stored.
+
+        Returns
+        -------
+            threads (list). A list of tuples with the name of the subreddit and
+            the `Thread` record of each thread.
+        '''
+        # Among the copies of a thread, the one with the highest score is used
+        columns = ', '.join('MAX(score) AS score' if name == 'score' else name
+                            for name in Thread._fields)
+        query = f'SELECT subreddit, {columns} FROM threads WHERE score >= ?'
+        params = [min_score]
+        if subreddits is not None:
+            names = [name.lower() for name in subreddits]
+            query += f' AND subreddit IN ({", ".join("?" * len(names))})'
+            params.extend(names)
+        query += ' GROUP BY url_comments ORDER BY score DESC LIMIT ?'
+        params.append(max(limit, 0))
+
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        return [(row[0], Thread._make(row[1:])) for row in rows]
+
+    # --------------------------------------------------------------------------
+    def close(self):
+        '''Closes the store.'''
+        with self._lock:
+            self._db.close()
+
+# Columns of the threads table with the fields of the `Thread` records
+_THREAD_COLUMNS = ', '.join(Thread._fields)
+
+# ------------------------------------------------------------------------------
+async def _get_top_threads(client, subreddit, limit, min_score, stream=True,
+                           scheduler=None, metrics=None, base_url=BASE_URL,
+                           store=None):
     '''Gets the top threads (up to the given limit and minimum score) for the
     given subreddit.
 
@@ -63,16 +1411,46 @@ async def _get_top_threads(client, subreddit, limit, min_score):
         subreddit (str). Name of the subreddit to query the top threads for.
 
         limit (int). Maximum number of threads to query the server, to constrain
-        the load on the server and the communication link.
+        the load on the server and the communication link. Since the server
+        returns at most `PAGE_LIMIT` threads per request, larger limits are
+        queried in pages (following the `after` cursor of each page). Without
+        a minimum score, the next page is requested as soon as its cursor is
+        known, so it is fetched while the current page is still being parsed.
+        With a minimum score, it is only requested once the whole current page
+        is parsed without finding a thread below the minimum (so no page is
+        requested in vain), and no more pages are requested once the limit or
+        the minimum score is reached.
 
         min_score (int). The minimum score for a thread to be considered as top
         (besides the reddit original indication from the top query).
 
+        stream (bool). If True (the default), the threads are parsed one by one
+        as the bytes of the response arrive (each one is decoded as soon as it
+        is completely received, with the fastest JSON backend installed, i.e.
+        orjson or ujson, if available), and the parsing stops as soon as
+        a thread with a score lower than the minimum is found (the rest of the
+        response is still read, so the connection can be reused). If False, the
+        whole response is read and then decoded at once, with the same JSON
+        backend.
+
+        scheduler (RequestScheduler). The scheduler that paces and retries the
+        requests. The default is None, in which case a new one is used.
+
+        metrics (CrawlMetrics). The metrics to record the requests in. The
+        default is None, meaning that no metrics are recorded.
+
+        base_url (str). The base url of the reddit server. The default is
+        `BASE_URL`.
+
+        store (SnapshotStore). The store of snapshots of the pages. The pages
+        that did not change since their snapshots are read from the store.
+        The default is None, meaning no store is used.
+
     Returns
     -------
-        data (list). A list of dictionaries containing the top threads for the
-        given subreddit. Each item in the list is a dictionary containing the
-        following attributes:
+        data (list). A list of `Thread` records with the top threads for the
+        given subreddit. Converted to dictionaries (by `Thread.to_dict`), each
+        item contains the following attributes:
             {
                 'url': 'string of the thread url',
                 'title': 'string of the thread title',
@@ -84,33 +1462,504 @@ async def _get_top_threads(client, subreddit, limit, min_score):
                 'url_comments': 'string of the thread comments url'
             }
     '''
-    # Setup the base and query url
-    base_url = 'https://old.reddit.com'
-    query = f'top.json?sort=top&t=day&limit={limit}'
-    url = f'{base_url}/r/{subreddit}/{query}'
-    
-    # Get the JSon data from the URL
-    async with client.get(url) as query_response:
-        assert query_response.status == 200
-        json_resp = await query_response.read()
-        response = json.loads(json_resp.decode('utf-8'))
-
-    # Build the dictionary data to return
+    base_url = base_url.rstrip('/')
+    if scheduler is None:
+        scheduler = RequestScheduler()
+
+    pages = []
+    requested = 0
+    stopped = False
+
+    # Starts the query for the next page (if more threads are needed). It is
+    # called by each page once it knows that the next page is needed (refer to
+    # `_get_page`), which without a minimum score is as soon as it knows the
+    # cursor, so the next page is already being fetched while the current one
+    # is parsed
+    def request_page(after):
+        nonlocal requested
+        count = min(limit - requested, PAGE_LIMIT)
+        if stopped or count <= 0 or (requested > 0 and not after):
+            return
+
+        query = f'top.json?sort=top&t=day&limit={count}'
+        if after:
+            query += f'&after={after}&count={requested}'
+        url = f'{base_url}/r/{subreddit}/{query}'
+        requested += count
+
+        page = _get_page(client, url, base_url, min_score, stream, request_page,
+                         scheduler, metrics, subreddit, store)
+        pages.append(asyncio.ensure_future(page))
+
+    request_page(None)
+
+    # Get the threads of each page, stopping at the first page in which a
+    # thread below the minimum score is found
     data = []
-    for resp in response['data']['children']:
-        if min_score > 0 and resp['data']['score'] < min_score:
-            break
-
-        item = {
-            'url': resp['data']['url'],
-            'title': resp['data']['title'],
-            'score': resp['data']['score'],
-            'ups': resp['data']['ups'],
-            'downs': resp['data']['downs'],
-            'author': resp['data']['author'],
-            'num_comments': resp['data']['num_comments'],
-            'url_comments': base_url + resp['data']['permalink']
-        }
-        data.append(item)
+    index = 0
+    try:
+        while index < len(pages):
+            threads, cutoff = await pages[index]
+            index += 1
+            data.extend(threads)
+            if cutoff:
+                break
+    finally:
+        stopped = True
+        for page in pages[index:]:
+            page.cancel()
+            page.add_done_callback(_discard_result)
+
+    return data[:limit]
+
+# ------------------------------------------------------------------------------
+def _discard_result(task):
+    '''Retrieves (and ignores) the result of a task that is no longer needed,
+    so its failure is not reported as never retrieved.'''
+    if not task.cancelled():
+        task.exception()
+
+# ------------------------------------------------------------------------------
+async def _get_page(client, url, base_url, min_score, stream, on_cursor,
+                    scheduler, metrics=None, subreddit=None, store=None):
+    '''Gets the threads in a page of the top threads listing.
+
+    Parameters
+    ----------
+        client (aiohttp.ClientSession). The HTTP session to query the data.
+
+        url (str). The url of the page.
+
+        base_url (str). The base url of the reddit server.
+
+        min_score (int). The minimum score for a thread to be considered as top.
+
+        stream (bool). Indicates if the response is parsed as it arrives.
+
+        on_cursor (function). Function called with the cursor of the next page
+        (or None, if there are no more pages) when the next page is needed: as
+        soon as the cursor is known, if there is no minimum score, or else once
+        the whole page is parsed without finding a thread below the minimum
+        score (it is not called if such a thread is found).
+
+        scheduler (RequestScheduler). The scheduler that paces and retries the
+        request.
+
+        metrics (CrawlMetrics). The metrics to record the request in. The
+        default is None, meaning that no metrics are recorded.
+
+        subreddit (str). The name of the subreddit (used to label the metrics).
+        The default is None.
+
+        store (SnapshotStore). The store of snapshots of the pages. If given,
+        the request is conditional on the validators of the snapshot of the
+        page (if any), and a response with HTTP status 304 is served from the
+        snapshot. Otherwise, the whole page is read (even after the first
+        thread below the minimum score) and saved as the new snapshot. The
+        default is None.
+
+    Returns
+    -------
+        threads (list). A list of `Thread` records with the threads in the
+        page (up to the first one below the minimum score).
+
+        cutoff (bool). Indicates if a thread below the minimum score was found.
+    '''
+    threads = []
+    cutoff = False
+    clock = time.perf_counter
+    stats = {'bytes': 0, 'parse': 0.0}
+    filter_time = 0.0
+
+    # With a store, the request is conditional on the snapshot of the page, and
+    # all the threads of the page (and its cursor) are kept for a new snapshot.
+    # The accesses to the store block on the disk, so they run in a worker
+    # thread instead of stalling the other queries in the event loop
+    headers = {}
+    page_threads = None
+    if store is not None:
+        snapshot = await asyncio.to_thread(store.get_page, url)
+        if snapshot is not None:
+            if snapshot['etag'] is not None:
+                headers['If-None-Match'] = snapshot['etag']
+            if snapshot['last_modified'] is not None:
+                headers['If-Modified-Since'] = snapshot['last_modified']
+        page_threads = []
+
+    # The cursor of the next page is reported as soon as it is known if there
+    # is no minimum score. Otherwise, the next page is only needed if no
+    # thread of this page is below the minimum, so the cursor is only reported
+    # once the whole page is parsed
+    cursor = []
+
+    def take_cursor(after):
+        cursor.append(after)
+        if min_score <= 0:
+            on_cursor(after)
+
+    start = clock()
+    query_response = await scheduler.request(client, url, subreddit, headers)
+    async with query_response:
+        read_start = clock()
+        if query_response.status == 304:
+            await asyncio.to_thread(store.touch_page, url)
+            take_cursor(snapshot['after'])
+            children = None
+        elif stream:
+            children = _iter_children(query_response.content, take_cursor,
+                                      stats)
+        else:
+            json_resp = await query_response.read()
+            parse_start = clock()
+            listing = _json_loads(json_resp)['data']
+            stats['parse'] = clock() - parse_start
+            stats['bytes'] = len(json_resp)
+            take_cursor(listing.get('after'))
+            children = _as_async(listing['children'])
+
+        # Build the thread records to return (stopping the parsing at the
+        # first thread below the minimum score, unless the whole page is
+        # needed for the store)
+        if children is not None:
+            try:
+                async for resp in children:
+                    filter_start = clock()
+                    if min_score > 0 and resp['data']['score'] < min_score:
+                        cutoff = True
+                        if page_threads is None:
+                            break
+                    thread = _make_thread(resp['data'], base_url)
+                    if not cutoff:
+                        threads.append(thread)
+                    if page_threads is not None:
+                        page_threads.append(thread)
+                    filter_time += clock() - filter_start
+            finally:
+                await children.aclose()
+
+            # The rest of the body (after the cutoff, or after the children
+            # array) is read without being parsed, since a response released
+            # before its end closes the connection instead of returning it to
+            # the pool of the session
+            if stream:
+                async for chunk in query_response.content.iter_any():
+                    stats['bytes'] += len(chunk)
+
+            if page_threads is not None:
+                await asyncio.to_thread(
+                    store.save_page, url, subreddit,
+                    query_response.headers.get('ETag'),
+                    query_response.headers.get('Last-Modified'),
+                    cursor[0] if cursor else None, page_threads)
+
+    # A page that did not change is served from its snapshot
+    if children is None:
+        for thread in snapshot['threads']:
+            if min_score > 0 and thread.score < min_score:
+                cutoff = True
+                break
+            threads.append(thread)
+
+    if min_score > 0 and not cutoff:
+        on_cursor(cursor[0] if cursor else None)
+
+    # The body is read while the threads are parsed and built, so the time
+    # spent reading it is what remains of the whole page
+    if metrics is not None:
+        end = clock()
+        metrics.add_bytes(subreddit, stats['bytes'])
+        metrics.observe(subreddit, 'body',
+                        max(end - read_start - stats['parse'] - filter_time, 0))
+        metrics.observe(subreddit, 'parse', stats['parse'])
+        metrics.observe(subreddit, 'filter', filter_time)
+        metrics.observe(subreddit, 'total', end - start)
+
+    return threads, cutoff
+
+# ------------------------------------------------------------------------------
+def _make_thread(thread_data, base_url):
+    '''Builds the record with the data of a thread, extracting only the
+    attributes used from the data in the reddit response.
+
+    Parameters
+    ----------
+        thread_data (dict). The data of the thread in the reddit response.
+
+        base_url (str). The base url of the reddit server.
+
+    Returns
+    -------
+        thread (Thread). The record with the thread data.
+    '''
+    return Thread(thread_data['url'], thread_data['title'],
+                  thread_data['score'], thread_data['ups'],
+                  thread_data['downs'], thread_data['author'],
+                  thread_data['num_comments'],
+                  base_url + thread_data['permalink'])
+
+# ------------------------------------------------------------------------------
+async def _as_async(items):
+    '''Iterates asynchronously over the given items (so lists can be used
+    where asynchronous iterators are expected).'''
+    for item in items:
+        yield item
+
+# ------------------------------------------------------------------------------
+async def _iter_children(content, on_cursor=None, stats=None):
+    '''Parses the children (i.e. the threads) of a reddit listing as the
+    bytes of the response arrive.
+
+    Parameters
+    ----------
+        content (aiohttp.StreamReader). The stream with the response body.
+
+        on_cursor (function). Function called with the cursor of the next page
+        of the listing (or None, if there are no more pages) as soon as it is
+        known. The default is None.
+
+        stats (dict). A dictionary in which the number of bytes read ('bytes')
+        and the time spent parsing them ('parse') are accumulated. The default
+        is None.
+
+    Yields
+    ------
+        child (dict). The data of each child of the listing, as soon as it is
+        completely received.
+    '''
+    parser = _ChildrenParser()
+    reported = on_cursor is None
+
+    async for chunk in content.iter_any():
+        if stats is None:
+            children = parser.feed(chunk)
+        else:
+            start = time.perf_counter()
+            children = parser.feed(chunk)
+            stats['parse'] += time.perf_counter() - start
+            stats['bytes'] += len(chunk)
+
+        # The cursor usually comes before the children, and then the next page
+        # can be requested right away
+        if not reported and parser.prefix:
+            match = _AFTER.search(parser.prefix)
+            if match is not None:
+                on_cursor(match.group(1))
+                reported = True
+
+        for child in children:
+            yield child
+        if parser.done and reported:
+            return
+
+    for child in parser.feed(b'', final=True):
+        yield child
+    if not reported:
+        match = _AFTER.search(parser.suffix)
+        on_cursor(match.group(1) if match is not None else None)
+
+# ==============================================================================
+class _ChildrenParser:
+    '''An incremental parser of the `data.children` array of a reddit listing.
+
+    The listing is a JSON object in which the `children` array is the first
+    (and only) attribute holding objects, so the parser simply skips the bytes
+    up to that array and then scans them for the boundaries of its items
+    (i.e. the braces outside of strings). Each item is decoded only once, with
+    the fastest JSON backend installed, as soon as all of its bytes are
+    available. Only the bytes of the item being received are kept in memory.
+
+    The braces are first simply counted (with the fast `bytes` methods), and a
+    slice is only taken as an item if it is decoded. If some braces are in
+    strings (e.g. in a title), the item is scanned again skipping the strings:
+    when the count balances but the slice does not decode, when a closing
+    brace is followed by the start of the next item although the count does
+    not balance, or at the latest at the end of the response.
+
+    Attributes
+    ----------
+        prefix (str). The text of the response before the children array.
+
+        suffix (str). The text of the response after the children array.
+
+        done (bool). Indicates if the whole children array was parsed.
+    '''
+
+    # --------------------------------------------------------------------------
+    def __init__(self):
+        '''Creates the parser. The response is expected in UTF-8 (as required
+        for JSON), so the structural characters are single bytes that are never
+        part of other characters.'''
+        self.prefix = ''
+        self.suffix = ''
+        self.done = False
+        self._buffer = bytearray()
+        self._in_array = False
+        self._decoder = codecs.getincrementaldecoder('utf-8')('replace')
+
+        # State of the scan of the current item: the position in the buffer
+        # where it continues, the position where the item starts, the depth of
+        # the braces, if the strings are being skipped (after a failed attempt
+        # to decode the item) and if the scan is inside a string
+        self._pos = 0
+        self._start = 0
+        self._depth = 0
+        self._exact = False
+        self._in_string = False
+
+    # --------------------------------------------------------------------------
+    def feed(self, chunk, final=False):
+        '''Feeds the parser with the next chunk of bytes of the response.
+
+        Parameters
+        ----------
+            chunk (bytes). The chunk of bytes.
+
+            final (bool). Indicates if this is the last chunk of the response.
+            The default is False.
+
+        Returns
+        -------
+            children (list). The children completely received with this chunk.
+        '''
+        if self.done:
+            self.suffix += self._decoder.decode(chunk, final)
+            return []
+
+        buffer = self._buffer
+        buffer += chunk
+        children = []
+
+        if not self._in_array:
+            start = buffer.find(b'"children"')
+            array = buffer.find(b'[', start) if start >= 0 else -1
+            if array >= 0:
+                self.prefix = buffer[:array].decode('utf-8', 'replace')
+                del buffer[:array + 1]
+                self._in_array = True
+
+        if self._in_array:
+            pos = self._pos
+            start = self._start
+            depth = self._depth
+            exact = self._exact
+            in_string = self._in_string
+            size = len(buffer)
+            while pos < size:
+                if depth == 0:
+                    # Skip to the start of the next child (or to the end of
+                    # the array)
+                    pos = _SEPARATOR.match(buffer, pos).end()
+                    if pos == size:
+                        break
+                    if buffer[pos] == _END:
+                        self._in_array = False
+                        self.done = True
+                        self.suffix = self._decoder.decode(buffer[pos + 1:],
+                                                           final)
+                        buffer.clear()
+                        pos = 0
+                        break
+                    if buffer[pos] != _OPEN:
+                        raise ValueError('The response is not a reddit '
+                                         'listing')
+                    start = pos
+                    depth = 1
+                    exact = False
+                    pos += 1
+
+                elif not exact:
+                    # Count the braces up to the next closing one as if none
+                    # of them were in strings (which is almost always true),
+                    # and try to decode the child when they are balanced. A
+                    # slice that decodes is certainly the whole child, since
+                    # it starts at the child and ends at a closing brace
+                    end = buffer.find(b'}', pos)
+                    if end < 0:
+                        depth += buffer.count(b'{', pos)
+                        pos = size
+                        break
+                    depth += buffer.count(b'{', pos, end) - 1
+                    pos = end + 1
+                    if depth > 0:
+                        # The count does not balance, but if the next child
+                        # starts right after the brace, it most likely ends
+                        # this child (with more opening braces than closing
+                        # ones in its strings). While that is not known, the
+                        # brace is scanned again with the next chunk
+                        match = _NEXT_CHILD.match(buffer, pos)
+                        if match.group(1) is not None:
+                            pos = start + 1
+                            depth = 1
+                            exact = True
+                            in_string = False
+                        elif match.end() == size and not final:
+                            depth += 1
+                            pos = end
+                            break
+                    else:
+                        try:
+                            child = _json_loads(bytes(buffer[start:pos]))
+                        except ValueError:
+                            # Some braces are in strings, so the child is
+                            # scanned again, skipping the strings
+                            pos = start + 1
+                            depth = 1
+                            exact = True
+                            in_string = False
+                        else:
+                            children.append(child)
+
+                elif in_string:
+                    # Skip to the closing quote (i.e. the first one preceded by
+                    # an even number of backslashes)
+                    end = buffer.find(b'"', pos)
+                    if end < 0:
+                        pos = size
+                        break
+                    escapes = end
+                    while buffer[escapes - 1] == _BACKSLASH:
+                        escapes -= 1
+                    pos = end + 1
+                    if (end - escapes) % 2 == 0:
+                        in_string = False
+
+                else:
+                    # Skip to the next brace out of the strings (or to the
+                    # start of a string not completely received yet)
+                    pos = _SKIP.match(buffer, pos).end()
+                    if pos == size:
+                        break
+                    char = buffer[pos]
+                    pos += 1
+                    if char == _QUOTE:
+                        in_string = True
+                    elif char == _OPEN:
+                        depth += 1
+                    else:
+                        depth -= 1
+                        if depth == 0:
+                            children.append(
+                                _json_loads(bytes(buffer[start:pos])))
+
+            # Keep only the bytes of the item being received
+            keep = start if depth > 0 else pos
+            del buffer[:keep]
+            self._pos = pos - keep
+            self._start = 0
+            self._depth = depth
+            self._exact = exact
+            self._in_string = in_string
+
+        if final and not self.done:
+            # A child whose braces were only counted is scanned again,
+            # skipping the strings (with braces in its strings, the count may
+            # never balance)
+            if self._depth > 0 and not self._exact:
+                self._pos = 1
+                self._depth = 1
+                self._exact = True
+                self._in_string = False
+                return children + self.feed(b'', final=True)
+            raise ValueError('The response is not a complete reddit listing')
 
-    return data
\ No newline at end of file
+        return children
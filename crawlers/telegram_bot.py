@@ -1,10 +1,19 @@
 import signal
 import sys
 import argparse
+import time
+import queue
 import asyncio
+import threading
+import functools
+import itertools
+from collections import deque
 
+import aiohttp
 import telebot
-from reddit import get_subreddits
+from reddit import fetch_subreddits, iter_subreddits, ThreadCache
+from reddit import RequestScheduler, CrawlMetrics, SnapshotStore, BASE_URL
+from reddit import Histogram, escape_label
 
 # ------------------------------------------------------------------------------
 def signal_handler(_, __):
@@ -13,45 +22,599 @@ def signal_handler(_, __):
     print('The OciosDoOficio Telegram Bot was stopped.')
     sys.exit(0)
 
+# ==============================================================================
+class RedditLoop:
+    '''An asyncio event loop running in a background thread, with a single
+    HTTP session (and its pool of keep-alive connections) shared by all the
+    queries to the reddit server.
+
+    The bot handlers run in regular threads, so they submit the queries to this
+    loop and wait for their results. Since the loop and the session live as long
+    as the bot, the connections (and their TCP and TLS handshakes) are reused
+    between the messages, and a single scheduler paces all the requests
+    according to the rate limit of the reddit server.
+    '''
+
+    # --------------------------------------------------------------------------
+    def __init__(self, max_connections=20, keepalive_timeout=60, cache=None,
+                 metrics=None, base_url=BASE_URL, store=None):
+        '''Starts the event loop thread and opens the HTTP session.
+
+        Parameters
+        ----------
+            max_connections (int). Maximum number of simultaneous connections
+            in the pool. The default is 20.
+
+            keepalive_timeout (float). Time (in seconds) that an idle
+            connection is kept open for reuse. The default is 60.
+
+            cache (reddit.ThreadCache). A cache of the top threads shared by
+            all the queries. The default is None, meaning no cache is used.
+
+            metrics (reddit.CrawlMetrics). The metrics to record all the
+            queries in. The default is None, meaning no metrics are recorded.
+
+            base_url (str). The base url of the reddit server. The default is
+            `reddit.BASE_URL`.
+
+            store (reddit.SnapshotStore). The store of snapshots of the pages
+            queried. The default is None, meaning no store is used.
+        '''
+        self.cache = cache
+        self.metrics = metrics
+        self.base_url = base_url
+        self.store = store
+        self.scheduler = RequestScheduler()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        name='RedditLoop', daemon=True)
+        self._thread.start()
+        self._client = self.run(self._open_client(max_connections,
+                                                  keepalive_timeout))
+
+    # --------------------------------------------------------------------------
+    async def _open_client(self, max_connections, keepalive_timeout):
+        '''Opens the HTTP session (it must be done within the event loop).'''
+        connector = aiohttp.TCPConnector(limit=max_connections,
+                                         keepalive_timeout=keepalive_timeout)
+        trace_configs = []
+        if self.metrics is not None:
+            trace_configs.append(self.metrics.trace_config())
+        return aiohttp.ClientSession(connector=connector,
+                                     trace_configs=trace_configs)
+
+    # --------------------------------------------------------------------------
+    def run(self, coroutine, timeout=None):
+        '''Runs the given coroutine in the event loop, waiting for its result.
+
+        Parameters
+        ----------
+            coroutine (coroutine). The coroutine to run.
+
+            timeout (float). Maximum time (in seconds) to wait for the result.
+            The default is None, meaning to wait for as long as it takes.
+
+        Returns
+        -------
+            result (object). The result of the coroutine.
+        '''
+        future = asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+        return future.result(timeout)
+
+    # --------------------------------------------------------------------------
+    def fetch_subreddits(self, subreddits, **kwargs):
+        '''Gets the top threads for the given subreddits, using the shared HTTP
+        session.
+
+        Parameters
+        ----------
+            subreddits (list). List of strings with the subreddits to query.
+
+            kwargs (dict). Other arguments accepted by
+            `reddit.fetch_subreddits`.
+
+        Returns
+        -------
+            results (list). The records returned by `reddit.fetch_subreddits`.
+        '''
+        return self.run(fetch_subreddits(subreddits, client=self._client,
+                                       cache=self.cache,
+                                       scheduler=self.scheduler,
+                                       metrics=self.metrics,
+                                       base_url=self.base_url,
+                                       store=self.store, **kwargs))
+
+    # --------------------------------------------------------------------------
+    def iter_subreddits(self, subreddits, **kwargs):
+        '''Gets the top threads for the given subreddits, using the shared HTTP
+        session, and yields the data of each subreddit as soon as its query
+        finishes.
+
+        Parameters
+        ----------
+            subreddits (list). List of strings with the subreddits to query.
+
+            kwargs (dict). Other arguments accepted by
+            `reddit.iter_subreddits`.
+
+        Yields
+        ------
+            item (reddit.SubredditResult). The data of a subreddit, as yielded
+            by `reddit.iter_subreddits`.
+        '''
+        results = queue.Queue()
+
+        async def produce():
+            try:
+                async for item in iter_subreddits(subreddits,
+                                                  client=self._client,
+                                                  cache=self.cache,
+                                                  scheduler=self.scheduler,
+                                                  metrics=self.metrics,
+                                                  base_url=self.base_url,
+                                                  store=self.store,
+                                                  **kwargs):
+                    results.put(item)
+            finally:
+                results.put(None)
+
+        future = asyncio.run_coroutine_threadsafe(produce(), self._loop)
+        try:
+            while True:
+                item = results.get()
+                if item is None:
+                    break
+                yield item
+            future.result()
+        finally:
+            future.cancel()
+
+    # --------------------------------------------------------------------------
+    def close(self):
+        '''Closes the HTTP session and stops the event loop thread.'''
+        if self._loop.is_closed():
+            return
+        self.run(self._client.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+# ==============================================================================
+class ChatDispatcher:
+    '''A pool of worker threads that runs the jobs submitted for the chats
+    concurrently, while keeping the jobs of each chat in the order they were
+    submitted.
+
+    Only one job of each chat is in the queue of ready jobs at a time. The next
+    jobs of the same chat wait in a list of that chat, and are moved to the
+    queue as the previous job finishes. The number of jobs pending (queued or
+    running) is bounded, so submitting a job blocks while the workers are busy
+    (i.e. the backpressure is applied to whoever submits the jobs).
+
+    Attributes
+    ----------
+        name (str). The name of the dispatcher (used in the thread names).
+
+        submitted (int). Number of jobs submitted.
+
+        completed (int). Number of jobs run (successfully or not).
+
+        failed (int). Number of jobs that raised an exception.
+
+        rejected (int). Number of jobs not accepted because the queue was full.
+
+        total_wait (float). Total time (in seconds) that the jobs waited before
+        being run.
+
+        max_wait (float). Maximum time (in seconds) that a job waited before
+        being run.
+
+    The times waited are also kept in a histogram (with the buckets of
+    `reddit.CrawlMetrics`), so the statistics can be exported while the jobs
+    are running (refer to function `_format_dispatchers`).
+    '''
+
+    # --------------------------------------------------------------------------
+    def __init__(self, workers=8, max_pending=100, name='ChatDispatcher',
+                 clock=time.monotonic):
+        '''Starts the worker threads.
+
+        Parameters
+        ----------
+            workers (int). Number of worker threads (i.e. maximum number of
+            jobs running at the same time). The default is 8. With 0 workers
+            the jobs are run directly in the thread that submits them.
+
+            max_pending (int). Maximum number of jobs pending (queued or
+            running). The default is 100.
+
+            name (str). The name of the dispatcher. The default is
+            'ChatDispatcher'.
+
+            clock (function). The function that gives the current time, in
+            seconds. The default is `time.monotonic`.
+        '''
+        self.name = name
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._waits = Histogram(CrawlMetrics.BUCKETS)
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(max_pending, 1))
+        self._ready = queue.Queue()
+        self._chats = {}
+        self._pending = 0
+        self._workers = [threading.Thread(target=self._work,
+                                          name=f'{name}-{i}', daemon=True)
+                         for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    # --------------------------------------------------------------------------
+    @property
+    def depth(self):
+        '''Number of jobs pending (queued or running).'''
+        return self._pending
+
+    # --------------------------------------------------------------------------
+    def submit(self, chat_id, function, *args, timeout=None, **kwargs):
+        '''Submits a job for a chat. It blocks while the maximum number of jobs
+        is pending.
+
+        Parameters
+        ----------
+            chat_id (int). The identifier of the chat. The jobs of a same chat
+            are run one at a time, in the order they were submitted.
+
+            function (function). The function to run.
+
+            args, kwargs. The arguments to call the function with.
+
+            timeout (float). Maximum time (in seconds) to wait for room in the
+            queue. The default is None, meaning to wait for as long as it
+            takes.
+
+        Returns
+        -------
+            accepted (bool). Indication if the job was accepted (False if the
+            timeout expired with the queue still full).
+        '''
+        if not self._slots.acquire(timeout=timeout):
+            with self._lock:
+                self.rejected += 1
+            return False
+
+        job = (chat_id, self._clock(), function, args, kwargs)
+        with self._lock:
+            self.submitted += 1
+            self._pending += 1
+            if not self._workers:
+                ready = None
+            elif chat_id in self._chats:
+                self._chats[chat_id].append(job)
+                ready = None
+            else:
+                self._chats[chat_id] = deque()
+                ready = job
+
+        if not self._workers:
+            self._run(job)
+        elif ready is not None:
+            self._ready.put(ready)
+        return True
+
+    # --------------------------------------------------------------------------
+    def _work(self):
+        '''Main function of the worker threads.'''
+        while True:
+            job = self._ready.get()
+            if job is None:
+                return
+
+            self._run(job)
+
+            # Moves the next job of the same chat (if any) to the queue
+            with self._lock:
+                chat_jobs = self._chats[job[0]]
+                if chat_jobs:
+                    self._ready.put(chat_jobs.popleft())
+                else:
+                    del self._chats[job[0]]
+
+    # --------------------------------------------------------------------------
+    def _run(self, job):
+        '''Runs a job, updating the statistics.'''
+        _, submitted_at, function, args, kwargs = job
+        wait = self._clock() - submitted_at
+        try:
+            function(*args, **kwargs)
+        except Exception as error:
+            with self._lock:
+                self.failed += 1
+            name = getattr(function, '__name__', repr(function))
+            print(f'{self.name}: {name} failed: '
+                  f'{type(error).__name__}: {error}', file=sys.stderr)
+        finally:
+            with self._lock:
+                self.completed += 1
+                self._pending -= 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+                self._waits.observe(wait)
+            self._slots.release()
+
+    # --------------------------------------------------------------------------
+    def stats(self):
+        '''Gets the statistics of the dispatcher.
+
+        Returns
+        -------
+            stats (dict). The current queue depth, the number of jobs
+            submitted, completed, failed and rejected, the average and
+            maximum time (in seconds) that the jobs waited before being run,
+            and the histogram of those times ('wait_buckets', a list of
+            (upper bound, cumulative count) pairs, the last bound being '+Inf',
+            and 'wait_sum', the total time waited).
+        '''
+        with self._lock:
+            return {
+                'depth': self._pending,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'rejected': self.rejected,
+                'avg_wait': self.total_wait / self.completed
+                            if self.completed else 0.0,
+                'max_wait': self.max_wait,
+                'wait_buckets': list(zip(
+                    self._waits.bounds + ('+Inf',),
+                    itertools.accumulate(self._waits.counts))),
+                'wait_sum': self._waits.sum
+            }
+
+    # --------------------------------------------------------------------------
+    def close(self, wait=True):
+        '''Stops the worker threads.
+
+        Parameters
+        ----------
+            wait (bool). Indicates if the jobs already queued are run before
+            the workers stop. The default is True.
+        '''
+        if wait:
+            while self._pending:
+                time.sleep(0.05)
+        for _ in self._workers:
+            self._ready.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+# ------------------------------------------------------------------------------
+def _format_dispatchers(dispatchers):
+    '''Formats the statistics of the dispatchers in the Prometheus text format
+    (e.g. to be added as a collector of `reddit.CrawlMetrics`), so the
+    backpressure can be observed while the bot is running.
+
+    Parameters
+    ----------
+        dispatchers (list). The dispatchers (`ChatDispatcher`).
+
+    Returns
+    -------
+        text (str). The metrics `telegram_dispatcher_queue_depth` (a gauge),
+        `telegram_dispatcher_jobs_total` (a counter labeled by outcome:
+        submitted, completed, failed or rejected) and
+        `telegram_dispatcher_wait_seconds` (a histogram), labeled by the name
+        of the dispatcher.
+    '''
+    stats = [(escape_label(dispatcher.name), dispatcher.stats())
+             for dispatcher in dispatchers]
+
+    lines = ['# HELP telegram_dispatcher_queue_depth Jobs pending (queued or '
+             'running).',
+             '# TYPE telegram_dispatcher_queue_depth gauge']
+    for name, entry in stats:
+        lines.append(f'telegram_dispatcher_queue_depth{{dispatcher="{name}"}} '
+                     f'{entry["depth"]}')
+
+    lines.append('# HELP telegram_dispatcher_jobs_total Jobs submitted, '
+                 'completed, failed and rejected (queue full).')
+    lines.append('# TYPE telegram_dispatcher_jobs_total counter')
+    for name, entry in stats:
+        for outcome in ('submitted', 'completed', 'failed', 'rejected'):
+            lines.append(f'telegram_dispatcher_jobs_total{{dispatcher='
+                         f'"{name}",outcome="{outcome}"}} {entry[outcome]}')
+
+    lines.append('# HELP telegram_dispatcher_wait_seconds Time that the jobs '
+                 'waited before being run.')
+    lines.append('# TYPE telegram_dispatcher_wait_seconds histogram')
+    metric = 'telegram_dispatcher_wait_seconds'
+    for name, entry in stats:
+        for bound, count in entry['wait_buckets']:
+            lines.append(f'{metric}_bucket{{dispatcher="{name}",le="{bound}"}} '
+                         f'{count}')
+        lines.append(f'{metric}_sum{{dispatcher="{name}"}} {entry["wait_sum"]}')
+        lines.append(f'{metric}_count{{dispatcher="{name}"}} '
+                     f'{entry["completed"]}')
+
+    return '\n'.join(lines) + '\n'
+
 # ------------------------------------------------------------------------------
-def _get_reddit_data(subreddits):
+def _iter_reddit_chunks(subreddits, reddit_loop=None, max_len=3000, header=''):
+    '''Gets the data for the given subreddits, formatted in chunks of text
+    ready to be sent to Telegram.
+
+    The data of each subreddit is formatted as soon as its query finishes. The
+    first chunk is sent as soon as the first subreddit is ready (so the user
+    gets an answer while the other subreddits are still being queried), and
+    the next ones only when they are full (so the answer takes as few
+    messages as possible). The chunks are cut only between threads (unless a
+    single thread is longer than the maximum length).
+
+    Parameters
+    ----------
+        subreddits (list). List of strings with the subreddits to query.
+
+        reddit_loop (RedditLoop). The background event loop (and HTTP session)
+        to run the queries in. The default is None, in which case a new event
+        loop and session are created just for this call.
+
+        max_len (int). Maximum length of each chunk. The default is 3000, which
+        leaves a margin below the maximum length of the Telegram messages
+        (4096, counted in UTF-16 units, so the emojis and other characters
+        out of the basic plane count twice).
+
+        header (str). Text to prepend to the first chunk. The default is an
+        empty string.
+
+    Yields
+    ------
+        text (str). A chunk of the formatted text, with at most `max_len`
+        characters.
+    '''
+    if reddit_loop is not None:
+        data = reddit_loop.iter_subreddits(subreddits)
+    else:
+        data = _run_async_iter(iter_subreddits(subreddits))
+
+    chunk = [header, '=' * 30 + '\n', 'O QUE "BOMBA" NO REDDIT HOJE' + '\n',
+             '=' * 30 + '\n']
+    length = sum(len(block) for block in chunk)
+    flushed = False
+
+    for count, item in enumerate(data, 1):
+        for block in _format_subreddit(item):
+            if length + len(block) > max_len and length > 0:
+                yield ''.join(chunk)
+                chunk = []
+                length = 0
+                flushed = True
+
+            if len(block) > max_len:
+                parts = telebot.util.split_string(block, max_len)
+                yield from parts[:-1]
+                block = parts[-1]
+                flushed = True
+
+            chunk.append(block)
+            length += len(block)
+
+        # The text of the first subreddit is sent as soon as it is ready (but
+        # the closing line goes along with the last one)
+        if not flushed and count < len(subreddits) and length > 0:
+            yield ''.join(chunk)
+            chunk = []
+            length = 0
+            flushed = True
+
+    footer = '=' * 30 + '\n'
+    if length + len(footer) > max_len:
+        yield ''.join(chunk)
+        chunk = []
+    chunk.append(footer)
+    yield ''.join(chunk)
+
+# ------------------------------------------------------------------------------
+def _format_subreddit(item):
+    '''Formats the data of a subreddit.
+
+    Parameters
+    ----------
+        item (reddit.SubredditResult). The data of the subreddit.
+
+    Yields
+    ------
+        block (str). The text of the title of the subreddit, and then the text
+        of each of its threads (or a message if there are no threads).
+    '''
+    yield f'ASSUNTO: {item.subreddit}\n' + '-' * 30 + '\n\n'
+
+    if item.error is not None:
+        yield '\tNão consegui consultar esse assunto agora. Tente de novo ' \
+              'daqui a pouco.\n\n'
+    elif len(item.threads) > 0:
+        for thread in item.threads:
+            yield f'TÍTULO: {thread.title}\n' \
+                  f'PONTUAÇÃO: {thread.score}\n' \
+                  f'URL: {thread.url}\n' \
+                  f'COMENTÁRIOS: {thread.url_comments}\n\n'
+    else:
+        yield '\tAinda não há threads "bombando" para esse assunto\n\n'
+
+# ------------------------------------------------------------------------------
+def _run_async_iter(iterator):
+    '''Runs an asynchronous iterator in a new event loop, yielding its items
+    synchronously.
+
+    Parameters
+    ----------
+        iterator (async iterator). The asynchronous iterator to run.
+
+    Yields
+    ------
+        item (object). Each item of the iterator.
+    '''
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(iterator.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(iterator.aclose())
+        loop.close()
+
+# ------------------------------------------------------------------------------
+def _get_reddit_data(subreddits, reddit_loop=None):
     '''Gets the data for the given subreddits.
 
     Parameters
     ----------
         subreddits (list). List of strings with the subreddits to query.
 
+        reddit_loop (RedditLoop). The background event loop (and HTTP session)
+        to run the queries in. The default is None, in which case a new event
+        loop and session are created just for this call.
+
     Returns
     -------
         text (str). The formatted text with the data queried for the subreddits
-        and ready to be sent back to the Telegram via a new (or reply) message.
-        Important: This text might be very large, so you should break it up
-        into chunks of a maximum length of 3000 bytes in order to send back
-        to Telegram without impairing the system.
+        (in the order their queries finished). Important: This text might be
+        very large, so prefer `_iter_reddit_chunks` to get it in chunks ready
+        to be sent to Telegram.
     '''
-    data = asyncio.run(get_subreddits(subreddits))
-    text = '=' * 30 + '\n'
-    text += 'O QUE "BOMBA" NO REDDIT HOJE' + '\n'
-    text += '=' * 30 + '\n'
-
-    for item in data:
-        text += f'ASSUNTO: {item["subreddit"]}' + '\n'
-        text += '-' * 30 + '\n'
-        text += '\n'
-
-        if len(item['threads']) > 0:
-            for thread in item['threads']:
-                text += f'TÍTULO: {thread["title"]}' + '\n'
-                text += f'PONTUAÇÃO: {thread["score"]}' + '\n'
-                text += f'URL: {thread["url"]}' + '\n'
-                text += f'COMENTÁRIOS: {thread["url_comments"]}' + '\n'
-                text += '\n'
-        else:
-            text += '\tAinda não há threads "bombando" para esse assunto' + '\n'
-            text += '\n'
+    return ''.join(_iter_reddit_chunks(subreddits, reddit_loop))
+
+# ------------------------------------------------------------------------------
+def _write_metrics(metrics, path, interval, stop):
+    '''Writes the metrics to a file in the Prometheus text format
+    periodically, until the given event is set (and then one last time).
+
+    Parameters
+    ----------
+        metrics (reddit.CrawlMetrics). The metrics to write.
 
-    text += '=' * 30 + '\n'
-    return text 
+        path (str). The path of the file.
+
+        interval (float). The interval (in seconds) between the writes.
+
+        stop (threading.Event). The event that stops the writing.
+    '''
+    while True:
+        stopped = stop.wait(interval)
+        try:
+            metrics.write_prometheus(path)
+        except OSError as error:
+            print(f'Failed to write the metrics to {path}: {error}',
+                  file=sys.stderr)
+        if stopped:
+            return
 
 # ------------------------------------------------------------------------------
 def main(argv):
@@ -68,12 +631,39 @@ def main(argv):
     '''
     args = parseCommandLine(argv)
 
-    bot = telebot.TeleBot(args.token)
+    # The updates are received by the polling thread and dispatched to the
+    # handlers in a pool of workers, so a slow query does not stall the other
+    # chats. The replies are sent by another pool, so the handlers do not wait
+    # for them either
+    bot = telebot.TeleBot(args.token, threaded=False)
+    cache = ThreadCache(ttl=args.cache_ttl) if args.cache_ttl > 0 else None
+    metrics = CrawlMetrics() if args.metrics_file is not None else None
+    store = SnapshotStore(args.snapshots) if args.snapshots else None
+    reddit_loop = RedditLoop(cache=cache, metrics=metrics, store=store)
+    handlers = ChatDispatcher(args.workers, args.max_queue, name='Handlers')
+    senders = ChatDispatcher(min(args.workers, 4), args.max_queue,
+                             name='Senders')
+
+    def dispatch(handler):
+        '''Makes the handler run in the pool of workers.'''
+        @functools.wraps(handler)
+        def wrapper(message):
+            handlers.submit(message.chat.id, handler, message)
+        return wrapper
+
+    def reply_to(message, text):
+        '''Sends (asynchronously) a reply to the given message.'''
+        senders.submit(message.chat.id, bot.reply_to, message, text)
+
+    def send_message(chat_id, text):
+        '''Sends (asynchronously) a message to the given chat.'''
+        senders.submit(chat_id, bot.send_message, chat_id, text)
 
     # Handler of the /start command (simply introduces the bot)
     @bot.message_handler(commands=['start'])
+    @dispatch
     def welcome_handler(message):
-        bot.reply_to(message, 'Olá, eu sou o bot Ócios do Ofício. Nome da hora, '
+        reply_to(message, 'Olá, eu sou o bot Ócios do Ofício. Nome da hora, '
         'diz aí? hehe Enfim, seja bem vindo(a)!\n\nEu existo pra ajudar quem '
         'está ocioso (eu usava outro termo antes, mas o chefe pediu pra eu ser '
         'mais agradável). Posso ajudar você a se divertir ou a aprender algo de '
@@ -84,8 +674,9 @@ def main(argv):
 
     # Handler of the /help command (presents the available commands)
     @bot.message_handler(commands=['help'])
+    @dispatch
     def help_handler(message):
-        bot.reply_to(message, 'Assim como você, eu também não tenho nadica de '
+        reply_to(message, 'Assim como você, eu também não tenho nadica de '
         'nada pra fazer. Então, eu vou te ajudar, vai.\nEis o que você pode me '
         'pedir:\n\n/NadaPraFazer algo[;algo mais;outro algo;...] Exibe uma '
         'lista das threads mais bombadas (isto é, com mais de 5 mil pontos) lá '
@@ -94,10 +685,11 @@ def main(argv):
 
     # Handler of the /NadaPraFazer command (gets top threads for subreddits)
     @bot.message_handler(commands=['NadaPraFazer'])
+    @dispatch
     def nothing_to_do_handler(message):
         parts = message.text.split()
         if len(parts) > 2:
-            bot.reply_to(message, 'Você tentou /help? Esse comando requer '
+            reply_to(message, 'Você tentou /help? Esse comando requer '
             'apenas um parâmetro, que é uma lista de '
             'assuntos do Reddit separados por '
             'ponto-e-vírgula. Tenta de novo. Você '
@@ -115,30 +707,55 @@ def main(argv):
             quote += 'assuntos que você pediu:\n\n'
             subreddits = parts[1].split(';')
         
-        whole_text = quote + _get_reddit_data(subreddits)
-
-        # Split the message text in blocks of 3000 characters (so Telegram can
-        # properly handle it)
-        splitted_text = telebot.util.split_string(whole_text, 3000)
-        for text in splitted_text:
-            bot.send_message(message.chat.id, text)
+        # Send the text in blocks of up to 3000 characters (so Telegram can
+        # properly handle it), as soon as each block is full (or the first
+        # subreddit is ready)
+        for text in _iter_reddit_chunks(subreddits, reddit_loop, 3000, quote):
+            send_message(message.chat.id, text)
 
     # Handler of the all other commands (presents feedback on error)
     @bot.message_handler(func=lambda message: True, content_types=['text'])
+    @dispatch
     def command_default(message):
         parts = message.text.split()
         if parts[0].upper() == '/NADAPRAFAZER':
             rest = ' '.join([p for i, p in enumerate(parts) if i > 0])
-            bot.send_message(message.chat.id, f'Você quis dizer /NadaPraFazer {rest}?')
+            send_message(message.chat.id, f'Você quis dizer /NadaPraFazer {rest}?')
         else:
-            bot.send_message(message.chat.id, 'Cuma? Não entendi. Tente a ajuda '
+            send_message(message.chat.id, 'Cuma? Não entendi. Tente a ajuda '
             'em /help.')
 
     signal.signal(signal.SIGINT, signal_handler)
     print('The OciosDoOficio Telegram bot server is started.')
     print('Press Ctrl+C to stop.')
 
-    bot.polling()
+    # The metrics of the queries (and the statistics of the dispatchers) are
+    # written periodically to a file, to be collected by Prometheus (e.g. by
+    # the textfile collector of node_exporter)
+    stop_metrics = threading.Event()
+    if metrics is not None:
+        metrics.add_collector(functools.partial(_format_dispatchers,
+                                                [handlers, senders]))
+        threading.Thread(target=_write_metrics, name='MetricsWriter',
+                         args=(metrics, args.metrics_file,
+                               args.metrics_interval, stop_metrics),
+                         daemon=True).start()
+
+    try:
+        bot.polling()
+    finally:
+        handlers.close()
+        senders.close()
+        reddit_loop.close()
+        stop_metrics.set()
+        if store is not None:
+            store.close()
+        for dispatcher in [handlers, senders]:
+            stats = dispatcher.stats()
+            print(f'{dispatcher.name}: {stats["completed"]} jobs, '
+                  f'{stats["failed"]} failed, {stats["rejected"]} rejected, '
+                  f'wait avg {stats["avg_wait"]:.3f}s '
+                  f'max {stats["max_wait"]:.3f}s')
     return 0
 
 #---------------------------------------------
@@ -166,8 +783,43 @@ def parseCommandLine(argv):
     help='The token created by the @BotFather and used to command the '
     'OciosDoOficioBot bot.', required=True)
 
+    parser.add_argument('-c', '--cache_ttl', metavar='seconds', default=300,
+    type=int, help='Time (in seconds) that the top threads queried for a '
+    'subreddit are cached and reused for other requests. The default value is '
+    '300, and 0 disables the cache.')
+
+    parser.add_argument('-w', '--workers', metavar='value', default=8,
+    type=int, help='Number of messages handled at the same time (the messages '
+    'of a same chat are always handled in order). The default value is 8, and '
+    '0 handles the messages one at a time in the polling thread.')
+
+    parser.add_argument('-q', '--max_queue', metavar='value', default=100,
+    type=int, help='Maximum number of messages waiting to be handled. When '
+    'the queue is full, new messages are only received as the pending ones are '
+    'handled. The default value is 100.')
+
+    parser.add_argument('-m', '--metrics_file', metavar='path',
+    help='Path of a file to write the metrics of the queries to reddit to, in '
+    'the Prometheus text format. The file is rewritten periodically.')
+
+    parser.add_argument('-i', '--metrics_interval', metavar='seconds',
+    default=60, type=float, help='Interval between the writes of the metrics '
+    'file. The default value is 60.')
+
+    parser.add_argument('-d', '--snapshots', metavar='path',
+    help='Path of a SQLite database to keep the snapshots of the pages queried '
+    'in. The pages that did not change since their snapshots are read from the '
+    'database, which also keeps the data across restarts of the bot.')
+
     args = parser.parse_args()
 
+    if args.workers < 0:
+        parser.error('The number of workers can not be negative')
+    if args.max_queue < 1:
+        parser.error('The minimum queue size is 1')
+    if args.metrics_interval <= 0:
+        parser.error('The metrics interval must be positive')
+
     return args
 
 # ------------------------------------------------------------------------------
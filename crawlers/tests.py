@@ -0,0 +1,929 @@
+import unittest
+import asyncio
+import json
+import random
+import threading
+import time
+import aiohttp
+from aiohttp import web
+from reddit import RequestScheduler, RedditHTTPError, RedditRateLimitError
+from reddit import RedditConnectionError, ThreadCache, fetch_subreddits
+from reddit import CrawlMetrics, Thread, SubredditResult, SnapshotStore
+from reddit import _ChildrenParser, _iter_children
+from telegram_bot import ChatDispatcher, _format_dispatchers
+from telegram_bot import _iter_reddit_chunks
+
+# ==============================================================================
+class FakeClock:
+    '''A clock whose time only passes when something sleeps on it, so the tests
+    of the pacing do not depend on (or wait for) the real time.'''
+
+    # --------------------------------------------------------------------------
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    # --------------------------------------------------------------------------
+    def __call__(self):
+        return self.now
+
+    # --------------------------------------------------------------------------
+    async def sleep(self, seconds):
+        '''Advances the time up to the end of the sleep (concurrent sleeps that
+        end at the same time only advance it once).'''
+        self.sleeps.append(seconds)
+        end = self.now + seconds
+        await asyncio.sleep(0)
+        self.now = max(self.now, end)
+
+# ==============================================================================
+class FakeResponse:
+    '''A response of the fake HTTP client.'''
+
+    # --------------------------------------------------------------------------
+    def __init__(self, status=200, headers=None):
+        self.status = status
+        self.headers = headers or {}
+        self.released = False
+
+    # --------------------------------------------------------------------------
+    def release(self):
+        self.released = True
+
+# ==============================================================================
+class FakeClient:
+    '''A fake HTTP client that answers the requests with the given responses
+    (or exceptions, or futures that give the responses), in order, and then
+    with the default response.'''
+
+    # --------------------------------------------------------------------------
+    def __init__(self, responses=(), default=None, clock=None):
+        self.responses = list(responses)
+        self.default = default
+        self.clock = clock
+        self.times = []
+
+    # --------------------------------------------------------------------------
+    async def get(self, url, headers=None, trace_request_ctx=None):
+        self.times.append(self.clock() if self.clock is not None else None)
+        item = self.responses.pop(0) if self.responses else self.default
+        if isinstance(item, asyncio.Future):
+            item = await item
+        if isinstance(item, Exception):
+            raise item
+        await asyncio.sleep(0)
+        if isinstance(item, int):
+            item = FakeResponse(item)
+        return item
+
+# ==============================================================================
+class FakeContent:
+    '''A fake stream of the body of a response, which gives it in chunks.'''
+
+    # --------------------------------------------------------------------------
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    # --------------------------------------------------------------------------
+    async def iter_any(self):
+        for chunk in self.chunks:
+            yield chunk
+
+# ------------------------------------------------------------------------------
+def make_listing(subreddit, count, offset=0, after=None, after_first=True):
+    '''Creates the data of a page of the top threads listing of reddit, with
+    scores decreasing from 10000 (in steps of 10) and the cursor of the next
+    page before (as reddit sends it) or after the children.'''
+    children = []
+    for i in range(offset, offset + count):
+        children.append({'kind': 't3', 'data': {
+            'url': f'https://example.com/{subreddit}/{i}',
+            'title': f'Thread {i} of {subreddit}',
+            'score': 10000 - i * 10,
+            'ups': 10000 - i * 10,
+            'downs': 0,
+            'author': f'user{i}',
+            'num_comments': i,
+            'permalink': f'/r/{subreddit}/comments/{i}/',
+            'selftext': 'text ' * 20,
+            'preview': {'images': [{'id': i, 'resolutions': []}]}
+        }})
+    data = {'after': after, 'dist': count, 'children': children,
+            'before': None}
+    if not after_first:
+        data['after'] = data.pop('after')
+    return {'kind': 'Listing', 'data': data}
+
+# ------------------------------------------------------------------------------
+def split(body, rand):
+    '''Splits the bytes of a body in chunks of random sizes.'''
+    chunks = []
+    start = 0
+    while start < len(body):
+        size = rand.choice([1, 2, 3, 7, 64, 1460, 8192])
+        chunks.append(body[start:start + size])
+        start += size
+    return chunks
+
+# ==============================================================================
+class LocalReddit:
+    '''A local HTTP server that imitates the top threads listing of reddit,
+    with 250 threads in each subreddit. The bodies are sent in small chunks
+    (as they arrive from the real server), and the query and the client port
+    of each request are recorded. The pages have an ETag (that changes with
+    the version of the listings), and the requests with the current one are
+    answered with HTTP status 304.'''
+
+    # --------------------------------------------------------------------------
+    def __init__(self, total=250):
+        self.total = total
+        self.version = 0
+        self.queries = []
+        self.statuses = []
+        self.ports = set()
+        self._runner = None
+        self.base_url = None
+
+    # --------------------------------------------------------------------------
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/r/{subreddit}/top.json', self.top)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, '127.0.0.1', 0).start()
+        host, port = self._runner.addresses[0][:2]
+        self.base_url = f'http://{host}:{port}'
+
+    # --------------------------------------------------------------------------
+    async def stop(self):
+        await self._runner.cleanup()
+
+    # --------------------------------------------------------------------------
+    async def top(self, request):
+        subreddit = request.match_info['subreddit']
+        self.queries.append((subreddit, dict(request.query)))
+        self.ports.add(request.transport.get_extra_info('peername')[1])
+
+        limit = min(int(request.query.get('limit', 25)), 100)
+        after = request.query.get('after')
+        offset = int(after[3:]) if after else 0
+        count = max(min(limit, self.total - offset), 0)
+        next_page = offset + count
+        cursor = f't3_{next_page}' if next_page < self.total else None
+
+        etag = f'"{subreddit}-{offset}-{count}-{self.version}"'
+        if request.headers.get('If-None-Match') == etag:
+            self.statuses.append(304)
+            return web.Response(status=304, headers={'ETag': etag})
+        self.statuses.append(200)
+
+        body = json.dumps(make_listing(subreddit, count, offset,
+                                       cursor)).encode('utf-8')
+        response = web.StreamResponse(
+            headers={'Content-Type': 'application/json', 'ETag': etag})
+        await response.prepare(request)
+        for start in range(0, len(body), 1460):
+            await response.write(body[start:start + 1460])
+        await response.write_eof()
+        return response
+
+# ------------------------------------------------------------------------------
+def quota(remaining, reset, status=200):
+    '''Creates a fake response with the rate limit headers of reddit.'''
+    return FakeResponse(status, {'X-Ratelimit-Remaining': str(remaining),
+                                 'X-Ratelimit-Reset': str(reset)})
+
+# ==============================================================================
+class TestRequestScheduler(unittest.TestCase):
+    '''Performs the unity tests of the scheduler of the reddit requests.'''
+
+    # --------------------------------------------------------------------------
+    def setUp(self):
+        '''Sets up the tests by creating a scheduler with a fake clock.'''
+        self.clock = FakeClock()
+        self.scheduler = RequestScheduler(clock=self.clock,
+                                          sleep=self.clock.sleep)
+
+    # --------------------------------------------------------------------------
+    def request_all(self, client, count):
+        '''Sends the given number of concurrent requests with the scheduler.'''
+        async def run():
+            requests = [self.scheduler.request(client, f'/r/{i}')
+                        for i in range(count)]
+            return await asyncio.wait_for(asyncio.gather(*requests), 5)
+        return asyncio.run(run())
+
+    # --------------------------------------------------------------------------
+    def test_burst(self):
+        '''Tests that a burst of requests within the quota is sent at once,
+        after the single request that learns the quota.'''
+
+        client = FakeClient(default=quota(95, 40), clock=self.clock)
+        responses = self.request_all(client, 10)
+
+        self.assertEqual([response.status for response in responses], [200] * 10)
+        self.assertEqual(client.times, [0.0] * 10)
+        self.assertEqual(self.clock.sleeps, [])
+        self.assertEqual(self.scheduler.remaining, 86)
+
+    # --------------------------------------------------------------------------
+    def test_quota_used_up(self):
+        '''Tests that the requests beyond the quota (less the margin) wait for
+        the quota to be renewed.'''
+
+        client = FakeClient(default=quota(5, 40), clock=self.clock)
+        self.request_all(client, 10)
+
+        # The probe plus 3 requests (keeping the margin of 2) in each period
+        self.assertEqual(sorted(client.times), [0.0] * 4 + [40.0] * 4 +
+                                               [80.0] * 2)
+
+    # --------------------------------------------------------------------------
+    def test_server_errors(self):
+        '''Tests that server errors are retried with backoff and that client
+        errors are not.'''
+
+        client = FakeClient([500, 503, 200])
+        response, = self.request_all(client, 1)
+        self.assertEqual(response.status, 200)
+        self.assertEqual(len(client.times), 3)
+        self.assertEqual(len(self.clock.sleeps), 2)
+
+        client = FakeClient([404, 200])
+        with self.assertRaises(RedditHTTPError) as context:
+            self.request_all(client, 1)
+        self.assertEqual(context.exception.status, 404)
+        self.assertEqual(len(client.times), 1)
+
+        client = FakeClient(default=502)
+        with self.assertRaises(RedditHTTPError) as context:
+            self.request_all(client, 1)
+        self.assertEqual(context.exception.status, 502)
+        self.assertEqual(len(client.times), self.scheduler.max_retries + 1)
+
+        error = aiohttp.ClientConnectionError('refused')
+        client = FakeClient([error, error, 200])
+        response, = self.request_all(client, 1)
+        self.assertEqual(response.status, 200)
+
+        client = FakeClient(default=error)
+        with self.assertRaises(RedditConnectionError):
+            self.request_all(client, 1)
+
+    # --------------------------------------------------------------------------
+    def test_rate_limited(self):
+        '''Tests that requests refused by the rate limit wait for the time given
+        by the server before being retried, and fail after all retries.'''
+
+        refused = FakeResponse(429, {'Retry-After': '10'})
+        client = FakeClient([refused, quota(50, 600)], clock=self.clock)
+        response, = self.request_all(client, 1)
+        self.assertEqual(response.status, 200)
+        self.assertTrue(refused.released)
+        self.assertGreaterEqual(client.times[1], 10.0)
+
+        client = FakeClient(default=refused, clock=self.clock)
+        with self.assertRaises(RedditRateLimitError) as context:
+            self.request_all(client, 1)
+        self.assertEqual(context.exception.status, 429)
+        self.assertEqual(len(client.times), self.scheduler.max_retries + 1)
+
+    # --------------------------------------------------------------------------
+    def test_backoff(self):
+        '''Tests that the backoff delays grow exponentially up to the cap.'''
+
+        scheduler = RequestScheduler(backoff_base=0.5, backoff_cap=4)
+        for attempt in range(8):
+            limit = min(4, 0.5 * 2 ** attempt)
+            delays = [scheduler.backoff(attempt) for _ in range(100)]
+            with self.subTest(attempt):
+                self.assertTrue(all(0 <= delay <= limit for delay in delays))
+                self.assertGreater(max(delays), limit / 2)
+
+    # --------------------------------------------------------------------------
+    def test_probe_owner(self):
+        '''Tests that only the request that probes a new quota period releases
+        the requests waiting for it (and not a request still in flight from
+        the previous period).'''
+
+        async def run():
+            loop = asyncio.get_running_loop()
+            late = loop.create_future()
+            probe = loop.create_future()
+            client = FakeClient([quota(10, 1), late, probe],
+                                default=quota(10, 1), clock=self.clock)
+
+            await self.scheduler.request(client, '/first')
+            in_flight = asyncio.ensure_future(
+                self.scheduler.request(client, '/late'))
+            await asyncio.sleep(0)
+
+            # A new period starts, with a new probe request and another one
+            # waiting for it
+            self.clock.now = 5.0
+            probing = asyncio.ensure_future(
+                self.scheduler.request(client, '/probe'))
+            waiting = asyncio.ensure_future(
+                self.scheduler.request(client, '/waiting'))
+            for _ in range(5):
+                await asyncio.sleep(0)
+            self.assertEqual(len(client.times), 3)
+
+            # The end of the request from the previous period does not
+            # release the waiting one
+            late.set_result(quota(10, 1))
+            await in_flight
+            for _ in range(5):
+                await asyncio.sleep(0)
+            self.assertEqual(len(client.times), 3)
+
+            # The end of the probe does
+            probe.set_result(quota(10, 1))
+            await asyncio.wait_for(asyncio.gather(probing, waiting), 5)
+            self.assertEqual(len(client.times), 4)
+
+        asyncio.run(run())
+
+# ==============================================================================
+class TestThreadCache(unittest.TestCase):
+    '''Performs the unity tests of the cache of top threads.'''
+
+    # --------------------------------------------------------------------------
+    def setUp(self):
+        '''Sets up the tests by creating a cache with a fake clock, and a fetch
+        function that counts its calls.'''
+        self.clock = FakeClock()
+        self.cache = ThreadCache(ttl=60, maxsize=2, clock=self.clock)
+        self.calls = []
+
+    # --------------------------------------------------------------------------
+    def fetch(self, key, delay=0, error=None):
+        '''Creates the function that queries the value of a key.'''
+        async def query():
+            self.calls.append(key)
+            await asyncio.sleep(delay)
+            if error is not None:
+                raise error
+            return f'value of {key}'
+        return query
+
+    # --------------------------------------------------------------------------
+    def get(self, key, **kwargs):
+        '''Gets the value of a key from the cache.'''
+        return asyncio.run(self.cache.get(key, self.fetch(key, **kwargs)))
+
+    # --------------------------------------------------------------------------
+    def test_ttl(self):
+        '''Tests that the entries are served until they expire.'''
+
+        self.assertEqual(self.get('a'), 'value of a')
+        self.clock.now = 59
+        self.assertEqual(self.get('a'), 'value of a')
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+        self.clock.now = 61
+        self.assertEqual(self.get('a'), 'value of a')
+        self.assertEqual(self.calls, ['a', 'a'])
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 2))
+
+    # --------------------------------------------------------------------------
+    def test_lru(self):
+        '''Tests that the least recently used entry is evicted when the cache
+        is full.'''
+
+        self.get('a')
+        self.get('b')
+        self.get('a')
+        self.get('c')
+        self.assertEqual(len(self.cache), 2)
+
+        self.get('a')
+        self.get('c')
+        self.assertEqual(self.calls, ['a', 'b', 'c'])
+        self.get('b')
+        self.assertEqual(self.calls, ['a', 'b', 'c', 'b'])
+
+    # --------------------------------------------------------------------------
+    def test_coalescing(self):
+        '''Tests that concurrent misses of the same entry run a single query,
+        which is not cancelled with one of the requests waiting for it.'''
+
+        async def run():
+            fetch = self.fetch('a', delay=0.05)
+            first = asyncio.ensure_future(self.cache.get('a', fetch))
+            second = asyncio.ensure_future(self.cache.get('a', fetch))
+            third = asyncio.ensure_future(self.cache.get('a', fetch))
+            await asyncio.sleep(0.01)
+            first.cancel()
+            return await asyncio.gather(second, third)
+
+        self.assertEqual(asyncio.run(run()), ['value of a'] * 2)
+        self.assertEqual(self.calls, ['a'])
+        self.assertEqual((self.cache.misses, self.cache.coalesced), (1, 2))
+        self.assertEqual(self.get('a'), 'value of a')
+        self.assertEqual(self.cache.hits, 1)
+
+    # --------------------------------------------------------------------------
+    def test_failures(self):
+        '''Tests that failed queries are not cached.'''
+
+        with self.assertRaises(RedditConnectionError):
+            self.get('a', error=RedditConnectionError('down'))
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.get('a'), 'value of a')
+        self.assertEqual(self.calls, ['a', 'a'])
+
+# ==============================================================================
+class TestChildrenParser(unittest.TestCase):
+    '''Performs the unity tests of the incremental parser of the listings.'''
+
+    # --------------------------------------------------------------------------
+    def setUp(self):
+        '''Sets up the tests by creating a listing with some tricky strings
+        (braces, quotes, escapes and non ASCII characters).'''
+        self.listing = make_listing('tests', 30, after='t3_next')
+        tricky = ['{', '}}', '"{"', '\\', '\\"}', 'ação 😀 {x}', '\n]}', '{{{',
+                  ':{ :{ :{', '}}}', '{"kind": {{']
+        for child, title in zip(self.listing['data']['children'], tricky):
+            child['data']['title'] = title
+        self.listing['data']['children'][12]['data']['selftext'] = \
+            'int main() { if (x) { y(); { z'
+        self.listing['data']['children'][-1]['data']['selftext'] = '{' * 5
+        self.children = self.listing['data']['children']
+
+    # --------------------------------------------------------------------------
+    def parse(self, chunks):
+        '''Parses the chunks of a listing, returning the parser and all the
+        children parsed.'''
+        parser = _ChildrenParser()
+        children = []
+        for chunk in chunks:
+            children.extend(parser.feed(chunk))
+        children.extend(parser.feed(b'', final=True))
+        return parser, children
+
+    # --------------------------------------------------------------------------
+    def test_chunk_splits(self):
+        '''Tests that the children are the same for any split of the body in
+        chunks, with and without indentation and escaping of non ASCII
+        characters.'''
+
+        rand = random.Random(0)
+        for indent, escape in [(None, True), (2, False), (None, False)]:
+            body = json.dumps(self.listing, indent=indent,
+                              ensure_ascii=escape).encode('utf-8')
+            for trial in range(50):
+                with self.subTest((indent, escape, trial)):
+                    parser, children = self.parse(split(body, rand))
+                    self.assertEqual(children, self.children)
+                    self.assertTrue(parser.done)
+                    self.assertIn('"after": "t3_next"', parser.prefix)
+
+        # Byte by byte, the children without braces in their strings come
+        # out one by one, as soon as each one ends
+        body = json.dumps(make_listing('tests', 10)).encode('utf-8')
+        parser = _ChildrenParser()
+        counts = [len(parser.feed(body[i:i + 1]))
+                  for i in range(len(body))]
+        self.assertEqual(sum(counts), 10)
+        self.assertEqual(max(counts), 1)
+        ends = [i for i, count in enumerate(counts) if count]
+        self.assertTrue(all(body[end:end + 1] == b'}' for end in ends))
+
+        # And the ones with unbalanced braces in their strings come out
+        # before the next child ends
+        listing = make_listing('tests', 10)
+        children = listing['data']['children']
+        children[0]['data']['title'] = '{{{'
+        children[3]['data']['selftext'] = 'int main() { if (x) { y(); { z'
+        children[6]['data']['title'] = ':{ :{ :{'
+        body = json.dumps(listing).encode('utf-8')
+        parser = _ChildrenParser()
+        parsed = []
+        for i in range(len(body)):
+            parsed.extend((i, child) for child in parser.feed(body[i:i + 1]))
+        self.assertEqual([child for _, child in parsed], children)
+        ends = [body.index(json.dumps(child).encode('utf-8')) +
+                len(json.dumps(child).encode('utf-8')) - 1
+                for child in children]
+        for (index, _), end, next_end in zip(parsed, ends,
+                                             ends[1:] + [len(body)]):
+            self.assertTrue(end <= index < next_end, (index, end, next_end))
+
+    # --------------------------------------------------------------------------
+    def test_incomplete(self):
+        '''Tests that a body that ends before the end of the children is
+        refused.'''
+
+        body = json.dumps(self.listing).encode('utf-8')
+        with self.assertRaises(ValueError):
+            self.parse([body[:len(body) // 2]])
+        with self.assertRaises(ValueError):
+            self.parse([b'{"error": 500}'])
+
+    # --------------------------------------------------------------------------
+    def test_cursor(self):
+        '''Tests that the cursor of the next page is reported before the
+        children when it comes first, and after them otherwise.'''
+
+        async def run(listing):
+            events = []
+            body = json.dumps(listing).encode('utf-8')
+            content = FakeContent(split(body, random.Random(1)))
+            async for child in _iter_children(content, events.append):
+                events.append(child['data']['num_comments'])
+            return events
+
+        for after_first in [True, False]:
+            for after in ['t3_next', None]:
+                listing = make_listing('tests', 5, after=after,
+                                       after_first=after_first)
+                listing['data']['children'][1]['data']['title'] = '{{{'
+                listing['data']['children'][4]['data']['selftext'] = '{{{'
+                events = asyncio.run(run(listing))
+                with self.subTest((after_first, after)):
+                    if after_first:
+                        self.assertEqual(events, [after, 0, 1, 2, 3, 4])
+                    else:
+                        self.assertEqual(events, [0, 1, 2, 3, 4, after])
+
+    # --------------------------------------------------------------------------
+    def test_cutoff(self):
+        '''Tests that the parsing can stop at any child (e.g. at the first
+        below the minimum score) and the rest of the body is left unparsed.'''
+
+        async def run():
+            body = json.dumps(self.listing).encode('utf-8')
+            content = FakeContent([body[i:i + 100]
+                                   for i in range(0, len(body), 100)])
+            children = _iter_children(content)
+            scores = []
+            async for child in children:
+                if child['data']['score'] < 9900:
+                    break
+                scores.append(child['data']['score'])
+            await children.aclose()
+            return scores
+
+        self.assertEqual(asyncio.run(run()), list(range(10000, 9890, -10)))
+
+# ==============================================================================
+class TestPagination(unittest.IsolatedAsyncioTestCase):
+    '''Performs the unity tests of the queries of the top threads listings, in
+    pages, against a local server.'''
+
+    # --------------------------------------------------------------------------
+    async def asyncSetUp(self):
+        '''Sets up the tests by starting the local server.'''
+        self.server = LocalReddit()
+        await self.server.start()
+
+    # --------------------------------------------------------------------------
+    async def asyncTearDown(self):
+        '''Stops the local server.'''
+        await self.server.stop()
+
+    # --------------------------------------------------------------------------
+    async def fetch(self, limit, min_score, stream=True, client=None):
+        '''Fetches the top threads of a subreddit from the local server.'''
+        result, = await fetch_subreddits(['tests'], limit, min_score,
+                                         client=client, stream=stream,
+                                         base_url=self.server.base_url)
+        self.assertIsNone(result.error)
+        return result.threads
+
+    # --------------------------------------------------------------------------
+    async def test_pages(self):
+        '''Tests that limits larger than a page are queried following the
+        cursors, up to the limit or to the end of the listing.'''
+
+        top = {'sort': 'top', 't': 'day'}
+        expected = [dict(top, limit='100'),
+                    dict(top, limit='100', after='t3_100', count='100'),
+                    dict(top, limit='20', after='t3_200', count='200')]
+        for stream in [True, False]:
+            self.server.queries.clear()
+            threads = await self.fetch(220, 0, stream)
+            with self.subTest(stream):
+                self.assertEqual([thread.num_comments for thread in threads],
+                                 list(range(220)))
+                self.assertEqual([query for _, query in self.server.queries],
+                                 expected)
+
+        self.server.queries.clear()
+        threads = await self.fetch(1000, 0)
+        self.assertEqual(len(threads), 250)
+        self.assertEqual(len(self.server.queries), 3)
+
+    # --------------------------------------------------------------------------
+    async def test_cutoff(self):
+        '''Tests that the threads stop at the minimum score and that no page
+        is requested after the one in which it is reached.'''
+
+        # Scores go down by 10 from 10000, so the 51st thread is below 9500 and
+        # the 151st is below 8500
+        for min_score, count, pages in [(9500, 51, 1), (8500, 151, 2),
+                                        (1, 250, 3)]:
+            for stream in [True, False]:
+                self.server.queries.clear()
+                threads = await self.fetch(300, min_score, stream)
+                with self.subTest((min_score, stream)):
+                    self.assertEqual(len(threads), count)
+                    self.assertTrue(all(thread.score >= min_score
+                                        for thread in threads))
+                    self.assertEqual(len(self.server.queries), pages)
+
+    # --------------------------------------------------------------------------
+    async def test_keep_alive(self):
+        '''Tests that the connection is reused after a response that is not
+        completely parsed (i.e. stopped at the minimum score).'''
+
+        async with aiohttp.ClientSession() as client:
+            for _ in range(5):
+                threads = await self.fetch(100, 9500, client=client)
+                self.assertEqual(len(threads), 51)
+        self.assertEqual(len(self.server.ports), 1)
+
+# ==============================================================================
+class ThreadRecordingStore(SnapshotStore):
+    '''A store of snapshots that records the threads it is accessed from.'''
+
+    # --------------------------------------------------------------------------
+    def __init__(self):
+        super().__init__()
+        self.threads = set()
+
+    # --------------------------------------------------------------------------
+    def get_page(self, url):
+        self.threads.add(threading.get_ident())
+        return super().get_page(url)
+
+    # --------------------------------------------------------------------------
+    def save_page(self, *args):
+        self.threads.add(threading.get_ident())
+        return super().save_page(*args)
+
+    # --------------------------------------------------------------------------
+    def touch_page(self, url):
+        self.threads.add(threading.get_ident())
+        return super().touch_page(url)
+
+# ==============================================================================
+class TestSnapshotStore(unittest.IsolatedAsyncioTestCase):
+    '''Performs the unity tests of the conditional queries with the store of
+    snapshots of the pages, against a local server.'''
+
+    # --------------------------------------------------------------------------
+    async def asyncSetUp(self):
+        '''Sets up the tests by starting the local server and creating a store
+        in memory.'''
+        self.server = LocalReddit()
+        await self.server.start()
+        self.store = ThreadRecordingStore()
+
+    # --------------------------------------------------------------------------
+    async def asyncTearDown(self):
+        '''Stops the local server and closes the store.'''
+        self.store.close()
+        await self.server.stop()
+
+    # --------------------------------------------------------------------------
+    async def fetch(self, stream=True):
+        '''Fetches the top threads of a subreddit, with a minimum score reached
+        in its second page, from the local server.'''
+        result, = await fetch_subreddits(['tests'], 250, 9000, stream=stream,
+                                         base_url=self.server.base_url,
+                                         store=self.store)
+        self.assertIsNone(result.error)
+        return result.threads
+
+    # --------------------------------------------------------------------------
+    async def test_not_modified(self):
+        '''Tests that the pages that did not change are read from the store,
+        and that the ones that changed are saved again.'''
+
+        for stream in [True, False]:
+            self.server.version += 1
+            self.server.statuses.clear()
+            with self.subTest(stream=stream):
+                # The scores go down by 10 from 10000, so the 101 first
+                # threads are above the minimum
+                threads = await self.fetch(stream)
+                self.assertEqual(len(threads), 101)
+                self.assertEqual(self.server.statuses, [200, 200])
+
+                # The pages are saved whole, even after the minimum score
+                self.assertEqual(len(self.store.top_threads(0, 1000)), 200)
+
+                self.assertEqual(await self.fetch(stream), threads)
+                self.assertEqual(self.server.statuses, [200, 200, 304, 304])
+
+                self.server.version += 1
+                self.assertEqual(await self.fetch(stream), threads)
+                self.assertEqual(self.server.statuses[4:], [200, 200])
+
+    # --------------------------------------------------------------------------
+    async def test_worker_threads(self):
+        '''Tests that the store is not accessed from the event loop thread.'''
+
+        await self.fetch()
+        await self.fetch()
+        self.assertEqual(self.server.statuses, [200, 200, 304, 304])
+        self.assertTrue(self.store.threads)
+        self.assertNotIn(threading.get_ident(), self.store.threads)
+
+# ==============================================================================
+class TestChatDispatcher(unittest.TestCase):
+    '''Performs the unity tests of the dispatcher of the jobs of the chats.'''
+
+    # --------------------------------------------------------------------------
+    def test_order(self):
+        '''Tests that the jobs of each chat run one at a time, in the order
+        they were submitted, while the chats run concurrently.'''
+
+        rand = random.Random(7)
+        lock = threading.Lock()
+        running = set()
+        done = {chat_id: [] for chat_id in range(5)}
+        overlaps = []
+
+        def job(chat_id, index, delay):
+            with lock:
+                if chat_id in running:
+                    overlaps.append(chat_id)
+                running.add(chat_id)
+            time.sleep(delay)
+            with lock:
+                running.discard(chat_id)
+                done[chat_id].append(index)
+
+        dispatcher = ChatDispatcher(workers=4, max_pending=10)
+        for index in range(20):
+            for chat_id in done:
+                dispatcher.submit(chat_id, job, chat_id, index,
+                                  rand.random() * 0.002)
+        dispatcher.close()
+
+        self.assertEqual(overlaps, [])
+        for chat_id, indexes in done.items():
+            self.assertEqual(indexes, list(range(20)), chat_id)
+        stats = dispatcher.stats()
+        self.assertEqual((stats['submitted'], stats['completed'],
+                          stats['depth']), (100, 100, 0))
+
+    # --------------------------------------------------------------------------
+    def test_backpressure(self):
+        '''Tests that the submits block (and are rejected at the timeout) while
+        the queue is full, and that it is observed in the exported metrics.'''
+
+        release = threading.Event()
+        dispatcher = ChatDispatcher(workers=1, max_pending=2, name='Handlers')
+        metrics = CrawlMetrics()
+        metrics.add_collector(lambda: _format_dispatchers([dispatcher]))
+
+        self.assertTrue(dispatcher.submit(1, release.wait))
+        self.assertTrue(dispatcher.submit(2, release.wait))
+        start = time.monotonic()
+        self.assertFalse(dispatcher.submit(3, release.wait, timeout=0.05))
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+        text = metrics.to_prometheus()
+        self.assertIn('telegram_dispatcher_queue_depth{dispatcher="Handlers"} '
+                      '2\n', text)
+        self.assertIn('telegram_dispatcher_jobs_total{dispatcher="Handlers",'
+                      'outcome="rejected"} 1\n', text)
+        self.assertIn('telegram_dispatcher_jobs_total{dispatcher="Handlers",'
+                      'outcome="completed"} 0\n', text)
+
+        # A submit without timeout waits for room in the queue
+        submitter = threading.Thread(target=dispatcher.submit,
+                                     args=(3, lambda: None))
+        submitter.start()
+        time.sleep(0.05)
+        self.assertTrue(submitter.is_alive())
+        release.set()
+        submitter.join(1)
+        self.assertFalse(submitter.is_alive())
+        dispatcher.close()
+
+        text = metrics.to_prometheus()
+        self.assertIn('telegram_dispatcher_queue_depth{dispatcher="Handlers"} '
+                      '0\n', text)
+        self.assertIn('telegram_dispatcher_jobs_total{dispatcher="Handlers",'
+                      'outcome="completed"} 3\n', text)
+        self.assertIn('telegram_dispatcher_wait_seconds_bucket{dispatcher='
+                      '"Handlers",le="+Inf"} 3\n', text)
+        self.assertIn('telegram_dispatcher_wait_seconds_count{dispatcher='
+                      '"Handlers"} 3\n', text)
+
+    # --------------------------------------------------------------------------
+    def test_wait_histogram(self):
+        '''Tests the histogram of the times that the jobs waited.'''
+
+        clock = FakeClock()
+        started = threading.Event()
+        release = threading.Event()
+
+        def block():
+            started.set()
+            release.wait()
+
+        # The second job waits (in the fake clock) while the first one runs
+        dispatcher = ChatDispatcher(workers=1, clock=clock)
+        dispatcher.submit(1, block)
+        dispatcher.submit(2, lambda: None)
+        started.wait(1)
+        clock.now += 0.3
+        release.set()
+        dispatcher.close()
+
+        stats = dispatcher.stats()
+        buckets = dict(stats['wait_buckets'])
+        self.assertEqual((buckets[0.0005], buckets[0.25], buckets[0.5],
+                          buckets['+Inf']), (1, 1, 2, 2))
+        self.assertAlmostEqual(stats['wait_sum'], 0.3)
+        self.assertAlmostEqual(stats['max_wait'], 0.3)
+
+# ==============================================================================
+class FakeRedditLoop:
+    '''A fake of the background loop of the bot, which gives the results of
+    the subreddits and records how many were given.'''
+
+    # --------------------------------------------------------------------------
+    def __init__(self, results):
+        self.results = results
+        self.given = 0
+
+    # --------------------------------------------------------------------------
+    def iter_subreddits(self, subreddits):
+        for result in self.results:
+            self.given += 1
+            yield result
+
+# ==============================================================================
+class TestRedditChunks(unittest.TestCase):
+    '''Performs the unity tests of the splitting of the answers of the bot in
+    messages.'''
+
+    # --------------------------------------------------------------------------
+    def make_results(self, subreddits, threads):
+        '''Creates the results of the subreddits, with the given number of
+        threads each.'''
+        return [SubredditResult(f'sub{i}', tuple(
+                    Thread(f'https://www.reddit.com/r/sub{i}/{j}',
+                           f'Thread {j} of sub{i} ' + 'x' * (j * 7 % 50),
+                           10000 - j, 10000 - j, 0, 'author', j,
+                           f'https://www.reddit.com/r/sub{i}/{j}/comments')
+                    for j in range(threads)), None)
+                for i in range(subreddits)]
+
+    # --------------------------------------------------------------------------
+    def test_chunks(self):
+        '''Tests that the first chunk is given as soon as the first subreddit
+        is ready, and the others only when they are full.'''
+
+        results = self.make_results(6, 12)
+        names = [result.subreddit for result in results]
+        loop = FakeRedditLoop(results)
+        chunks = []
+        given = []
+        for chunk in _iter_reddit_chunks(names, loop, header='header\n'):
+            chunks.append(chunk)
+            given.append(loop.given)
+
+        self.assertEqual(given[0], 1)
+        self.assertTrue(chunks[0].startswith('header\n'))
+        self.assertNotIn('sub1', chunks[0])
+        self.assertTrue(all(len(chunk) <= 3000 for chunk in chunks))
+
+        # The chunks are only cut between the threads, and the ones after the
+        # first are full (the next thread would not fit in them)
+        for chunk, following in zip(chunks[1:-1], chunks[2:]):
+            self.assertTrue(chunk.endswith('\n\n'))
+            block = following[:following.index('\n\n') + 2]
+            self.assertGreater(len(chunk) + len(block), 3000)
+
+        text = ''.join(chunks)
+        for result in results:
+            for thread in result.threads:
+                self.assertEqual(text.count(f'TÍTULO: {thread.title}\n'), 1)
+
+    # --------------------------------------------------------------------------
+    def test_single_subreddit(self):
+        '''Tests the chunks of a single subreddit that fits in one message, or
+        that needs more than one.'''
+
+        results = self.make_results(1, 3)
+        chunks = list(_iter_reddit_chunks(['sub0'], FakeRedditLoop(results)))
+        self.assertEqual(len(chunks), 1)
+        self.assertTrue(chunks[0].endswith('=' * 30 + '\n'))
+
+        results = self.make_results(1, 60)
+        chunks = list(_iter_reddit_chunks(['sub0'], FakeRedditLoop(results),
+                                          max_len=1000))
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(chunk) <= 1000 for chunk in chunks))
+
+# ==============================================================================
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,330 @@
+import sys
+import os
+import json
+import time
+import random
+import argparse
+import platform
+import subprocess
+import tracemalloc
+
+from stringutils import word_wrap_text, _iter_paragraphs, _tokenize
+from stringutils import _break_lines, _build_lines
+
+# Names of the shapes of the synthetic corpora
+SHAPES = ['lorem', 'huge_paragraph', 'tiny_paragraphs', 'long_words']
+
+# ------------------------------------------------------------------------------
+def make_corpus(shape, size, seed=0):
+    '''Generates a synthetic text of the given shape and (approximate) size.
+
+    Parameters
+    ----------
+        shape (str). The shape of the text. One of:
+            'lorem': the lorem-ipsum fixture repeated up to the size.
+            'huge_paragraph': the words of the lorem-ipsum fixture in a single
+                paragraph (i.e. without any line feed).
+            'tiny_paragraphs': many paragraphs with 1 to 8 words each, and some
+                empty lines in between.
+            'long_words': random words of 20 to 200 characters (most of them
+                longer than the usual line lengths), in paragraphs of about 2
+                KB.
+
+        size (int). The size of the text, in characters.
+
+        seed (int). The seed for the random generator. The default is 0.
+
+    Returns
+    -------
+        text (str). The generated text.
+    '''
+    folder = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(folder, 'lorem_input.txt'), mode='r',
+              encoding='utf-8') as file:
+        lorem = file.read()
+
+    if shape == 'lorem':
+        text = lorem * (size // len(lorem) + 1)
+
+    elif shape == 'huge_paragraph':
+        words = lorem.split()
+        text = ' '.join(words * (size // len(lorem) + 1))
+
+    elif shape == 'tiny_paragraphs':
+        rand = random.Random(seed)
+        words = lorem.split()
+        parts = []
+        length = 0
+        while length < size:
+            if rand.random() < 0.1:
+                part = ''
+            else:
+                part = ' '.join(rand.choices(words, k=rand.randint(1, 8)))
+            parts.append(part)
+            length += len(part) + 1
+        text = '\n'.join(parts)
+
+    elif shape == 'long_words':
+        rand = random.Random(seed)
+        letters = 'abcdefghijklmnopqrstuvwxyz'
+        parts = []
+        length = 0
+        while length < size:
+            word = ''.join(rand.choices(letters, k=rand.randint(20, 200)))
+            parts.append(word)
+            length += len(word) + 1
+            parts.append('\n' if len(parts) % 20 == 0 else ' ')
+        text = ''.join(parts)
+
+    else:
+        raise ValueError(f'Unknown corpus shape: {shape}')
+
+    return text[:size]
+
+# ------------------------------------------------------------------------------
+def measure_stages(text, max_line_len, justify):
+    '''Measures the time spent in each stage of the wrapping of the given text.
+
+    Parameters
+    ----------
+        text (str). The text to wrap.
+
+        max_line_len (int). The max line length to wrap the text in.
+
+        justify (bool). An indication if the text should be justified.
+
+    Returns
+    -------
+        times (dict). The time, in seconds, spent on tokenizing the paragraphs,
+        on breaking them in lines and on building (and, if required,
+        justifying) the lines.
+    '''
+    times = {'tokenize': 0.0, 'break': 0.0, 'build': 0.0}
+    clock = time.perf_counter
+
+    for start, end in _iter_paragraphs(text):
+        if start == end:
+            continue
+
+        begin = clock()
+        starts, lens = _tokenize(text, start, end)
+        tokenized = clock()
+        bounds = _break_lines(lens, max_line_len)
+        broken = clock()
+        _build_lines(text, starts, lens, bounds, max_line_len, justify)
+        built = clock()
+
+        times['tokenize'] += tokenized - begin
+        times['break'] += broken - tokenized
+        times['build'] += built - broken
+
+    return times
+
+# ------------------------------------------------------------------------------
+def run_benchmark(shape, size, max_line_len, justify, repeat):
+    '''Runs the benchmark of `word_wrap_text` for a corpus.
+
+    Parameters
+    ----------
+        shape (str). The shape of the corpus (refer to `make_corpus`).
+
+        size (int). The size of the corpus, in characters.
+
+        max_line_len (int). The max line length to wrap the text in.
+
+        justify (bool). An indication if the text should be justified.
+
+        repeat (int). The number of times to run each measurement (the best
+        time is reported).
+
+    Returns
+    -------
+        result (dict). The results of the benchmark: the throughput (in MB of
+        input text per second), the peak memory allocated while wrapping (in
+        bytes) and the time spent in each stage (in seconds).
+    '''
+    text = make_corpus(shape, size)
+    megabytes = len(text.encode('utf-8')) / (1 << 20)
+
+    best = float('inf')
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        word_wrap_text(text, max_line_len, justify)
+        best = min(best, time.perf_counter() - begin)
+
+    # The memory is measured in a separate run, since tracing the allocations
+    # slows down the wrapping considerably
+    tracemalloc.start()
+    word_wrap_text(text, max_line_len, justify)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stages = {}
+    for _ in range(repeat):
+        times = measure_stages(text, max_line_len, justify)
+        for stage, value in times.items():
+            stages[stage] = min(stages.get(stage, float('inf')), value)
+
+    return {
+        'shape': shape,
+        'size': size,
+        'max_line_len': max_line_len,
+        'justify': justify,
+        'seconds': best,
+        'mb_per_second': megabytes / best if best > 0 else None,
+        'peak_memory': peak,
+        'stages': stages
+    }
+
+# ------------------------------------------------------------------------------
+def _get_commit():
+    '''Gets the hash of the current git commit, if available.
+
+    Returns
+    -------
+        commit (str). The hash of the commit, or None if it can not be found.
+    '''
+    try:
+        folder = os.path.dirname(os.path.abspath(__file__))
+        output = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=folder,
+                                capture_output=True, text=True, check=True)
+        return output.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# ------------------------------------------------------------------------------
+def compare(report, baseline):
+    '''Prints the throughput of each benchmark in the given report relative to
+    the same benchmark in a baseline report.
+
+    Parameters
+    ----------
+        report (dict). The report of the current run.
+
+        baseline (dict). The report to compare to (e.g. from another commit).
+    '''
+    def key(result):
+        return (result['shape'], result['size'], result['max_line_len'],
+                result['justify'])
+
+    previous = {key(result): result for result in baseline['results']}
+    for result in report['results']:
+        old = previous.get(key(result))
+        if old is None or not old['mb_per_second']:
+            continue
+        ratio = result['mb_per_second'] / old['mb_per_second']
+        print(f'{result["shape"]:>16} size={result["size"]:<10} '
+              f'justify={result["justify"]!s:<5} '
+              f'{result["mb_per_second"]:8.2f} MB/s ({ratio:5.2f}x)',
+              file=sys.stderr)
+
+# ------------------------------------------------------------------------------
+def main(argv):
+    '''Main entry function, called at the beginning of this script.
+
+    Parameters
+    ----------
+        argv (list). List of string arguments received from the command line.
+
+    Returns
+    -------
+        status (int). Status code to be returned to the command line. A negative
+        value indicates an error, and 0 indicates success.
+    '''
+    args = parseCommandLine(argv)
+
+    report = {
+        'commit': _get_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': []
+    }
+
+    for shape in args.shapes:
+        for size in args.sizes:
+            for justify in [False, True]:
+                result = run_benchmark(shape, size, args.max_len, justify,
+                                       args.repeat)
+                report['results'].append(result)
+
+    output = json.dumps(report, indent=2)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, mode='w', encoding='utf-8') as file:
+            file.write(output)
+
+    if args.compare is not None:
+        with open(args.compare, mode='r', encoding='utf-8') as file:
+            compare(report, json.load(file))
+
+    return 0
+
+#---------------------------------------------
+def parseCommandLine(argv):
+    '''Parses the command line of this script.
+    This function uses the argparse package to handle the command line
+    arguments. In case of command line errors, the application will be
+    automatically terminated.
+
+    Parameters
+    ----------
+        argv (list). List of strings with the arguments received from the
+        command line.
+
+    Returns
+    -------
+        args (object). Object with the parsed arguments as attributes
+        (refer to the documentation of the argparse package for details).
+    '''
+    parser = argparse.ArgumentParser(description='Benchmarks the word wrapping '
+                                    'on synthetic corpora of increasing sizes, '
+                                    'reporting the results in JSON.')
+
+    parser.add_argument('-s', '--shapes', metavar='"name[;name;...]"',
+                        default=';'.join(SHAPES),
+                        help='Semicolon-separated list of corpus shapes to use. '
+                        f'The default is all of them ({";".join(SHAPES)}).')
+
+    parser.add_argument('-z', '--sizes', metavar='"kb[;kb;...]"',
+                        default='64;512;4096',
+                        help='Semicolon-separated list of corpus sizes, in KB. '
+                        'The default is "64;512;4096".')
+
+    parser.add_argument('-l', '--max_len', metavar='value', default=80,
+                        type=int, help='Maximum line length. The default value '
+                        'is 80.')
+
+    parser.add_argument('-r', '--repeat', metavar='value', default=3, type=int,
+                        help='Number of times each measurement is repeated (the '
+                        'best time is reported). The default value is 3.')
+
+    parser.add_argument('-o', '--output', metavar='path',
+                        help='Path of the file to write the JSON report to. If '
+                        'not given, the report is printed to the standard '
+                        'output.')
+
+    parser.add_argument('-c', '--compare', metavar='path',
+                        help='Path of a previous JSON report to compare the '
+                        'throughput with (e.g. from another commit).')
+
+    args = parser.parse_args(argv)
+
+    args.shapes = args.shapes.split(';')
+    for shape in args.shapes:
+        if shape not in SHAPES:
+            parser.error(f'Unknown corpus shape: {shape}')
+
+    try:
+        args.sizes = [int(size) * 1024 for size in args.sizes.split(';')]
+    except ValueError:
+        parser.error('The sizes must be integer numbers of KB')
+
+    if args.repeat <= 0:
+        parser.error('The minimum number of repetitions is 1')
+
+    return args
+
+# ------------------------------------------------------------------------------
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
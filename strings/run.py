@@ -1,19 +1,113 @@
-from stringutils import word_wrap_text
+import sys
+import argparse
 
-with open('input.txt', mode='r', encoding='utf-8') as file:
-    _input = file.read()
+from stringutils import word_wrap_text, iter_wrap, wrap_file
 
-max_len = 80
-print(f'Quebra em {max_len} colunas sem justificar:')
-print('-' * max_len)
-_output = word_wrap_text(_input, max_line_len=max_len, justify=False)
-print(_output)
-print('-' * max_len)
+# ------------------------------------------------------------------------------
+def main(argv):
+    '''Main entry function, called at the beginning of this script.
 
-print('')
+    Parameters
+    ----------
+        argv (list). List of string arguments received from the command line.
 
-print(f'Quebra em {max_len} colunas justificando:')
-print('-' * max_len)
-_output = word_wrap_text(_input, max_line_len=max_len, justify=True)
-print(_output)
-print('-' * max_len)
\ No newline at end of file
+    Returns
+    -------
+        status (int). Status code to be returned to the command line. A negative
+        value indicates an error, and 0 indicates success.
+    '''
+    args = parseCommandLine(argv)
+
+    # In the file mode the input file is wrapped straight into the output file
+    if args.input is not None:
+        wrap_file(args.input, args.output, args.max_len, args.justify,
+                  algorithm=args.algorithm)
+        return 0
+
+    # In the streaming mode the text is read from the standard input and
+    # written to the standard output one paragraph at a time
+    if args.stream:
+        for line in iter_wrap(sys.stdin, args.max_len, args.justify,
+                              algorithm=args.algorithm):
+            sys.stdout.write(line + '\n')
+        return 0
+
+    with open('input.txt', mode='r', encoding='utf-8') as file:
+        _input = file.read()
+
+    max_len = args.max_len
+    print(f'Quebra em {max_len} colunas sem justificar:')
+    print('-' * max_len)
+    _output = word_wrap_text(_input, max_line_len=max_len, justify=False)
+    print(_output)
+    print('-' * max_len)
+
+    print('')
+
+    print(f'Quebra em {max_len} colunas justificando:')
+    print('-' * max_len)
+    _output = word_wrap_text(_input, max_line_len=max_len, justify=True)
+    print(_output)
+    print('-' * max_len)
+
+    return 0
+
+#---------------------------------------------
+def parseCommandLine(argv):
+    '''Parses the command line of this script.
+    This function uses the argparse package to handle the command line
+    arguments. In case of command line errors, the application will be
+    automatically terminated.
+
+    Parameters
+    ----------
+        argv (list). List of strings with the arguments received from the
+        command line.
+
+    Returns
+    -------
+        args (object). Object with the parsed arguments as attributes
+        (refer to the documentation of the argparse package for details).
+    '''
+    parser = argparse.ArgumentParser(description='Wraps a text in lines of a '
+                                    'maximum length. Without arguments, it '
+                                    'wraps the sample in input.txt.')
+
+    parser.add_argument('-s', '--stream', action='store_true',
+                        help='Reads the text from the standard input and '
+                        'writes the wrapped text to the standard output, one '
+                        'paragraph at a time (so it runs in constant memory).')
+
+    parser.add_argument('-i', '--input', metavar='path',
+                        help='Path of a file to wrap into the file given by '
+                        '--output. The input file is memory-mapped and wrapped '
+                        'one paragraph at a time, so it can be larger than the '
+                        'available memory.')
+
+    parser.add_argument('-o', '--output', metavar='path',
+                        help='Path of the file to write the wrapped text to '
+                        '(required with --input).')
+
+    parser.add_argument('-l', '--max_len', metavar='value', default=80,
+                        type=int, help='Maximum line length. The default value '
+                        'is 80.')
+
+    parser.add_argument('-j', '--justify', action='store_true',
+                        help='Justifies the wrapped lines (only used in the '
+                        'streaming and file modes).')
+
+    parser.add_argument('-a', '--algorithm', choices=['greedy', 'optimal'],
+                        default='greedy', help='Line breaking algorithm (only '
+                        'used in the streaming and file modes). The default is '
+                        'greedy.')
+
+    args = parser.parse_args(argv)
+
+    if (args.input is None) != (args.output is None):
+        parser.error('The arguments --input and --output must be used together')
+
+    return args
+
+# ------------------------------------------------------------------------------
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,5 +1,295 @@
 import re
 import math
+import os
+import mmap
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat, accumulate
+from bisect import bisect_right
+from array import array
+from collections import OrderedDict, deque
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Minimum text length (in characters) for the parallel wrapping to actually use
+# a process pool; shorter texts are wrapped serially to avoid the pool overhead
+PARALLEL_MIN_LEN = 1 << 20
+
+# Characters that separate the words in a paragraph
+_SEPARATORS = re.compile(r'[(\s+)(\n+)]')
+
+# Number of paragraphs in each block of a WrappedDocument (a block is split
+# again in blocks of this size when it grows to twice this size)
+_DOCUMENT_BLOCK_SIZE = 512
+
+# Ranges of code points (first, last) that may be matched by the separators
+# pattern: the blocks holding all the Unicode whitespace characters, plus the
+# ASCII block (for the other characters listed in the pattern)
+_SEPARATOR_RANGES = [(0x0000, 0x007F), (0x0085, 0x0085), (0x00A0, 0x00A0),
+                     (0x1680, 0x1680), (0x2000, 0x200A), (0x2028, 0x2029),
+                     (0x202F, 0x202F), (0x205F, 0x205F), (0x3000, 0x3000)]
+
+# Code points of the separators (built on demand for the batch wrapping)
+_SEPARATOR_CODES = None
+
+# ------------------------------------------------------------------------------
+def _break_lines(word_lens, max_line_len):
+    '''Finds the boundaries of the lines formed by breaking a sequence of words
+    (given by their lengths) in lines of the given maximum length.
+
+    This is the line breaking engine used by the wrapping functions. It keeps a
+    running length of the current line, so each word is visited only once and
+    the whole paragraph is processed in linear time.
+
+    Parameters
+    ----------
+        word_lens (iterable). The lengths of the words to separate in lines.
+
+        max_line_len (int). The maximum length (i.e. number of columns) for each
+        line, considering the sum of the length of the words and the single
+        space that would be required to separate each word.
+
+    Returns
+    -------
+        bounds (list). A list of tuples `(start, end)` with the indexes of the
+        first word and one past the last word of each line, so the words of a
+        line can be obtained with `words[start:end]`.
+    '''
+    bounds = []
+    start = end = 0
+    line_len = -1
+
+    # A word starts a new line if it would make the current line longer than
+    # the maximum (unless the current line is still empty, in which case the
+    # word is simply too long and it gets a line of its own)
+    for word_len in word_lens:
+        new_len = line_len + 1 + word_len
+        if new_len > max_line_len and end > start:
+            bounds.append((start, end))
+            start = end
+            new_len = word_len
+        line_len = new_len
+        end += 1
+
+    if end > start:
+        bounds.append((start, end))
+
+    return bounds
+
+# ------------------------------------------------------------------------------
+def _word_ends(word_lens):
+    '''Calculates the prefix sums of the word lengths, each word counted with
+    the single space that follows it.
+
+    Parameters
+    ----------
+        word_lens (iterable). The lengths of the words of a paragraph.
+
+    Returns
+    -------
+        ends (list). A list with one more item than the number of words, in
+        which `ends[j] - ends[i] - 1` is the length of the line formed by the
+        words from index `i` up to (but not including) index `j`.
+    '''
+    return list(accumulate((word_len + 1 for word_len in word_lens), initial=0))
+
+# ------------------------------------------------------------------------------
+def _break_lines_by_ends(ends, max_line_len):
+    '''Finds the boundaries of the lines formed by breaking a paragraph in
+    lines of the given maximum length, using the prefix sums calculated by
+    `_word_ends`.
+
+    It produces exactly the same boundaries as `_break_lines`, but since the
+    end of each line is found with a binary search the cost depends on the
+    number of lines instead of the number of words. That makes it cheap to
+    break the same paragraph in many different line lengths.
+
+    Parameters
+    ----------
+        ends (list). The prefix sums of the word lengths, as calculated by
+        `_word_ends`.
+
+        max_line_len (int). The maximum length (i.e. number of columns) for each
+        line.
+
+    Returns
+    -------
+        bounds (list). A list of tuples `(start, end)` with the indexes of the
+        first word and one past the last word of each line.
+    '''
+    bounds = []
+    num_words = len(ends) - 1
+    start = 0
+
+    # The line starting at `start` ends at the last word for which the prefix
+    # sum is within the max length, but it always has at least one word (even
+    # if it is longer than the max length)
+    while start < num_words:
+        limit = ends[start] + max_line_len + 1
+        end = bisect_right(ends, limit, start + 2) - 1
+        bounds.append((start, end))
+        start = end
+
+    return bounds
+
+# ------------------------------------------------------------------------------
+def _min_raggedness(word_lens, first, last, max_line_len):
+    '''Finds the line boundaries that minimize the sum of the squared slack
+    (i.e. the number of unused columns) of the lines formed by a range of
+    words, not counting the last line.
+
+    The minimum cost `f[j]` of breaking the first `j` words is given by the
+    minimum of `f[i] + (max_line_len - width(i, j)) ** 2` for every line of
+    words `i` up to `j` that fits in the max length. Since this cost of a line
+    is a convex function of the difference between two prefix sums, a newer
+    candidate `i` that becomes better than an older one at some `j` stays
+    better for all the following words. So the candidates are kept in a queue,
+    each one with the first word from which it is the best, and only a binary
+    search is needed to insert a new candidate, making the whole process
+    O(n log n) instead of the O(n²) of the naive dynamic programming. The
+    search is limited to the words that fit in a line with the new candidate,
+    so in practice it only depends on the number of words per line.
+
+    Parameters
+    ----------
+        word_lens (sequence). The lengths of the words. None of the words in
+        the range may be longer than the max line length.
+
+        first (int). The index of the first word of the range.
+
+        last (int). The index one past the last word of the range.
+
+        max_line_len (int). The maximum length (i.e. number of columns) for each
+        line.
+
+    Returns
+    -------
+        bounds (list). A list of tuples `(start, end)` with the indexes of the
+        first word and one past the last word of each line.
+    '''
+    num_words = last - first
+    ends = _word_ends(word_lens[idx] for idx in range(first, last))
+    limit = max_line_len + 1
+
+    # Cost of the best breaking of the first `j` words, and the start of the
+    # last line in it. The cost of a line from word `i` up to `j` is the square
+    # of its slack `limit - ends[j] + ends[i]` (infinite if negative)
+    costs = [0] * num_words
+    parents = [0] * num_words
+
+    # The queue of candidates is kept in two lists (the start of the line and
+    # the first word from which it is the best), with the index of its head
+    starts = [0]
+    froms = [1]
+    head = 0
+
+    for j in range(1, num_words):
+        # Drop the candidates that are no longer the best ones
+        while head + 1 < len(starts) and froms[head + 1] <= j:
+            head += 1
+
+        best = starts[head]
+        end_j = ends[j]
+        slack = limit - end_j + ends[best]
+        cost_j = costs[best] + slack * slack if slack >= 0 else math.inf
+        costs[j] = cost_j
+        parents[j] = best
+
+        # Drop the candidates that the new one (i.e. `j`) beats right from the
+        # word they would start being the best (a line starting at `j` that
+        # does not fit can not fit from an older start either)
+        while froms[-1] > j:
+            older = starts[-1]
+            end_m = ends[froms[-1]]
+            new = limit - end_m + end_j
+            old = limit - end_m + ends[older]
+            if new >= 0 and old >= 0 and \
+               cost_j + new * new > costs[older] + old * old:
+                break
+            starts.pop()
+            froms.pop()
+
+        # Find (by binary search) the first word from which the new candidate
+        # beats the last of them. It is never after the last word that fits in
+        # a line starting at `j`, so the search is limited to a single line
+        older = starts[-1]
+        end_older = ends[older]
+        cost_older = costs[older]
+        low = max(froms[-1], j + 1)
+        high = min(bisect_right(ends, end_j + limit, j), num_words)
+        while low < high:
+            middle = (low + high) // 2
+            end_m = ends[middle]
+            new = limit - end_m + end_j
+            old = limit - end_m + end_older
+            if old < 0 or cost_j + new * new <= cost_older + old * old:
+                high = middle
+            else:
+                low = middle + 1
+        if low < num_words:
+            starts.append(j)
+            froms.append(low)
+
+    # The last line does not count in the cost, so it starts at the word that
+    # gives the least cost among all that allow it to fit in the max length
+    start = num_words - 1
+    best = start
+    while start > 0 and ends[num_words] - ends[start - 1] <= limit:
+        start -= 1
+        if costs[start] < costs[best]:
+            best = start
+
+    bounds = [(first + best, last)]
+    end = best
+    while end > 0:
+        start = parents[end]
+        bounds.append((first + start, first + end))
+        end = start
+
+    bounds.reverse()
+    return bounds
+
+# ------------------------------------------------------------------------------
+def _break_lines_optimal(word_lens, max_line_len):
+    '''Finds the boundaries of the lines formed by breaking a sequence of words
+    (given by their lengths) in lines of the given maximum length, minimizing
+    the raggedness of the lines (i.e. the sum of their squared slack) instead of
+    simply filling each line as much as possible.
+
+    The words longer than the max line length always get a line of their own,
+    so the words in between them are broken independently (and the line before
+    such a word does not count in the cost, just like the last line of the
+    paragraph).
+
+    Parameters
+    ----------
+        word_lens (sequence). The lengths of the words to separate in lines.
+
+        max_line_len (int). The maximum length (i.e. number of columns) for each
+        line.
+
+    Returns
+    -------
+        bounds (list). A list of tuples `(start, end)` with the indexes of the
+        first word and one past the last word of each line.
+    '''
+    bounds = []
+    first = 0
+    for index, word_len in enumerate(word_lens):
+        if word_len > max_line_len:
+            if index > first:
+                bounds.extend(_min_raggedness(word_lens, first, index,
+                                              max_line_len))
+            bounds.append((index, index + 1))
+            first = index + 1
+
+    if first < len(word_lens):
+        bounds.extend(_min_raggedness(word_lens, first, len(word_lens),
+                                      max_line_len))
+
+    return bounds
 
 # ------------------------------------------------------------------------------
 def _break_by_max_len(words, max_line_len):
@@ -18,101 +308,531 @@ def _break_by_max_len(words, max_line_len):
     -------
         lines (list). A list of lists with a list of words for each line.
     '''
-    lines = []
-    line = []
-
-    # Simply iterate through the words and calculate their summed length to
-    # separate them into different lines with the given maximum length
-    for word in words:
-        new_line = line + [word]
-        line_len = sum(len(word) for word in new_line) + len(new_line) - 1
-
-        if line_len <= max_line_len:
-            line = new_line
-        else:
-            if len(line) > 0:
-                lines.append(line)
-            line = [word]
-
-    if len(line) > 0:
-        lines.append(line)
-
-    return lines
+    bounds = _break_lines([len(word) for word in words], max_line_len)
+    return [words[start:end] for start, end in bounds]
 
 # ------------------------------------------------------------------------------
-def _add_justification_spaces(line, req_line_len):
-    '''Add spaces to the words in the given list so they will produce a line
-    with the exact line length required.
+def _justification_spaces(num_words, needed_spaces):
+    '''Calculates how many extra spaces each word of a line must receive so
+    the line is justified.
 
-    P.S.: This method adds extra needed spaces to the words in the line so it
-    will produce a line with the exact required length when joined by a single
-    space. That means that this function *does not* add the single spaces that
-    will be required to join the list of words later on.
+    The placement follows the "step" rotation described in the README: the
+    spaces are given one at a time, starting at the first word and jumping by
+    the step (circulating the array of words), and the last word only receives
+    a space (to its begining) if it is the very last one needed. Instead of
+    handing out the spaces one by one, the rotation is followed a whole pass
+    over the words at a time, and as soon as a pass starts at a position and
+    step already seen the spaces given in that cycle of passes are multiplied
+    by the number of times the cycle fully repeats. Hence the cost does not
+    depend on the number of spaces needed.
 
     Parameters
     ----------
-        line (list). A list of words of a single line, to have spaces added
-        so the formed line length will be equal to the `req_line_len`.
+        num_words (int). The number of words in the line (at least 2).
 
-        req_line_len (int). The required line length for the line to be
-        justified.
+        needed_spaces (int). The number of spaces to add to the line, besides
+        the single spaces that separate the words.
 
     Returns
     -------
-        justified_line (list). A list of words with extra spaces added to their
-        end, so when they are joined with the regular separated spaces the whole
-        line will be justified to the length given by `req_line_len`.
+        gaps (list). A list with the number of extra spaces to add after each
+        word (the value for the last word is always 0).
+
+        lead (bool). Indicates if a single space must be added before the last
+        word.
     '''
-    # Handle the special cases
-    if len(line) == 0:
-        return line        
-    if len(line) == 1:
-        line_len = len(line[0])
-        needed_spaces = req_line_len - line_len
-        line[0] += ' ' * needed_spaces
-        return line
-
-    existing_spaces = len(line) - 1
-    line_len = sum(len(word) for word in line) + existing_spaces
-    needed_spaces = req_line_len - line_len
+    gaps = [0] * num_words
+    lead = False
+    last = num_words - 1
+
+    existing_spaces = num_words - 1
     step = abs(existing_spaces - needed_spaces)
-    if step <= 0 or step >= len(line):
+    if step <= 0 or step >= num_words:
         step = 1
 
-    # Process each word starting from the first one (index 0),
-    # jumping in the calculated step (i.e. the absolute difference between
-    # the number of needed and existing spaces in the line)    
+    # Each iteration of this loop is a pass over the words, starting at
+    # `word_idx` and jumping in the calculated step until the end of the line
     word_idx = 0
+    seen = {}
+    first_pass = True
     while needed_spaces > 0:
 
-        # If the current word is not the last word in the line,
-        # then add one of the needed spaces to its end
-        if word_idx != len(line) - 1:
-            line[word_idx] += ' '
-            needed_spaces -= 1
+        # The rotation only depends on the position and step at the begining
+        # of a pass, so once they repeat all the following passes repeat too.
+        # The complete cycles are then applied at once, leaving at least two
+        # spaces to be distributed normally (so the special handling of the
+        # last word still happens in the right pass)
+        if seen is not None and not first_pass:
+            state = (word_idx, step)
+            if state in seen:
+                prev_needed, prev_gaps = seen[state]
+                cycle_spaces = prev_needed - needed_spaces
+                cycles = (needed_spaces - 2) // cycle_spaces
+                if cycles > 0:
+                    needed_spaces -= cycles * cycle_spaces
+                    gaps = [gap + cycles * (gap - prev_gap)
+                            for gap, prev_gap in zip(gaps, prev_gaps)]
+                seen = None
+            else:
+                seen[state] = (needed_spaces, gaps[:])
+        first_pass = False
 
-        # If the current word is the last word in the line, then add one of the
-        # needed spaces to its begining *only* if there is just one more space
-        # to conclude
-        elif needed_spaces == 1:
-            line[word_idx] = ' ' + line[word_idx]
-            needed_spaces -= 1
+        while word_idx < num_words and needed_spaces > 0:
+            # If the current word is not the last word in the line, then add
+            # one of the needed spaces to its end
+            if word_idx != last:
+                gaps[word_idx] += 1
+                needed_spaces -= 1
 
-        # Jump to the next word (circulating the array)
-        word_idx += step
-        if word_idx >= len(line):                        
-            word_idx -= len(line)
+            # If the current word is the last word in the line, then add one of
+            # the needed spaces to its begining *only* if there is just one more
+            # space to conclude
+            elif needed_spaces == 1:
+                lead = True
+                needed_spaces -= 1
+
+            word_idx += step
+
+        # Jump back to the begining (circulating the array)
+        if word_idx >= num_words:
+            word_idx -= num_words
 
             # After one complete passing in the array, decrease the step if
             # it will make the exact same "path" over the words in the next
             # passing (i.e. if the step is a multiple of the number of words)
-            if step > 1 and len(line) % step == 0:
+            if step > 1 and num_words % step == 0:
                 step -= 1
 
-    return line
-    
+    return gaps, lead
+
+# ------------------------------------------------------------------------------
+def _justify_line(line, req_line_len):
+    '''Joins the words in the given list producing a justified line, with the
+    exact line length required.
+
+    Parameters
+    ----------
+        line (list). A list of words of a single line.
+
+        req_line_len (int). The required line length for the line to be
+        justified.
+
+    Returns
+    -------
+        justified_line (str). The words joined with as many spaces as needed
+        so the line length is equal to `req_line_len`.
+    '''
+    # Handle the special cases
+    if len(line) == 0:
+        return ''
+    if len(line) == 1:
+        return line[0] + ' ' * (req_line_len - len(line[0]))
+
+    line_len = sum(len(word) for word in line) + len(line) - 1
+    gaps, lead = _justification_spaces(len(line), req_line_len - line_len)
+
+    # Build the whole line in a single join, with the single separating space
+    # plus the extra spaces calculated for each word
+    parts = []
+    for word, gap in zip(line, gaps[:-1]):
+        parts.append(word)
+        parts.append(' ' * (gap + 1))
+    if lead:
+        parts.append(' ')
+    parts.append(line[-1])
+    return ''.join(parts)
+
+# ------------------------------------------------------------------------------
+def _tokenize(text, start=0, end=None):
+    '''Breaks a paragraph of the given text into words, ignoring any number of
+    spaces.
+
+    The words are not copied from the text. Instead, their positions are
+    stored in compact arrays of integers, so the text is only sliced when the
+    wrapped lines are built.
+
+    Parameters
+    ----------
+        text (str). The text containing the paragraph.
+
+        start (int). The index of the first character of the paragraph in the
+        text. The default is 0.
+
+        end (int). The index one past the last character of the paragraph in
+        the text. The default is None, meaning the end of the text.
+
+    Returns
+    -------
+        starts (array). The index of the first character of each word in the
+        text.
+
+        lens (array). The length of each word.
+    '''
+    if end is None:
+        end = len(text)
+
+    starts = array('Q')
+    lens = array('I')
+
+    # Each separator character ends a word (that might be empty, as when there
+    # are two separators in a row)
+    word_start = start
+    for match in _SEPARATORS.finditer(text, start, end):
+        separator = match.start()
+        starts.append(word_start)
+        lens.append(separator - word_start)
+        word_start = separator + 1
+
+    starts.append(word_start)
+    lens.append(end - word_start)
+
+    return starts, lens
+
+# ------------------------------------------------------------------------------
+def _build_lines(text, starts, lens, bounds, max_line_len, justify):
+    '''Builds the text of the lines of a paragraph from the positions of its
+    words in the original text.
+
+    Parameters
+    ----------
+        text (str). The text containing the paragraph.
+
+        starts (array). The index of the first character of each word, as
+        returned by `_tokenize`.
+
+        lens (array). The length of each word, as returned by `_tokenize`.
+
+        bounds (list). The boundaries of each line, as returned by
+        `_break_lines`.
+
+        max_line_len (int). The max line length used to break the paragraph.
+
+        justify (bool). An indication if the lines should be justified (True)
+        or not (False).
+
+    Returns
+    -------
+        lines (list). A list of strings, one for each wrapped line.
+    '''
+    lines = []
+    for line_start, line_end in bounds:
+        line = [text[starts[idx]:starts[idx] + lens[idx]]
+                for idx in range(line_start, line_end)]
+
+        # If justification is needed, join the words with enough spaces so the
+        # length of the line will be exact the value given `max_line_len`.
+        # Otherwise, simply join each word with a single space character
+        if justify:
+            lines.append(_justify_line(line, max_line_len))
+        else:
+            lines.append(' '.join(line))
+
+    return lines
+
+# ------------------------------------------------------------------------------
+def _get_breaker(algorithm):
+    '''Gets the line breaking engine for the given algorithm.
+
+    Parameters
+    ----------
+        algorithm (str). The name of the algorithm: 'greedy' (each line is
+        filled with as many words as possible) or 'optimal' (the raggedness of
+        the lines in each paragraph is minimized).
+
+    Returns
+    -------
+        breaker (function). The function that finds the line boundaries.
+    '''
+    if algorithm == 'greedy':
+        return _break_lines
+    if algorithm == 'optimal':
+        return _break_lines_optimal
+    raise ValueError(f'Unknown line breaking algorithm: {algorithm}')
+
+# ------------------------------------------------------------------------------
+def _wrap_paragraph(text, start, end, max_line_len, justify,
+                    algorithm='greedy'):
+    '''Wraps a single (non-empty) paragraph of the given text.
+
+    Parameters
+    ----------
+        text (str). The text containing the paragraph.
+
+        start (int). The index of the first character of the paragraph.
+
+        end (int). The index one past the last character of the paragraph.
+
+        max_line_len (int). The max line length to be considered when wrapping
+        the paragraph.
+
+        justify (bool). An indication if the lines should be justified (True)
+        or not (False).
+
+        algorithm (str). The line breaking algorithm ('greedy' or 'optimal').
+        The default is 'greedy'.
+
+    Returns
+    -------
+        lines (list). A list of strings, one for each wrapped line.
+    '''
+    # Break the paragraph into words, ignoring any number of spaces
+    starts, lens = _tokenize(text, start, end)
+
+    # Break the words into lines within the limit of max line length given
+    bounds = _get_breaker(algorithm)(lens, max_line_len)
+
+    return _build_lines(text, starts, lens, bounds, max_line_len, justify)
+
+# ------------------------------------------------------------------------------
+def _iter_paragraphs(text):
+    '''Iterates over the paragraphs (i.e. the lines) of the given text without
+    copying them.
+
+    Parameters
+    ----------
+        text (str). The text to iterate over.
+
+    Yields
+    ------
+        start (int). The index of the first character of the paragraph.
+
+        end (int). The index one past the last character of the paragraph.
+    '''
+    start = 0
+    while True:
+        end = text.find('\n', start)
+        if end == -1:
+            yield start, len(text)
+            return
+        yield start, end
+        start = end + 1
+
+# ==============================================================================
+class WrapCache:
+    '''A bounded cache of wrapped paragraphs, with least recently used (LRU)
+    eviction.
+
+    It is useful when the same paragraphs (disclaimers, footers, etc) are
+    wrapped over and over in many different texts: an instance can be given to
+    `word_wrap_text` or `iter_wrap` (through the `cache` argument), so the
+    repeated paragraphs are simply looked up instead of wrapped again. The
+    entries are keyed on the paragraph text, the max line length, the
+    justification flag and the line breaking algorithm.
+
+    Attributes
+    ----------
+        maxsize (int). The maximum number of paragraphs kept in the cache.
+
+        hits (int). The number of lookups that found the paragraph wrapped.
+
+        misses (int). The number of lookups that had to wrap the paragraph.
+    '''
+
+    # --------------------------------------------------------------------------
+    def __init__(self, maxsize=1024):
+        '''Creates the cache.
+
+        Parameters
+        ----------
+            maxsize (int). The maximum number of paragraphs to keep in the
+            cache. The default is 1024.
+        '''
+        self.maxsize = max(maxsize, 0)
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    # --------------------------------------------------------------------------
+    def __len__(self):
+        '''Gets the number of paragraphs currently in the cache.'''
+        return len(self._entries)
+
+    # --------------------------------------------------------------------------
+    def wrap(self, paragraph, max_line_len, justify, algorithm='greedy'):
+        '''Gets the wrapped lines of the given (non-empty) paragraph, either
+        from the cache or by wrapping it (and then storing the result).
+
+        Parameters
+        ----------
+            paragraph (str). The text of the paragraph, without line feeds.
+
+            max_line_len (int). The max line length to be considered when
+            wrapping the paragraph.
+
+            justify (bool). An indication if the lines should be justified
+            (True) or not (False).
+
+            algorithm (str). The line breaking algorithm ('greedy' or
+            'optimal'). The default is 'greedy'.
+
+        Returns
+        -------
+            lines (tuple). The wrapped lines of the paragraph.
+        '''
+        key = (paragraph, max_line_len, justify, algorithm)
+        lines = self._entries.get(key)
+        if lines is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return lines
+
+        self.misses += 1
+        lines = tuple(_wrap_paragraph(paragraph, 0, len(paragraph),
+                                      max_line_len, justify, algorithm))
+        if self.maxsize > 0:
+            self._entries[key] = lines
+            self._evict()
+        return lines
+
+    # --------------------------------------------------------------------------
+    def resize(self, maxsize):
+        '''Changes the maximum number of paragraphs kept in the cache, evicting
+        the least recently used ones if needed.
+
+        Parameters
+        ----------
+            maxsize (int). The new maximum number of paragraphs.
+        '''
+        self.maxsize = max(maxsize, 0)
+        self._evict()
+
+    # --------------------------------------------------------------------------
+    def clear(self):
+        '''Removes all paragraphs from the cache and resets the statistics.'''
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    # --------------------------------------------------------------------------
+    def _evict(self):
+        '''Removes the least recently used paragraphs until the cache size is
+        within the maximum size.'''
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+# ------------------------------------------------------------------------------
+def iter_wrap(source, max_line_len=40, justify=False, cache=None,
+              algorithm='greedy'):
+    '''Wraps the paragraphs read from the given source, yielding the wrapped
+    lines as soon as each paragraph is processed.
+
+    Only one paragraph is kept in memory at a time, so this function can be
+    used to wrap very large files (or standard input) in constant memory.
+
+    Parameters
+    ----------
+        source (iterable). A file object opened in text mode or any iterable
+        of strings, each one being a paragraph (i.e. a line of the text). A
+        trailing line feed in each item is ignored.
+
+        max_line_len (int). The max line length (i.e. max number of columns for
+        each line) to be considered when wrapping the text. The default is 40.
+
+        justify (bool). An indication if the text should be justified (True) or
+        not (False). Refer to `word_wrap_text` for details.
+
+        cache (WrapCache). A cache of wrapped paragraphs to use. The default is
+        None, meaning that no cache is used.
+
+        algorithm (str). The line breaking algorithm. Refer to `word_wrap_text`
+        for details.
+
+    Yields
+    ------
+        line (str). Each wrapped line, without the line feed character. Empty
+        paragraphs produce empty lines, so
+        `'\\n'.join(iter_wrap(text.split('\\n')))` is equal to
+        `word_wrap_text(text)`.
+    '''
+    _get_breaker(algorithm)
+
+    for paragraph in source:
+        if paragraph.endswith('\n'):
+            paragraph = paragraph[:-1]
+
+        # Empty lines are kept as they are
+        if paragraph == '':
+            yield paragraph
+            continue
+
+        if cache is not None:
+            yield from cache.wrap(paragraph, max_line_len, justify, algorithm)
+        else:
+            yield from _wrap_paragraph(paragraph, 0, len(paragraph),
+                                       max_line_len, justify, algorithm)
+
 # ------------------------------------------------------------------------------
-def word_wrap_text(text, max_line_len=40, justify=False):
+def wrap_file(src_path, dst_path, max_line_len=40, justify=False,
+              encoding='utf-8', cache=None, algorithm='greedy'):
+    '''Wraps the text in the given source file, writing the wrapped text to
+    the given destination file.
+
+    The source file is memory-mapped and each paragraph is decoded, wrapped
+    and written through a buffered writer before the next one is read, so
+    neither the whole text nor the whole wrapped text are ever kept in memory.
+    The output is the same as writing the result of `word_wrap_text` for the
+    file contents (read in text mode, so Windows line endings are handled as
+    well).
+
+    Parameters
+    ----------
+        src_path (str). The path of the file with the text to be wrapped.
+
+        dst_path (str). The path of the file to write the wrapped text to. It
+        is overwritten if it already exists.
+
+        max_line_len (int). The max line length (i.e. max number of columns for
+        each line) to be considered when wrapping the text. The default is 40.
+
+        justify (bool). An indication if the text should be justified (True) or
+        not (False). Refer to `word_wrap_text` for details.
+
+        encoding (str). The encoding of both files. It must be an encoding in
+        which the line feed is the single byte 0x0A (like UTF-8, Latin-1 or
+        ASCII). The default is 'utf-8'.
+
+        cache (WrapCache). A cache of wrapped paragraphs to use. The default is
+        None, meaning that no cache is used.
+
+        algorithm (str). The line breaking algorithm. Refer to `word_wrap_text`
+        for details.
+    '''
+    _get_breaker(algorithm)
+
+    with open(src_path, mode='rb') as src, \
+         open(dst_path, mode='w', encoding=encoding, newline='\n',
+              buffering=1 << 20) as dst:
+
+        # Empty files can not be memory-mapped (and produce an empty output)
+        if os.fstat(src.fileno()).st_size == 0:
+            return
+
+        with mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            start = 0
+            size = len(data)
+            first = True
+            while start <= size:
+                end = data.find(b'\n', start)
+                if end == -1:
+                    end = size
+
+                # Ignore the carriage return of Windows line endings
+                stop = end
+                if stop > start and data[stop - 1] == ord('\r'):
+                    stop -= 1
+                paragraph = data[start:stop].decode(encoding)
+                start = end + 1
+
+                for line in iter_wrap((paragraph,), max_line_len, justify,
+                                      cache, algorithm):
+                    if not first:
+                        dst.write('\n')
+                    dst.write(line)
+                    first = False
+
+# ------------------------------------------------------------------------------
+def word_wrap_text(text, max_line_len=40, justify=False, cache=None,
+                   algorithm='greedy'):
     '''Wraps the given text so each line the maximum length. Also justify the
     lines if required.
 
@@ -128,35 +848,786 @@ def word_wrap_text(text, max_line_len=40, justify=False):
         spaces in between the words to guarantee that the all lines have the
         same length after wrapping.
 
+        cache (WrapCache). A cache of wrapped paragraphs to use, so paragraphs
+        repeated across calls are not wrapped again. The default is None,
+        meaning that no cache is used.
+
+        algorithm (str). The line breaking algorithm. With 'greedy' (the
+        default), each line gets as many words as fit in it. With 'optimal',
+        the words are distributed so the sum of the squared slack of the lines
+        in each paragraph (except the last line) is minimized, producing less
+        ragged paragraphs (what looks better when they are justified).
+
     Returns
     -------
         wrapped_text (str). The text wrapped according to the parameters.
     '''
-    # Breaks the text into lines, considering each one a paragraph to be 
+    _get_breaker(algorithm)
+
+    # Breaks the text into lines, considering each one a paragraph to be
     # processed individually
-    paragraphs = text.split('\n')
-    for index, paragraph in enumerate(paragraphs):
-        # Ignore empty lines
+    lines = []
+    for start, end in _iter_paragraphs(text):
+        # Empty lines are kept as they are
+        if start == end:
+            lines.append('')
+        elif cache is not None:
+            lines.extend(cache.wrap(text[start:end], max_line_len, justify,
+                                    algorithm))
+        else:
+            lines.extend(_wrap_paragraph(text, start, end, max_line_len,
+                                         justify, algorithm))
+
+    # Build back the final text by joining each line with a line feed character
+    return '\n'.join(lines)
+
+# ==============================================================================
+class _FenwickTree:
+    '''A Fenwick (binary indexed) tree of non-negative integers, which changes
+    a value and sums the values up to a position in logarithmic time.
+
+    Attributes
+    ----------
+        total (int). The sum of all values.
+    '''
+
+    # --------------------------------------------------------------------------
+    def __init__(self, values):
+        '''Builds the tree in linear time.
+
+        Parameters
+        ----------
+            values (list). The initial values.
+        '''
+        size = len(values)
+        tree = [0]
+        tree.extend(values)
+        for index in range(1, size + 1):
+            parent = index + (index & -index)
+            if parent <= size:
+                tree[parent] += tree[index]
+        self._tree = tree
+        self.total = sum(values)
+
+    # --------------------------------------------------------------------------
+    def add(self, position, delta):
+        '''Adds a delta to a value.
+
+        Parameters
+        ----------
+            position (int). The position of the value.
+
+            delta (int). The amount to add to the value.
+        '''
+        tree = self._tree
+        self.total += delta
+        index = position + 1
+        while index < len(tree):
+            tree[index] += delta
+            index += index & -index
+
+    # --------------------------------------------------------------------------
+    def prefix(self, position):
+        '''Sums the values before a position.
+
+        Parameters
+        ----------
+            position (int). The position one past the last value to sum.
+
+        Returns
+        -------
+            total (int). The sum of the values before the position.
+        '''
+        tree = self._tree
+        total = 0
+        while position > 0:
+            total += tree[position]
+            position -= position & -position
+        return total
+
+    # --------------------------------------------------------------------------
+    def find(self, value):
+        '''Finds the first position at which the running sum of the values
+        exceeds the given value.
+
+        Parameters
+        ----------
+            value (int). The value to search for.
+
+        Returns
+        -------
+            position (int). The position found, or the number of values if
+            their total does not exceed the given value.
+
+            before (int). The sum of the values before that position.
+        '''
+        tree = self._tree
+        size = len(tree) - 1
+        position = 0
+        before = 0
+        step = 1 << size.bit_length() >> 1
+        while step:
+            index = position + step
+            if index <= size and before + tree[index] <= value:
+                position = index
+                before += tree[index]
+            step >>= 1
+        return position, before
+
+# ==============================================================================
+class WrappedDocument:
+    '''A text kept wrapped while it is edited.
+
+    The document is made of paragraphs (the lines of the text, as in
+    `word_wrap_text`), and the wrapped lines of each paragraph are kept. Each
+    edit re-wraps only the paragraphs it touches, so its cost depends on the
+    size of the edit and not on the size of the whole document.
+
+    Attributes
+    ----------
+        max_line_len (int). The max line length used to wrap the paragraphs.
+
+        justify (bool). An indication if the paragraphs are justified.
+
+        algorithm (str). The line breaking algorithm used to wrap the
+        paragraphs ('greedy' or 'optimal').
+    '''
+
+    # --------------------------------------------------------------------------
+    def __init__(self, text='', max_line_len=40, justify=False,
+                 algorithm='greedy', cache=None):
+        '''Creates the document, wrapping the given text.
+
+        Parameters
+        ----------
+            text (str). The initial text of the document. The default is an
+            empty text.
+
+            max_line_len (int). The max line length (i.e. max number of columns
+            for each line). The default is 40.
+
+            justify (bool). An indication if the text should be justified (True)
+            or not (False). The default is False.
+
+            algorithm (str). The line breaking algorithm. Refer to
+            `word_wrap_text` for details. The default is 'greedy'.
+
+            cache (WrapCache). A cache of wrapped paragraphs to use. The
+            default is None, meaning that no cache is used.
+        '''
+        _get_breaker(algorithm)
+
+        self.max_line_len = max_line_len
+        self.justify = justify
+        self.algorithm = algorithm
+        self._cache = cache
+
+        self._paragraphs = text.split('\n')
+        self._lines = [self._wrap(paragraph) for paragraph in self._paragraphs]
+
+        # The paragraphs are grouped in consecutive blocks, and the number of
+        # paragraphs and of characters (including the line feeds) of each
+        # block are kept in Fenwick trees, so an offset of the text is located
+        # in logarithmic time plus a scan of a single block, and an edit only
+        # updates the blocks that it touches
+        size = _DOCUMENT_BLOCK_SIZE
+        counts = []
+        lengths = []
+        for start in range(0, len(self._paragraphs), size):
+            block = self._paragraphs[start:start + size]
+            counts.append(len(block))
+            lengths.append(sum(map(len, block)) + len(block))
+        self._set_blocks(counts, lengths)
+
+    # --------------------------------------------------------------------------
+    def __len__(self):
+        '''Gets the number of paragraphs in the document.'''
+        return len(self._paragraphs)
+
+    # --------------------------------------------------------------------------
+    @property
+    def text(self):
+        '''The text of the document (str).'''
+        return '\n'.join(self._paragraphs)
+
+    # --------------------------------------------------------------------------
+    @property
+    def wrapped_text(self):
+        '''The wrapped text of the document (str), equal to the result of
+        `word_wrap_text` for its text.'''
+        return '\n'.join(self.iter_lines())
+
+    # --------------------------------------------------------------------------
+    def paragraph(self, index):
+        '''Gets the text of a paragraph.
+
+        Parameters
+        ----------
+            index (int). The index of the paragraph.
+
+        Returns
+        -------
+            paragraph (str). The text of the paragraph.
+        '''
+        return self._paragraphs[index]
+
+    # --------------------------------------------------------------------------
+    def lines(self, index):
+        '''Gets the wrapped lines of a paragraph.
+
+        Parameters
+        ----------
+            index (int). The index of the paragraph.
+
+        Returns
+        -------
+            lines (tuple). The wrapped lines of the paragraph.
+        '''
+        return self._lines[index]
+
+    # --------------------------------------------------------------------------
+    def iter_lines(self):
+        '''Iterates over all wrapped lines of the document.
+
+        Yields
+        ------
+            line (str). Each wrapped line, without the line feed character.
+        '''
+        for lines in self._lines:
+            yield from lines
+
+    # --------------------------------------------------------------------------
+    def edit(self, index, text):
+        '''Replaces the text of a paragraph, re-wrapping only it.
+
+        Parameters
+        ----------
+            index (int). The index of the paragraph to replace.
+
+            text (str). The new text of the paragraph. If it contains line
+            feeds, the paragraph is replaced by as many paragraphs.
+
+        Returns
+        -------
+            indexes (range). The indexes of the paragraphs that were changed.
+        '''
+        if index < 0:
+            index += len(self._paragraphs)
+        if not 0 <= index < len(self._paragraphs):
+            raise IndexError('Paragraph index out of range')
+
+        return self._splice(index, index + 1, text)
+
+    # --------------------------------------------------------------------------
+    def replace(self, start, end, text):
+        '''Replaces a range of characters of the document text, re-wrapping
+        only the paragraphs touched by the range.
+
+        Parameters
+        ----------
+            start (int). The offset of the first character to replace.
+
+            end (int). The offset one past the last character to replace (equal
+            to `start` to simply insert the text).
+
+            text (str). The text to put in place of the range.
+
+        Returns
+        -------
+            indexes (range). The indexes of the paragraphs that were changed.
+        '''
+        if not 0 <= start <= end <= self._length():
+            raise IndexError('Text range out of the document')
+
+        first, first_offset = self._locate(start)
+        last, last_offset = self._locate(end)
+        head = self._paragraphs[first][:start - first_offset]
+        tail = self._paragraphs[last][end - last_offset:]
+
+        return self._splice(first, last + 1, head + text + tail)
+
+    # --------------------------------------------------------------------------
+    def paragraph_at(self, offset):
+        '''Finds the paragraph that contains the given offset of the text.
+
+        Parameters
+        ----------
+            offset (int). An offset of the text, from 0 up to its length (the
+            offset of a line feed belongs to the paragraph that it ends). An
+            IndexError is raised for offsets out of this range.
+
+        Returns
+        -------
+            index (int). The index of the paragraph.
+        '''
+        if not 0 <= offset <= self._length():
+            raise IndexError('Text offset out of the document')
+
+        return self._locate(offset)[0]
+
+    # --------------------------------------------------------------------------
+    def _wrap(self, paragraph):
+        '''Wraps a paragraph with the settings of the document.
+
+        Parameters
+        ----------
+            paragraph (str). The text of the paragraph.
+
+        Returns
+        -------
+            lines (tuple). The wrapped lines of the paragraph.
+        '''
+        # Empty lines are kept as they are
         if paragraph == '':
-            continue
+            return ('',)
+        if self._cache is not None:
+            return self._cache.wrap(paragraph, self.max_line_len, self.justify,
+                                    self.algorithm)
+        return tuple(_wrap_paragraph(paragraph, 0, len(paragraph),
+                                     self.max_line_len, self.justify,
+                                     self.algorithm))
 
-        # Break the current paragraph into words, ignoring any number of spaces
-        words = re.split(r'[(\s+)(\n+)]', paragraph)
+    # --------------------------------------------------------------------------
+    def _splice(self, first, last, text):
+        '''Replaces the paragraphs in the given range by the paragraphs of the
+        given text, wrapping only the new ones.
 
-        # Break the words into lines within the limit of max line length given
-        lines = _break_by_max_len(words, max_line_len)
+        Parameters
+        ----------
+            first (int). The index of the first paragraph to replace.
 
-        # If justification is needed, update the lines to add extra spaces
-        # to their words so their length - when joined together with a single
-        # space - will be exact the value given `max_line_len`
-        if justify:
-            for idx, line in enumerate(lines):
-                lines[idx] = _add_justification_spaces(line, max_line_len)
-                
-        # Build back the text for the paragraph by joining each word with a 
-        # single space character and each line with a line feed character
-        paragraphs[index] = '\n'.join([' '.join(line) for line in lines])
-                
-    # Build back the final text by joining each paragraph with a new line feed
-    # character
-    return '\n'.join(paragraphs)
\ No newline at end of file
+            last (int). The index one past the last paragraph to replace.
+
+            text (str). The text of the new paragraphs.
+
+        Returns
+        -------
+            indexes (range). The indexes of the new paragraphs.
+        '''
+        paragraphs = text.split('\n')
+
+        # Take the replaced paragraphs out of the blocks that hold them, and
+        # put the new ones in the block of the first replaced paragraph
+        block, start = self._count_tree.find(first)
+        current = block
+        index = first
+        while index < last:
+            count = self._block_counts[current]
+            end = min(last, start + count)
+            removed = self._paragraphs[index:end]
+            self._add_to_block(current, -len(removed),
+                               -sum(map(len, removed)) - len(removed))
+            index = end
+            start += count
+            current += 1
+        self._add_to_block(block, len(paragraphs),
+                           sum(map(len, paragraphs)) + len(paragraphs))
+
+        self._paragraphs[first:last] = paragraphs
+        self._lines[first:last] = [self._wrap(paragraph)
+                                   for paragraph in paragraphs]
+
+        self._rebalance(block, current)
+        return range(first, first + len(paragraphs))
+
+    # --------------------------------------------------------------------------
+    def _locate(self, offset):
+        '''Finds the paragraph that contains the given offset of the text.
+
+        Parameters
+        ----------
+            offset (int). An offset of the text, from 0 up to its length.
+
+        Returns
+        -------
+            index (int). The index of the paragraph.
+
+            start (int). The offset of the start of the paragraph.
+        '''
+        block, start = self._length_tree.find(offset)
+        first = self._count_tree.prefix(block)
+        last = first + self._block_counts[block]
+        for index in range(first, last - 1):
+            end = start + len(self._paragraphs[index]) + 1
+            if offset < end:
+                return index, start
+            start = end
+        return last - 1, start
+
+    # --------------------------------------------------------------------------
+    def _add_to_block(self, block, count, length):
+        '''Changes the number of paragraphs and of characters of a block.
+
+        Parameters
+        ----------
+            block (int). The index of the block.
+
+            count (int). The number of paragraphs added (or removed, if
+            negative).
+
+            length (int). The number of characters added (or removed, if
+            negative), including the line feeds.
+        '''
+        self._block_counts[block] += count
+        self._block_lengths[block] += length
+        self._count_tree.add(block, count)
+        self._length_tree.add(block, length)
+
+    # --------------------------------------------------------------------------
+    def _rebalance(self, first, last):
+        '''Splits again the paragraphs of a range of blocks changed by an edit,
+        if they are now too big or empty.
+
+        Parameters
+        ----------
+            first (int). The index of the first block changed.
+
+            last (int). The index one past the last block changed.
+        '''
+        size = _DOCUMENT_BLOCK_SIZE
+        if last - first == 1 and self._block_counts[first] <= 2 * size:
+            return
+
+        start = self._count_tree.prefix(first)
+        end = start + sum(self._block_counts[first:last])
+        counts = []
+        lengths = []
+        for index in range(start, end, size):
+            block = self._paragraphs[index:min(index + size, end)]
+            counts.append(len(block))
+            lengths.append(sum(map(len, block)) + len(block))
+
+        self._block_counts[first:last] = counts
+        self._block_lengths[first:last] = lengths
+        self._set_blocks(self._block_counts, self._block_lengths)
+
+    # --------------------------------------------------------------------------
+    def _set_blocks(self, counts, lengths):
+        '''Sets the blocks of paragraphs, building their Fenwick trees.
+
+        Parameters
+        ----------
+            counts (list). The number of paragraphs in each block.
+
+            lengths (list). The number of characters in each block, including
+            the line feed after each paragraph.
+        '''
+        self._block_counts = counts
+        self._block_lengths = lengths
+        self._count_tree = _FenwickTree(counts)
+        self._length_tree = _FenwickTree(lengths)
+
+    # --------------------------------------------------------------------------
+    def _length(self):
+        '''Gets the length of the document text.'''
+        # The last paragraph is not followed by a line feed
+        return self._length_tree.total - 1
+
+# ------------------------------------------------------------------------------
+def wrap_many_widths(text, widths, justify=False):
+    '''Wraps the given text in several different max line lengths at once.
+
+    The text is broken into paragraphs and words (and the prefix sums of the
+    word lengths are calculated) only once, and then reused to break the lines
+    for every width. The result for each width is exactly the same as the one
+    produced by `word_wrap_text`.
+
+    Parameters
+    ----------
+        text (str). The text to be wrapped.
+
+        widths (list). The max line lengths (i.e. max number of columns for
+        each line) to wrap the text in.
+
+        justify (bool or list). An indication if the text should be justified
+        (True) or not (False). It can be either a single value, used for all
+        widths, or a list with one value for each width.
+
+    Returns
+    -------
+        wrapped_texts (list). The wrapped texts, in the same order of the
+        given widths.
+    '''
+    if isinstance(justify, bool):
+        justify = [justify] * len(widths)
+    if len(justify) != len(widths):
+        raise ValueError('The justify flags must match the widths given')
+
+    # Tokenize each paragraph only once (empty paragraphs are kept as None)
+    tokens = []
+    for start, end in _iter_paragraphs(text):
+        if start == end:
+            tokens.append(None)
+        else:
+            starts, lens = _tokenize(text, start, end)
+            tokens.append((starts, lens, _word_ends(lens)))
+
+    # The line boundaries only depend on the width, so they are shared by the
+    # justified and the not justified results of a same width
+    all_bounds = {}
+    for width in widths:
+        if width not in all_bounds:
+            all_bounds[width] = [None if token is None else
+                                 _break_lines_by_ends(token[2], width)
+                                 for token in tokens]
+
+    wrapped_texts = []
+    for width, just in zip(widths, justify):
+        paragraphs = []
+        for token, bounds in zip(tokens, all_bounds[width]):
+            if token is None:
+                paragraphs.append('')
+            else:
+                starts, lens, _ = token
+                lines = _build_lines(text, starts, lens, bounds, width, just)
+                paragraphs.append('\n'.join(lines))
+        wrapped_texts.append('\n'.join(paragraphs))
+
+    return wrapped_texts
+
+# ------------------------------------------------------------------------------
+def _separator_codes():
+    '''Gets the code points of all characters that separate words (i.e. that
+    are matched by the separators pattern).
+
+    The array is built in the first call (by matching only the code points in
+    the known whitespace ranges, instead of the whole Unicode range) and kept
+    for the next ones.
+
+    Returns
+    -------
+        codes (numpy.ndarray). The sorted code points of the separators.
+    '''
+    global _SEPARATOR_CODES
+    if _SEPARATOR_CODES is None:
+        codes = [code for first, last in _SEPARATOR_RANGES
+                 for code in range(first, last + 1)
+                 if _SEPARATORS.match(chr(code))]
+        _SEPARATOR_CODES = np.array(codes, dtype=np.uint32)
+    return _SEPARATOR_CODES
+
+# ------------------------------------------------------------------------------
+def _break_batch_lines(lens, first_words, last_words, max_line_len):
+    '''Finds the boundaries of the lines of many paragraphs at once, using
+    vectorised operations from NumPy.
+
+    The words of all paragraphs are given in a single sequence, and the
+    prefix sums of their lengths are calculated for the whole batch. Then, in
+    each round, the end of the current line of every paragraph is found at
+    once with a binary search over those prefix sums. Hence the number of
+    rounds is the number of lines of the longest paragraph, and not the total
+    number of lines in the batch.
+
+    Parameters
+    ----------
+        lens (numpy.ndarray). The length of each word of all paragraphs.
+
+        first_words (numpy.ndarray). The index of the first word of each
+        paragraph.
+
+        last_words (numpy.ndarray). The index one past the last word of each
+        paragraph.
+
+        max_line_len (int). The maximum length (i.e. number of columns) for each
+        line.
+
+    Returns
+    -------
+        line_starts (numpy.ndarray). The index of the first word of each line,
+        ordered by paragraph and then by line.
+
+        line_ends (numpy.ndarray). The index one past the last word of each
+        line, in the same order.
+    '''
+    ends = np.zeros(len(lens) + 1, dtype=np.int64)
+    np.cumsum(lens + 1, out=ends[1:])
+
+    starts = first_words
+    stops = last_words
+    line_starts = [np.zeros(0, dtype=np.int64)]
+    line_ends = [np.zeros(0, dtype=np.int64)]
+
+    while starts.size > 0:
+        # The line ends at the last word for which the prefix sum is within the
+        # max length, but it always has at least one word and it never goes
+        # beyond the end of its own paragraph
+        limits = ends[starts] + max_line_len + 1
+        line_stops = np.searchsorted(ends, limits, side='right') - 1
+        line_stops = np.minimum(np.maximum(line_stops, starts + 1), stops)
+
+        line_starts.append(starts)
+        line_ends.append(line_stops)
+
+        active = line_stops < stops
+        starts = line_stops[active]
+        stops = stops[active]
+
+    # The start of each line is a global word index, so sorting by it puts
+    # the lines back in the order of the paragraphs
+    line_starts = np.concatenate(line_starts)
+    line_ends = np.concatenate(line_ends)
+    order = np.argsort(line_starts, kind='stable')
+    return line_starts[order], line_ends[order]
+
+# ------------------------------------------------------------------------------
+def word_wrap_batch(texts, max_line_len=40, justify=False):
+    '''Wraps each text in the given list, producing the same results as
+    calling `word_wrap_text` for each one of them.
+
+    It is meant for large batches of short texts (like product descriptions
+    or messages), for which most of the cost would be the overhead of each
+    individual call. If NumPy is installed, the words of all texts are found
+    and their lines are broken at once with vectorised operations, leaving
+    only the building of the output lines to Python. Otherwise, each text is
+    simply wrapped with `word_wrap_text`.
+
+    Parameters
+    ----------
+        texts (list). The list of strings with the texts to be wrapped.
+
+        max_line_len (int). The max line length (i.e. max number of columns for
+        each line) to be considered when wrapping the texts. The default is 40.
+
+        justify (bool). An indication if the texts should be justified (True) or
+        not (False). Refer to `word_wrap_text` for details.
+
+    Returns
+    -------
+        wrapped_texts (list). The list of wrapped texts, in the same order of
+        the given texts.
+    '''
+    if np is None or len(texts) == 0:
+        return [word_wrap_text(text, max_line_len, justify) for text in texts]
+
+    # Join all texts in a single one, so each text starts a new paragraph, and
+    # find all separators in their code points
+    batch = '\n'.join(texts)
+    codes = np.frombuffer(batch.encode('utf-32-le', 'surrogatepass'),
+                          dtype=np.uint32)
+    separators = np.flatnonzero(np.isin(codes, _separator_codes()))
+
+    # The words are the (possibly empty) ranges between the separators, and
+    # the paragraphs end at the words followed by a line feed
+    word_starts = np.concatenate(([0], separators + 1))
+    word_ends = np.concatenate((separators, [len(codes)]))
+    lens = word_ends - word_starts
+    newlines = np.flatnonzero(codes[separators] == ord('\n'))
+    first_words = np.concatenate(([0], newlines + 1))
+    last_words = np.concatenate((newlines + 1, [len(word_starts)]))
+
+    line_starts, line_ends = _break_batch_lines(lens, first_words, last_words,
+                                                max_line_len)
+
+    # Lines made only of separators that are single spaces can be sliced
+    # directly from the text, and lines of an empty paragraph (i.e. a single
+    # empty word) must be kept empty
+    not_space = np.concatenate(([0], np.cumsum(codes[separators] != ord(' '))))
+    plain = not_space[line_ends - 1] == not_space[line_starts]
+    empty = np.zeros(len(lens), dtype=bool)
+    empty[first_words[(last_words - first_words == 1) &
+                      (lens[first_words] == 0)]] = True
+    empty = empty[line_starts]
+
+    lines = []
+    for start, end, plain_line, empty_line in zip(line_starts.tolist(),
+                                                  line_ends.tolist(),
+                                                  plain.tolist(),
+                                                  empty.tolist()):
+        if empty_line:
+            lines.append('')
+        elif plain_line and not justify:
+            lines.append(batch[word_starts[start]:word_ends[end - 1]])
+        else:
+            line = [batch[word_start:word_end] for word_start, word_end in
+                    zip(word_starts[start:end].tolist(),
+                        word_ends[start:end].tolist())]
+            if justify:
+                lines.append(_justify_line(line, max_line_len))
+            else:
+                lines.append(' '.join(line))
+
+    # Each text starts at the word just after its joining line feed, and its
+    # lines are the ones from the line starting at that word
+    offsets = list(accumulate((len(text) + 1 for text in texts[:-1]),
+                              initial=0))
+    text_words = np.searchsorted(word_starts, offsets)
+    text_lines = np.searchsorted(line_starts, text_words).tolist()
+    text_lines.append(len(lines))
+
+    return ['\n'.join(lines[first:last])
+            for first, last in zip(text_lines, text_lines[1:])]
+
+# ------------------------------------------------------------------------------
+def _split_chunks(text, num_chunks):
+    '''Splits the given text in about the given number of chunks, always
+    cutting at a line feed so no paragraph is shared by two chunks.
+
+    Parameters
+    ----------
+        text (str). The text to be split.
+
+        num_chunks (int). The desired number of chunks.
+
+    Returns
+    -------
+        chunks (list). A list of strings that, when joined with a line feed
+        character, produce the given text back.
+    '''
+    chunk_len = max(len(text) // num_chunks, 1)
+    chunks = []
+    start = 0
+    while True:
+        end = text.find('\n', start + chunk_len)
+        if end == -1:
+            chunks.append(text[start:])
+            return chunks
+        chunks.append(text[start:end])
+        start = end + 1
+
+# ------------------------------------------------------------------------------
+def parallel_word_wrap_text(text, max_line_len=40, justify=False, workers=None,
+                            min_parallel_len=PARALLEL_MIN_LEN,
+                            algorithm='greedy'):
+    '''Wraps the given text just like `word_wrap_text`, but distributing the
+    paragraphs among a pool of processes.
+
+    The text is split in chunks of whole paragraphs, each chunk is wrapped in a
+    worker process and the results are joined back in the original order, so
+    the output is exactly the same as the one of `word_wrap_text`.
+
+    Parameters
+    ----------
+        text (str). The text to be wrapped.
+
+        max_line_len (int). The max line length (i.e. max number of columns for
+        each line) to be considered when wrapping the text. The default is 40.
+
+        justify (bool). An indication if the text should be justified (True) or
+        not (False). Refer to `word_wrap_text` for details.
+
+        workers (int). The number of worker processes to use. The default is
+        None, in which case the number of CPUs in the machine is used.
+
+        min_parallel_len (int). The minimum text length for the process pool
+        to be used. Texts shorter than that (or with a single paragraph) are
+        wrapped serially. The default is `PARALLEL_MIN_LEN`.
+
+        algorithm (str). The line breaking algorithm. Refer to `word_wrap_text`
+        for details.
+
+    Returns
+    -------
+        wrapped_text (str). The text wrapped according to the parameters.
+    '''
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(text) < min_parallel_len or '\n' not in text:
+        return word_wrap_text(text, max_line_len, justify, None, algorithm)
+
+    # Use a few chunks per worker, so the load is balanced even if some
+    # paragraphs are much longer than others
+    chunks = _split_chunks(text, workers * 4)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(word_wrap_text, chunks, repeat(max_line_len),
+                               repeat(justify), repeat(None),
+                               repeat(algorithm))
+        return '\n'.join(results)
@@ -1,5 +1,15 @@
 import unittest
-from stringutils import word_wrap_text
+import sys
+import io
+import os
+import tempfile
+import random
+from stringutils import word_wrap_text, iter_wrap, parallel_word_wrap_text
+from stringutils import wrap_many_widths, word_wrap_batch, WrapCache
+from stringutils import wrap_file, WrappedDocument
+import stringutils
+from stringutils import _break_lines, _justify_line, _tokenize
+from stringutils import _break_lines_optimal
 
 # ==============================================================================
 class TestStringChallenge(unittest.TestCase):
@@ -93,6 +103,300 @@ class TestStringChallenge(unittest.TestCase):
                 output = word_wrap_text(self.lorem, max_line_len=i, justify=True)
                 self.assertEqual(output, self.lorem_output3)
 
+    # --------------------------------------------------------------------------
+    def test_break_lines(self):
+        '''Tests that the line breaking engine produces the expected word
+        boundaries, including for words longer than the max line length.'''
+
+        word_lens = [5, 3, 2, 12, 1, 1, 0, 4]
+        bounds = _break_lines(word_lens, 10)
+        self.assertEqual(bounds, [(0, 2), (2, 3), (3, 4), (4, 8)])
+        self.assertEqual(_break_lines([], 10), [])
+        self.assertEqual(_break_lines([2, 2], 0), [(0, 1), (1, 2)])
+
+    # --------------------------------------------------------------------------
+    def test_iter_wrap(self):
+        '''Tests that the streaming API produces the same lines as the regular
+        wrapping, both from a file object and from a list of paragraphs.'''
+
+        for justify in [False, True]:
+            with self.subTest(justify):
+                expected = word_wrap_text(self.lorem, 80, justify)
+
+                lines = iter_wrap(io.StringIO(self.lorem), 80, justify)
+                output = ''.join(line + '\n' for line in lines)
+                self.assertEqual(output, expected)
+
+                lines = iter_wrap(self.lorem.split('\n'), 80, justify)
+                self.assertEqual('\n'.join(lines), expected)
+
+    # --------------------------------------------------------------------------
+    def test_parallel_word_wrap_text(self):
+        '''Tests that the parallel wrapping produces exactly the same output as
+        the serial one, with and without the process pool.'''
+
+        text = '\n'.join([self.lorem, self.input] * 10)
+        for justify in [False, True]:
+            with self.subTest(justify):
+                expected = word_wrap_text(text, 80, justify)
+                output = parallel_word_wrap_text(text, 80, justify, workers=2,
+                                                 min_parallel_len=0)
+                self.assertEqual(output, expected)
+                output = parallel_word_wrap_text(text, 80, justify, workers=2)
+                self.assertEqual(output, expected)
+
+    # --------------------------------------------------------------------------
+    def test_justify_line(self):
+        '''Tests that the justification places the extra spaces as expected and
+        produces lines of the exact required length, even for large widths.'''
+
+        self.assertEqual(_justify_line(['a', 'b', 'c'], 7), 'a  b  c')
+        self.assertEqual(_justify_line(['a', 'b', 'c'], 8), 'a  b   c')
+        self.assertEqual(_justify_line(['a', 'b'], 4), 'a  b')
+        self.assertEqual(_justify_line(['ab'], 4), 'ab  ')
+        self.assertEqual(_justify_line([], 4), '')
+
+        words = ['w{}'.format(i) for i in range(12)]
+        for width in [100, 1000, 100000]:
+            with self.subTest(width):
+                line = _justify_line(words, width)
+                self.assertEqual(len(line), width)
+                self.assertEqual(line.split(), words)
+
+    # --------------------------------------------------------------------------
+    def test_wrap_many_widths(self):
+        '''Tests that wrapping in many widths at once produces the same output
+        as wrapping in each width separately.'''
+
+        widths = list(range(100)) * 2
+        justify = [False] * 100 + [True] * 100
+        outputs = wrap_many_widths(self.lorem, widths, justify)
+        for width, just, output in zip(widths, justify, outputs):
+            with self.subTest((width, just)):
+                expected = word_wrap_text(self.lorem, width, just)
+                self.assertEqual(output, expected)
+
+        self.assertEqual(wrap_many_widths(self.input, [40, 80], True),
+                         [self.output_part2, word_wrap_text(self.input, 80, True)])
+        self.assertEqual(wrap_many_widths('', [40]), [''])
+
+    # --------------------------------------------------------------------------
+    def test_tokenize(self):
+        '''Tests that the tokenizer finds the same words as splitting the text,
+        including the empty words between consecutive separators.'''
+
+        text = 'x\nab  (cd)+e\tf\ny'
+        starts, lens = _tokenize(text, 2, 14)
+        words = [text[start:start + size] for start, size in zip(starts, lens)]
+        self.assertEqual(words, ['ab', '', '', 'cd', '', 'e', 'f'])
+
+        starts, lens = _tokenize('word')
+        self.assertEqual((list(starts), list(lens)), ([0], [4]))
+
+    # --------------------------------------------------------------------------
+    def test_word_wrap_batch(self):
+        '''Tests that wrapping a batch of texts produces the same output as
+        wrapping each text separately, with and without NumPy.'''
+
+        texts = self.lorem.split('. ') + ['', '\n\n', self.input, 'a  b(c)']
+        numpy = stringutils.np
+        try:
+            for use_numpy in [True, False]:
+                if not use_numpy:
+                    stringutils.np = None
+                elif numpy is None:
+                    continue
+                for width, justify in [(0, False), (10, True), (40, False),
+                                       (80, True)]:
+                    with self.subTest((use_numpy, width, justify)):
+                        outputs = word_wrap_batch(texts, width, justify)
+                        expected = [word_wrap_text(text, width, justify)
+                                    for text in texts]
+                        self.assertEqual(outputs, expected)
+        finally:
+            stringutils.np = numpy
+
+        self.assertEqual(word_wrap_batch([]), [])
+
+    # --------------------------------------------------------------------------
+    def test_separator_codes(self):
+        '''Tests that the known whitespace ranges hold all the characters
+        matched by the separators pattern.'''
+
+        if stringutils.np is None:
+            self.skipTest('NumPy is not available')
+
+        all_chars = ''.join(map(chr, range(sys.maxunicode + 1)))
+        expected = [match.start() for match in
+                    stringutils._SEPARATORS.finditer(all_chars)]
+        self.assertEqual(list(stringutils._separator_codes()), expected)
+
+    # --------------------------------------------------------------------------
+    def test_wrap_cache(self):
+        '''Tests that the cache of paragraphs does not change the output, counts
+        the hits and misses and evicts the least recently used paragraphs.'''
+
+        cache = WrapCache(maxsize=100)
+        num_paragraphs = len([p for p in self.lorem.split('\n') if p])
+        for i in range(3):
+            with self.subTest(i):
+                output = word_wrap_text(self.lorem, 80, True, cache=cache)
+                self.assertEqual(output, self.lorem_output2)
+        self.assertEqual(cache.misses, num_paragraphs)
+        self.assertEqual(cache.hits, 2 * num_paragraphs)
+
+        lines = iter_wrap(self.lorem.split('\n'), 80, False, cache=cache)
+        self.assertEqual('\n'.join(lines), self.lorem_output1)
+
+        cache.resize(2)
+        self.assertEqual(len(cache), 2)
+        cache.wrap('a b c', 3, False)
+        self.assertEqual(cache.wrap('a b c', 3, False), ('a b', 'c'))
+        self.assertEqual(len(cache), 2)
+
+        cache.clear()
+        self.assertEqual((len(cache), cache.hits, cache.misses), (0, 0, 0))
+
+    # --------------------------------------------------------------------------
+    def test_wrap_file(self):
+        '''Tests that wrapping a file into another file produces the same text
+        as wrapping the file contents, including empty files and files with
+        Windows line endings.'''
+
+        with tempfile.TemporaryDirectory() as folder:
+            src_path = os.path.join(folder, 'input.txt')
+            dst_path = os.path.join(folder, 'output.txt')
+
+            for name, text, newline in [('lorem', self.lorem, '\n'),
+                                        ('crlf', self.input, '\r\n'),
+                                        ('empty', '', '\n'),
+                                        ('no_lf', 'a b\n\nc d', '\n')]:
+                with self.subTest(name):
+                    with open(src_path, mode='w', encoding='utf-8',
+                              newline=newline) as file:
+                        file.write(text)
+
+                    wrap_file(src_path, dst_path, 80, True)
+                    with open(dst_path, mode='r', encoding='utf-8',
+                              newline='') as file:
+                        output = file.read()
+                    self.assertEqual(output, word_wrap_text(text, 80, True))
+
+    # --------------------------------------------------------------------------
+    def test_optimal_wrap(self):
+        '''Tests that the optimal line breaking finds the same minimum cost (sum
+        of the squared slack of all lines but the last) as a naive dynamic
+        programming, and that it keeps the words and the line lengths.'''
+
+        def cost(lens, bounds, width):
+            return sum((width - sum(lens[start:end]) - (end - start - 1)) ** 2
+                       for start, end in bounds[:-1])
+
+        def naive_cost(lens, width):
+            costs = [0] + [float('inf')] * len(lens)
+            for end in range(1, len(lens) + 1):
+                for start in range(end):
+                    line_len = sum(lens[start:end]) + end - start - 1
+                    if line_len <= width:
+                        slack = 0 if end == len(lens) else width - line_len
+                        costs[end] = min(costs[end],
+                                         costs[start] + slack * slack)
+            return costs[-1]
+
+        for paragraph in self.input.split('\n'):
+            if paragraph == '':
+                continue
+            lens = [len(word) for word in paragraph.split(' ')]
+            for width in range(max(lens), 90, 7):
+                with self.subTest((paragraph[:10], width)):
+                    bounds = _break_lines_optimal(lens, width)
+                    self.assertEqual(cost(lens, bounds, width),
+                                     naive_cost(lens, width))
+                    greedy = _break_lines(lens, width)
+                    self.assertLessEqual(cost(lens, bounds, width),
+                                         cost(lens, greedy, width))
+
+        for justify in [False, True]:
+            with self.subTest(justify):
+                output = word_wrap_text(self.lorem, 80, justify,
+                                        algorithm='optimal')
+                self.assertEqual(output.split(), self.lorem.split())
+                for line in output.split('\n'):
+                    if justify and line:
+                        self.assertEqual(len(line), 80)
+                    else:
+                        self.assertLessEqual(len(line), 80)
+
+        output = word_wrap_text(self.lorem, 0, algorithm='optimal')
+        self.assertEqual(output, self.lorem_output3)
+
+        with self.assertRaises(ValueError):
+            word_wrap_text(self.lorem, algorithm='fastest')
+
+    # --------------------------------------------------------------------------
+    def test_wrapped_document(self):
+        '''Tests that the wrapped document re-wraps only the edited paragraphs
+        and keeps its wrapped text equal to the one of the whole text.'''
+
+        document = WrappedDocument(self.lorem, 80, True)
+        self.assertEqual(document.wrapped_text, self.lorem_output2)
+
+        text = self.lorem
+        first_lines = document.lines(0)
+        changed = document.replace(len(text) - 10, len(text) - 9, 'X\nY')
+        text = text[:len(text) - 10] + 'X\nY' + text[len(text) - 9:]
+        self.assertEqual(list(changed), [len(document) - 3, len(document) - 2])
+        self.assertIs(document.lines(0), first_lines)
+        self.assertEqual(document.text, text)
+        self.assertEqual(document.wrapped_text, word_wrap_text(text, 80, True))
+
+        changed = document.edit(0, 'In the beginning')
+        self.assertEqual(list(changed), [0])
+        self.assertEqual(document.lines(0),
+                         (word_wrap_text('In the beginning', 80, True),))
+        self.assertEqual(document.paragraph_at(0), 0)
+        self.assertEqual(document.paragraph_at(16), 0)
+        self.assertEqual(document.paragraph_at(17), 1)
+
+        document.replace(0, len(document.text), '')
+        self.assertEqual((len(document), document.wrapped_text), (1, ''))
+
+        with self.assertRaises(IndexError):
+            document.edit(1, 'out of range')
+
+    # --------------------------------------------------------------------------
+    def test_wrapped_document_blocks(self):
+        '''Tests that the blocks of paragraphs of the wrapped document keep the
+        offsets right while they are split and emptied by random edits.'''
+
+        block_size = stringutils._DOCUMENT_BLOCK_SIZE
+        rand = random.Random(0)
+        inserts = ['', 'x', '\n', 'a b\nc\n\nd', '   ']
+        try:
+            for size in [1, 2, 3]:
+                stringutils._DOCUMENT_BLOCK_SIZE = size
+                text = '\n'.join(self.input.split('\n')[:40])
+                document = WrappedDocument(text, 20)
+                for _ in range(300):
+                    start = rand.randint(0, len(text))
+                    end = min(len(text), start + rand.choice([0, 3, 30, 200]))
+                    insert = rand.choice(inserts)
+                    document.replace(start, end, insert)
+                    text = text[:start] + insert + text[end:]
+
+                    offset = rand.randint(0, len(text))
+                    with self.subTest((size, start, end, offset)):
+                        self.assertEqual(document.text, text)
+                        self.assertEqual(document.paragraph_at(offset),
+                                         text.count('\n', 0, offset))
+                self.assertEqual(document.wrapped_text,
+                                 word_wrap_text(text, 20))
+        finally:
+            stringutils._DOCUMENT_BLOCK_SIZE = block_size
+
+        with self.assertRaises(IndexError):
+            document.paragraph_at(len(text) + 1)
+
 # ==============================================================================
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file